@@ -0,0 +1,281 @@
+"""
+Whole-roster evaluation of fixed-hours categories with NumPy.
+
+Every staff member in a fixed category is judged against the same
+constants, so a day's punches are packed into one int64 array of seconds
+since midnight with per-staff offsets and evaluated in bulk. Results match
+attendance_rules.evaluate_day; hours-based categories, unusable rules and
+installs without NumPy go through the scalar path.
+"""
+from itertools import chain
+
+from attendance_rules import (
+    ABSENT, HALF_DAY_MINS, GRACE_MINS, Evaluation, evaluate_day, collapse_duplicates, removal_name, sorts_before_without
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Attendance codes ordered like the strings they stand for ('H' < 'I' < 'P')
+_H, _I, _P = 0, 1, 2
+_ATTENDANCE = ('H', 'I', 'P')
+
+
+def _pack(punch_lists):
+    """(t, starts, n): all punches in one array, each staff's offset into it and punch count."""
+    n = np.fromiter((len(p) for p in punch_lists), dtype=np.int64, count=len(punch_lists))
+    starts = np.zeros(len(punch_lists), dtype=np.int64)
+    if len(n) > 1:
+        np.cumsum(n[:-1], out=starts[1:])
+    t = np.fromiter(chain.from_iterable(punch_lists), dtype=np.int64, count=int(n.sum()))
+    return t, starts, n
+
+
+def _attendance(half_m, half_a):
+    return np.where(half_m & half_a, _I, np.where(half_m | half_a, _H, _P))
+
+
+def _fixed_multi(t, starts, n, rule, afternoon_checks):
+    """
+    Vector form of attendance_rules._fixed_multi for staff with two or more
+    punches. Returns (half_m, half_a, late, break_mins); late is unrounded.
+    """
+    count = len(n)
+    first = t[starts]
+    last = t[starts + n - 1]
+
+    late_in = (first - rule.start) / 60
+    is_late = first > rule.start
+    half_m = is_late & (late_in > HALF_DAY_MINS)
+    half_a = np.zeros(count, dtype=bool)
+    morning = np.where(is_late & ~half_m & (late_in >= GRACE_MINS), late_in, 0.0)
+    afternoon = np.zeros(count)
+
+    # Sorted punches: "none after in1" is just "last one at or before in1"
+    no_in1 = last <= rule.in1
+    half_m |= no_in1
+    morning[no_in1] = 0
+
+    # Out/in pairs at positions 1-2, 3-4, ... within each staff's slice
+    per_staff = (n - 1) // 2
+    owner = np.repeat(np.arange(count), per_staff)
+    pair = np.arange(len(owner)) - np.repeat(np.cumsum(per_staff) - per_staff, per_staff)
+    exit_index = starts[owner] + 1 + 2 * pair
+    exit_time = t[exit_index]
+    entry_time = t[exit_index + 1]
+
+    kept = exit_time <= rule.end
+    owner, exit_time, entry_time = owner[kept], exit_time[kept], entry_time[kept]
+    minutes = (entry_time - exit_time) / 60
+    valid_start = np.maximum(exit_time, rule.break_in)
+    valid_end = np.minimum(entry_time, rule.break_out)
+    valid = np.where(valid_start <= valid_end, (valid_end - valid_start) / 60, 0.0)
+
+    # Lunch break: longest valid part per staff, the earliest one on ties
+    candidates = np.flatnonzero(valid > 0)
+    order = np.lexsort((candidates, -valid[candidates], owner[candidates]))
+    ranked = candidates[order]
+    leading = np.ones(len(ranked), dtype=bool)
+    leading[1:] = owner[ranked][1:] != owner[ranked][:-1]
+    selected = ranked[leading]
+    is_selected = np.zeros(len(owner), dtype=bool)
+    is_selected[selected] = True
+
+    break_mins = np.zeros(count)
+    break_mins[owner[selected]] = valid[selected]
+
+    sel_exit, sel_entry = exit_time[selected], entry_time[selected]
+    overrun = (np.where(sel_exit < rule.break_in, (rule.break_in - sel_exit) / 60, 0.0)
+               + np.where(sel_entry > rule.break_out, (sel_entry - rule.break_out) / 60, 0.0))
+    in_morning = sel_exit <= rule.middle
+    np.add.at(morning, owner[selected][in_morning], overrun[in_morning])
+    np.add.at(afternoon, owner[selected][~in_morning], overrun[~in_morning])
+
+    others = ~is_selected
+    in_morning = exit_time <= rule.middle
+    np.add.at(morning, owner[others & in_morning], minutes[others & in_morning])
+    np.add.at(afternoon, owner[others & ~in_morning], minutes[others & ~in_morning])
+
+    over = morning > HALF_DAY_MINS
+    half_m |= over
+    morning[over] = 0
+    over = afternoon > HALF_DAY_MINS
+    half_a |= over
+    afternoon[over] = 0
+
+    if afternoon_checks:
+        no_out2 = last <= rule.out2
+        half_a |= no_out2
+        afternoon[no_out2] = 0
+
+        early = (rule.end - last) / 60
+        leaving = ~half_a & (last < rule.end)
+        too_early = leaving & (early > HALF_DAY_MINS)
+        half_a |= too_early
+        afternoon[too_early] = 0
+        afternoon[leaving & ~too_early] += early[leaving & ~too_early]
+
+    late = np.where(half_m & half_a, 0.0, morning + afternoon)
+    return half_m, half_a, late, break_mins
+
+
+def _fixed_single(punch, rule):
+    """Vector form of attendance_rules._fixed_single. Returns (half_m, half_a, late)."""
+    references = np.array([rule.start, rule.end, rule.in1, rule.out2])
+    closest = np.argmin(np.abs((punch[None, :] - references[:, None]) / 60), axis=0)
+    half_m = np.zeros(len(punch), dtype=bool)
+    half_a = np.zeros(len(punch), dtype=bool)
+    late = np.zeros(len(punch))
+
+    late_in = (punch - rule.start) / 60
+    counted = (closest == 0) & (punch > rule.start)
+    half_m |= counted & (late_in > HALF_DAY_MINS)
+    grace = counted & (late_in <= HALF_DAY_MINS) & (late_in >= GRACE_MINS)
+    late[grace] = late_in[grace]
+
+    early_in1 = (rule.in1 - punch) / 60
+    counted = (closest == 2) & (punch < rule.in1)
+    half_m |= counted & (early_in1 > HALF_DAY_MINS)
+    counted &= early_in1 <= HALF_DAY_MINS
+    late[counted] = early_in1[counted]
+
+    early_out = (rule.end - punch) / 60
+    counted = ((closest == 1) | (closest == 3)) & (punch < rule.end)
+    half_a |= counted & (early_out > HALF_DAY_MINS)
+    counted &= early_out <= HALF_DAY_MINS
+    late[counted] = early_out[counted]
+    return half_m, half_a, late
+
+
+def _time_str_keys(t):
+    """Integers that order seconds the way their attendance_rules.time_str strings sort."""
+    h, m, s = t // 3600, t % 3600 // 60, t % 60
+    # Character codes of 'H:MM:SS' (padded) or 'HH:MM:SS'
+    one_digit = [48 + h, 58, 48 + m // 10, 48 + m % 10, 58, 48 + s // 10, 48 + s % 10, 0 * h]
+    two_digits = [48 + h // 10, 48 + h % 10, 58, 48 + m // 10, 48 + m % 10, 58, 48 + s // 10, 48 + s % 10]
+    key = np.zeros_like(t)
+    for short, full in zip(one_digit, two_digits):
+        key = key * 64 + np.where(h < 10, short, full)
+    return key
+
+
+def _choose_odd(punch_lists, rule):
+    """
+    choose_removal for many odd punch sets: every set without each of its
+    punches is scored in one _fixed_multi pass per set size. Returns
+    (removal, remaining punches) per set, in order.
+    """
+    chosen = [None] * len(punch_lists)
+    by_size = {}
+    for i, punches in enumerate(punch_lists):
+        by_size.setdefault(len(punches), []).append(i)
+
+    for n, members in by_size.items():
+        sets = np.array([punch_lists[i] for i in members], dtype=np.int64)
+        # Row k of a set's candidates is the set without punch k
+        candidates = np.broadcast_to(sets[:, None, :], (len(members), n, n))[:, ~np.eye(n, dtype=bool)]
+        count = len(members) * n
+        half_m, half_a, late, _ = _fixed_multi(
+            candidates.ravel(), np.arange(count, dtype=np.int64) * (n - 1), np.full(count, n - 1, dtype=np.int64),
+            rule, afternoon_checks=False
+        )
+        # Fewest half days, then late minutes, then attendance, as _score_key orders them
+        keys = [half_m.astype(int) + half_a.astype(int), np.round(late, 6), _attendance(half_m, half_a)]
+        tied = np.ones(count, dtype=bool)
+        for key in keys:
+            key = np.where(tied, key, np.inf).reshape(len(members), n)
+            tied = (key == key.min(axis=1, keepdims=True)).ravel()
+        tied = tied.reshape(len(members), n)
+
+        # Same score: fall back to the time-string order the scalar path
+        # sorts by. Between two tied candidates the later one wins when the
+        # earlier one's punch sorts before its neighbour, so the first tied
+        # punch that sorts after its neighbour wins, else the last tied one.
+        text = _time_str_keys(sets)
+        after_next = np.zeros((len(members), n), dtype=bool)
+        after_next[:, :-1] = text[:, :-1] > text[:, 1:]
+        stop = tied & after_next
+        best = np.where(stop.any(axis=1), stop.argmax(axis=1), n - 1 - tied[:, ::-1].argmax(axis=1)).tolist()
+        # Equal neighbours compare further along; leave those to the scalar rule
+        for row in np.flatnonzero((text[:, :-1] == text[:, 1:]).any(axis=1)).tolist():
+            punches = punch_lists[members[row]]
+            tied_ks = np.flatnonzero(tied[row]).tolist()
+            best[row] = tied_ks[0]
+            for k in tied_ks[1:]:
+                if sorts_before_without(punches, k, best[row]):
+                    best[row] = k
+        for row, i in enumerate(members):
+            k, punches = best[row], punch_lists[i]
+            chosen[i] = (removal_name(k, n), list(punches[:k]) + list(punches[k + 1:]))
+    return chosen
+
+
+def evaluate_fixed_batch(punch_lists, rule, day_off=False):
+    """
+    evaluate_day for many staff sharing one valid fixed-category rule.
+
+    `punch_lists` are sorted seconds since midnight with flagged punches
+    and duplicates already removed. Returns one Evaluation (or None) per list, in order.
+    """
+    if day_off:
+        # Only the empty sets get a row on a holiday or Sunday
+        return [ABSENT if not punches else None for punches in punch_lists]
+
+    results = [None] * len(punch_lists)
+    odd = [i for i, p in enumerate(punch_lists) if len(p) % 2 == 1 and len(p) > 1]
+    removals = dict(zip(odd, _choose_odd([punch_lists[i] for i in odd], rule))) if odd else {}
+    multi, single = [], []
+    for i, punches in enumerate(punch_lists):
+        if not punches:
+            results[i] = ABSENT
+        elif len(punches) == 1:
+            single.append(i)
+        else:
+            multi.append(i)
+
+    def chosen(i):
+        return removals[i][1] if i in removals else punch_lists[i]
+
+    if multi:
+        t, starts, n = _pack([chosen(i) for i in multi])
+        half_m, half_a, late, break_mins = _fixed_multi(t, starts, n, rule, afternoon_checks=True)
+        attendance = _attendance(half_m, half_a)
+        late = np.where(late > 0, np.floor(late), late)
+        for j, i in enumerate(multi):
+            removal = removals[i][0] if i in removals else 'none'
+            results[i] = Evaluation(int(late[j]), _ATTENDANCE[attendance[j]], tuple(chosen(i)),
+                                    float(break_mins[j]), removal)
+
+    if single:
+        punch = np.fromiter((punch_lists[i][0] for i in single), dtype=np.int64, count=len(single))
+        half_m, half_a, late = _fixed_single(punch, rule)
+        # One punch never makes both halves, so there is no 'I' here
+        attendance = np.where(half_m | half_a, _H, _P)
+        late = np.where(late > 0, np.floor(late), late)
+        for j, i in enumerate(single):
+            results[i] = Evaluation(int(late[j]), _ATTENDANCE[attendance[j]], tuple(punch_lists[i]), 0, 'none')
+
+    return results
+
+
+def evaluate_roster(roster, rules, day_off=False):
+    """
+    Evaluate a whole day's roster, batching fixed categories when NumPy is
+    available. `roster` yields (staff_id, category_id, punches, flagged);
+    returns {staff_id: Evaluation or None} as evaluate_day would.
+    """
+    results = {}
+    batches = {}
+    for staff_id, category_id, punches, flagged in roster:
+        rule = rules.get(category_id)
+        if np is not None and rule is not None and rule.valid and rule.is_fixed:
+            batches.setdefault(category_id, []).append((staff_id, collapse_duplicates([t for t in punches if t not in flagged])))
+        else:
+            results[staff_id] = evaluate_day(punches, rule, flagged, day_off)
+
+    for category_id, members in batches.items():
+        evaluations = evaluate_fixed_batch([punches for _, punches in members], rules[category_id], day_off)
+        results.update(zip((staff_id for staff_id, _ in members), evaluations))
+    return results
@@ -0,0 +1,535 @@
+"""
+Attendance rules without database or console I/O.
+
+Punch times, flagged times and exemption windows are seconds since
+midnight; categories are compiled CategoryRule objects (see
+category_rules). Every function here only computes, so callers can batch,
+parallelise or benchmark the evaluation freely.
+"""
+import math
+import os
+from collections import namedtuple
+from functools import lru_cache, partial
+
+from intervals import IntervalIndex
+
+# Lateness beyond this many minutes in a session turns it into a half day
+HALF_DAY_MINS = 90
+# First-in lateness below this many minutes is forgiven
+GRACE_MINS = 16
+# Punches closer together than this are one capture seen twice; 0 keeps them all
+DUPLICATE_SECS = int(os.getenv("FACEMACHINE_DUPLICATE_PUNCH_SECS", "60"))
+
+Evaluation = namedtuple("Evaluation", [
+    "late_mins",
+    "attendance",
+    "pairing",      # the punches the result was computed from
+    "break_mins",
+    "removal",      # which punch was dropped from an odd set: 'last', 'center', its index, or 'none'
+])
+
+ABSENT = Evaluation(0, 'I', (), 0, 'none')
+
+
+# One entry per second of the day
+@lru_cache(maxsize=86400)
+def time_str(seconds):
+    """'H:MM:SS' as MySQL TIME values print, used to keep the old tie-break order."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def collapse_duplicates(punches, window=DUPLICATE_SECS):
+    """Sorted punches without those less than `window` seconds after the previous kept one."""
+    if window <= 0:
+        return list(punches)
+    kept = []
+    for t in punches:
+        if kept and t - kept[-1] < window:
+            continue
+        kept.append(t)
+    return kept
+
+
+def removal_name(k, n):
+    """How Evaluation.removal names dropping punch `k` of `n`."""
+    if k == n - 1:
+        return 'last'
+    if k == n // 2:
+        return 'center'
+    return str(k)
+
+
+def breaks_before_end(punches, rule):
+    """
+    (number, exit, entry, minutes, valid_minutes) for each out/in pair that
+    starts before the category's end time; valid minutes are the part that
+    falls inside the break window.
+    """
+    breaks = []
+    i = 1
+    while i < len(punches) - 1:
+        exit_time, entry_time = punches[i], punches[i + 1]
+        if exit_time <= rule.end:
+            valid_start = max(exit_time, rule.break_in)
+            valid_end = min(entry_time, rule.break_out)
+            valid = max(0, (valid_end - valid_start) / 60) if valid_start <= valid_end else 0
+            breaks.append((i // 2 + 1, exit_time, entry_time, (entry_time - exit_time) / 60, valid))
+        i += 2
+    return breaks
+
+
+def apply_breaks(morning, afternoon, breaks, rule, allowed_break=None):
+    """
+    Add break lateness to the running session totals.
+
+    The break with the longest valid part is the lunch break: only its
+    overrun outside the window counts (plus anything beyond `allowed_break`
+    when given). Every other break counts in full. Returns (morning,
+    afternoon, break_mins).
+    """
+    if not breaks:
+        return morning, afternoon, 0
+    break_mins = 0
+    valid_breaks = [b for b in breaks if b[4] > 0]
+    selected = max(valid_breaks, key=lambda b: b[4]) if valid_breaks else None
+    if selected:
+        break_mins = selected[4] if allowed_break is None else min(selected[4], allowed_break)
+        overrun = 0
+        if selected[1] < rule.break_in:
+            overrun += (rule.break_in - selected[1]) / 60
+        if selected[2] > rule.break_out:
+            overrun += (selected[2] - rule.break_out) / 60
+        if allowed_break is not None and selected[4] > allowed_break:
+            overrun += selected[4] - allowed_break
+        if overrun > 0:
+            if selected[1] <= rule.middle:
+                morning += overrun
+            else:
+                afternoon += overrun
+
+    for number, exit_time, _, minutes, _ in breaks:
+        if selected is None or number != selected[0]:
+            if exit_time <= rule.middle:
+                morning += minutes
+            else:
+                afternoon += minutes
+    return morning, afternoon, break_mins
+
+
+def _break_summary(exit_time, entry_time, rule, credit=None):
+    """
+    (morning, afternoon, selected) for one out/in pair, as apply_breaks
+    would see it, or None for a pair starting after the end time. `credit`
+    gives minutes of the gap that do not count (exempted time).
+    """
+    if exit_time > rule.end:
+        return None
+    minutes = (entry_time - exit_time) / 60
+    if credit is not None:
+        minutes -= credit(exit_time, entry_time)
+    valid_start = max(exit_time, rule.break_in)
+    valid_end = min(entry_time, rule.break_out)
+    valid = max(0, (valid_end - valid_start) / 60) if valid_start <= valid_end else 0
+    brk = (0, exit_time, entry_time, minutes, valid)
+    morning = exit_time <= rule.middle
+    return (minutes if morning else 0, 0 if morning else minutes, brk if valid > 0 else None)
+
+
+def _merge_breaks(earlier, later):
+    """Combine two break summaries; the lunch break is the longest valid one, the earliest on ties."""
+    if later is None:
+        return earlier
+    if earlier is None:
+        return later
+    selected = earlier[2]
+    if later[2] is not None and (selected is None or later[2][4] > selected[4]):
+        selected = later[2]
+    return earlier[0] + later[0], earlier[1] + later[1], selected
+
+
+def _apply_break_summary(morning, afternoon, summary, rule, allowed_break=None):
+    """apply_breaks on a break summary (None for no breaks) instead of the list of breaks."""
+    if summary is None:
+        return morning, afternoon, 0
+    break_morning, break_afternoon, selected = summary
+    break_mins = 0
+    if selected:
+        _, exit_time, entry_time, minutes, valid = selected
+        break_mins = valid if allowed_break is None else min(valid, allowed_break)
+        overrun = 0
+        if exit_time < rule.break_in:
+            overrun += (rule.break_in - exit_time) / 60
+        if entry_time > rule.break_out:
+            overrun += (entry_time - rule.break_out) / 60
+        if allowed_break is not None and valid > allowed_break:
+            overrun += valid - allowed_break
+        # The lunch break counts by its overrun only, not as a plain break
+        if exit_time <= rule.middle:
+            morning += overrun
+            break_morning -= minutes
+        else:
+            afternoon += overrun
+            break_afternoon -= minutes
+    return morning + break_morning, afternoon + break_afternoon, break_mins
+
+
+def drop_one(punches, rule, credit=None):
+    """
+    For every punch k of a sorted set, (k, first, last, breaks): the first
+    and last punch and the break summary of the set without punch k.
+
+    Dropping k keeps the out/in pairing before it and shifts the pairing
+    after it by one, so prefix sums over the original pairing and suffix
+    sums over the shifted one give every candidate in O(1) after two O(n)
+    passes, instead of a full evaluation per candidate.
+    """
+    n = len(punches)
+    # prefix[m]: pairs (j, j+1) with j odd and j + 1 < m; None for no breaks
+    prefix = [None, None]
+    summary = None
+    for m in range(2, n + 1):
+        if m % 2 == 1:
+            summary = _merge_breaks(summary, _break_summary(punches[m - 2], punches[m - 1], rule, credit))
+        prefix.append(summary)
+    # suffix[m]: pairs (j, j+1) with j even, j >= m and j + 1 < n
+    suffix = [None] * (n + 1)
+    summary = None
+    for m in range(n - 2, -1, -1):
+        if m % 2 == 0:
+            summary = _merge_breaks(_break_summary(punches[m], punches[m + 1], rule, credit), summary)
+        suffix[m] = summary
+
+    for k in range(n):
+        breaks = prefix[k]
+        if k % 2 == 0 and 2 <= k <= n - 2:
+            # The pair that closes over the dropped punch
+            breaks = _merge_breaks(breaks, _break_summary(punches[k - 1], punches[k + 1], rule, credit))
+        breaks = _merge_breaks(breaks, suffix[k + 1])
+        first = punches[1] if k == 0 else punches[0]
+        last = punches[-2] if k == n - 1 else punches[-1]
+        yield k, first, last, breaks
+
+
+def best_removal(punches, score, rule, credit=None):
+    """
+    The punch to drop from an odd set: the candidate with the lowest
+    score(first, last, breaks), falling back to the time-string order of
+    the remaining punches on ties. Returns (removal, remaining punches).
+    """
+    best = best_key = None
+    for k, first, last, breaks in drop_one(punches, rule, credit):
+        key = score(first, last, breaks)
+        if best is None or key < best_key or (key == best_key and sorts_before_without(punches, k, best)):
+            best, best_key = k, key
+    return removal_name(best, len(punches)), list(punches[:best]) + list(punches[best + 1:])
+
+
+def sorts_before_without(punches, later, earlier):
+    """
+    Whether the punches without `later` come before those without `earlier`
+    in time-string order. The two sets only differ between the two
+    positions, so the first unequal neighbours there decide.
+    """
+    for i in range(earlier, later):
+        a, b = time_str(punches[i]), time_str(punches[i + 1])
+        if a != b:
+            return a < b
+    return False
+
+
+class _Sessions:
+    """Morning/afternoon lateness and half-day state for one evaluation."""
+
+    def __init__(self, half_day_afternoon=False):
+        self.attendance = 'P'
+        self.half_day_morning = False
+        self.half_day_afternoon = half_day_afternoon
+        self.morning = 0
+        self.afternoon = 0
+
+    def morning_half_day(self):
+        self.half_day_morning = True
+        self.morning = 0
+        self.attendance = 'H'
+
+    def afternoon_half_day(self):
+        self.half_day_afternoon = True
+        self.afternoon = 0
+        self.attendance = 'H'
+
+    def check_first_in(self, first, start, covered=0):
+        if first > start:
+            late = (first - start) / 60 - covered
+            if late > HALF_DAY_MINS:
+                self.morning_half_day()
+            elif late >= GRACE_MINS:
+                self.morning += late
+
+    def check_early_out(self, last, end, covered=0):
+        if last < end:
+            early = (end - last) / 60 - covered
+            if early > HALF_DAY_MINS:
+                self.afternoon_half_day()
+            else:
+                self.afternoon += early
+
+    def check_totals(self):
+        if self.morning > HALF_DAY_MINS:
+            self.morning_half_day()
+        if self.afternoon > HALF_DAY_MINS:
+            self.afternoon_half_day()
+
+    def half_days(self):
+        return int(self.half_day_morning) + int(self.half_day_afternoon)
+
+    def late_mins(self):
+        if self.half_day_morning and self.half_day_afternoon:
+            self.attendance = 'I'
+            return 0
+        return self.morning + self.afternoon
+
+
+def _add_breaks(s, breaks, rule, allowed_break=None):
+    """Add break lateness from a list of breaks (apply_breaks) or a drop_one break summary."""
+    if isinstance(breaks, list):
+        s.morning, s.afternoon, break_mins = apply_breaks(s.morning, s.afternoon, breaks, rule, allowed_break)
+    else:
+        s.morning, s.afternoon, break_mins = _apply_break_summary(s.morning, s.afternoon, breaks, rule, allowed_break)
+    return break_mins
+
+
+def _fixed_sessions(first, last, breaks, rule, afternoon_checks):
+    """The fixed-category day given its first and last punch and its breaks (see _add_breaks)."""
+    s = _Sessions()
+    s.check_first_in(first, rule.start)
+    # Punches are sorted: "any punch after in1" is just the last one
+    if not last > rule.in1:
+        s.morning_half_day()
+    break_mins = _add_breaks(s, breaks, rule)
+    s.check_totals()
+    if afternoon_checks:
+        if not last > rule.out2:
+            s.afternoon_half_day()
+        if not s.half_day_afternoon:
+            s.check_early_out(last, rule.end)
+    return s, s.late_mins(), break_mins
+
+
+def _fixed_multi(punches, rule, afternoon_checks):
+    """Two or more punches against a fixed category. Returns (sessions, late_mins, break_mins)."""
+    return _fixed_sessions(punches[0], punches[-1], breaks_before_end(punches, rule), rule, afternoon_checks)
+
+
+def _score_key(s, late):
+    # Fewest half days, then fewest late minutes (rounded so summation order cannot split ties)
+    return s.half_days(), round(late, 6), s.attendance
+
+
+def _fixed_score(rule, first, last, breaks):
+    """
+    _score_key of _fixed_sessions without the afternoon checks for a
+    drop_one candidate, on plain locals since it runs once per punch.
+    """
+    half_m = half_a = False
+    morning = 0
+    if first > rule.start:
+        late = (first - rule.start) / 60
+        if late > HALF_DAY_MINS:
+            half_m = True
+        elif late >= GRACE_MINS:
+            morning = late
+    if not last > rule.in1:
+        half_m = True
+        morning = 0
+    morning, afternoon, _ = _apply_break_summary(morning, 0, breaks, rule)
+    if morning > HALF_DAY_MINS:
+        half_m = True
+        morning = 0
+    if afternoon > HALF_DAY_MINS:
+        half_a = True
+        afternoon = 0
+    if half_m and half_a:
+        return 2, 0, 'I'
+    return int(half_m) + int(half_a), round(morning + afternoon, 6), 'H' if half_m or half_a else 'P'
+
+
+def choose_removal(punches, rule):
+    """
+    The punch to drop from an odd set of two or more against a valid fixed
+    rule: the one leaving the fewest half days, then late minutes, judged
+    without the afternoon checks. Returns (removal, remaining punches).
+    """
+    return best_removal(punches, partial(_fixed_score, rule), rule)
+
+
+def _fixed_single(punch, rule):
+    """One punch against a fixed category: judge it against the nearest reference time."""
+    s = _Sessions()
+    references = [('in_time', rule.start), ('out_time', rule.end), ('in1', rule.in1), ('out2', rule.out2)]
+    closest = min(references, key=lambda ref: abs((punch - ref[1]) / 60))[0]
+    if closest == 'in_time':
+        s.check_first_in(punch, rule.start)
+    elif closest == 'in1' and punch < rule.in1:
+        early = (rule.in1 - punch) / 60
+        if early > HALF_DAY_MINS:
+            s.morning_half_day()
+        else:
+            s.morning = early
+    elif closest in ('out2', 'out_time') and punch < rule.end:
+        early = (rule.end - punch) / 60
+        if early > HALF_DAY_MINS:
+            s.afternoon_half_day()
+        else:
+            s.afternoon = early
+    return s, s.morning + s.afternoon
+
+
+def _hours(punches, rule):
+    """Punches against an hours-based category: the day runs `duration` from the first punch."""
+    s = _Sessions()
+    end = punches[0] + rule.duration
+    n = len(punches)
+    if n == 1:
+        if punches[0] < end:
+            early = (end - punches[0]) / 60
+            if early > HALF_DAY_MINS:
+                s.afternoon_half_day()
+            else:
+                s.afternoon = early
+        return s, s.afternoon, 0
+
+    s.check_early_out(punches[-1], end)
+    break_mins = 0
+    for i in range(1, n - 1, 2):
+        break_mins += (punches[i + 1] - punches[i]) / 60
+    if not s.half_day_afternoon and break_mins > rule.allowed_break:
+        s.afternoon += break_mins - rule.allowed_break
+    return s, s.afternoon, break_mins
+
+
+def evaluate_day(punches, rule, flagged=(), day_off=False):
+    """
+    Late minutes and attendance for one staff member's day.
+
+    `punches` are sorted seconds since midnight; any in `flagged` are
+    ignored. Returns an Evaluation, or None when nothing should be written:
+    no usable category rule, or a holiday/Sunday with punches to judge.
+    """
+    punches = collapse_duplicates([t for t in punches if t not in flagged])
+    removal = 'none'
+
+    if len(punches) % 2 == 1 and len(punches) > 1:
+        # Odd punch count: drop whichever punch costs the fewest half days,
+        # then late minutes.
+        if rule is None or not rule.valid or not rule.is_fixed:
+            return ABSENT
+        removal, punches = choose_removal(punches, rule)
+    elif not punches:
+        return ABSENT
+
+    if rule is None or not rule.valid or day_off:
+        return None
+
+    break_mins = 0
+    if rule.is_fixed:
+        if len(punches) == 1:
+            s, late = _fixed_single(punches[0], rule)
+        else:
+            s, late, break_mins = _fixed_multi(punches, rule, afternoon_checks=True)
+    else:
+        s, late, break_mins = _hours(punches, rule)
+
+    if late > 0:
+        late = math.floor(late)
+    return Evaluation(late, s.attendance, tuple(punches), break_mins, removal)
+
+
+def _fixed_exempt(punches, rule, windows, half_day_afternoon):
+    """
+    Two or more punches against a fixed category with part of the day
+    exempted. Exempted minutes inside a lateness, a break or an early exit
+    do not count towards it.
+    """
+    breaks = [(number, exit_time, entry_time, minutes - windows.covered_minutes(exit_time, entry_time), valid)
+              for number, exit_time, entry_time, minutes, valid in breaks_before_end(punches, rule)]
+    return _exempt_sessions(punches[0], punches[-1], breaks, rule, windows, half_day_afternoon)
+
+
+def _exempt_sessions(first, last, breaks, rule, windows, half_day_afternoon):
+    """The exempted fixed-category day given its first and last punch and its breaks (see _add_breaks)."""
+    s = _Sessions(half_day_afternoon)
+    # Lateness only counts when the exemption starts after the day does
+    if windows.start > rule.start:
+        s.check_first_in(first, rule.start, windows.covered_minutes(rule.start, first))
+    if not last > rule.in1:
+        s.morning_half_day()
+    break_mins = _add_breaks(s, breaks, rule, rule.allowed_break)
+    if not s.half_day_afternoon and not last > rule.out2:
+        s.afternoon_half_day()
+    if not s.half_day_afternoon:
+        s.check_early_out(last, rule.end, windows.covered_minutes(last, rule.end))
+    s.check_totals()
+    return s, s.late_mins(), break_mins
+
+
+def choose_exempt_removal(punches, rule, windows, half_day_afternoon):
+    """choose_removal for an exempted day, scored the way _fixed_exempt judges it."""
+    def score(first, last, breaks):
+        return _score_key(*_exempt_sessions(first, last, breaks, rule, windows, half_day_afternoon)[:2])
+    return best_removal(punches, score, rule, credit=windows.covered_minutes)
+
+
+def evaluate_exemption(punches, rule, window=None, flagged=()):
+    """
+    Late minutes and attendance for a day with an approved exemption.
+
+    `window` is the exempted (start, end) in seconds since midnight, an
+    IntervalIndex of every window the staff member has that day, or None
+    for a whole-day exemption. Returns an Evaluation, or None when the
+    category rule is unusable.
+    """
+    if window is None:
+        return Evaluation(0, 'P', (), 0, 'none')
+    if rule is None or not rule.valid:
+        return None
+
+    windows = window if isinstance(window, IntervalIndex) else IntervalIndex([window])
+    if not windows:
+        return None
+    punches, windows = windows.apply_to(collapse_duplicates([t for t in punches if t not in flagged]))
+
+    if rule.is_fixed:
+        if windows.covers_span(rule.start, rule.end):
+            return Evaluation(0, 'P', tuple(punches), 0, 'none')
+        # Without the afternoon exempted it starts out as a half day
+        half_day_afternoon = not windows.covers_span(rule.break_out, rule.end)
+
+        if not punches:
+            return ABSENT
+        if len(punches) % 2 == 1 and len(punches) > 1:
+            removal, punches = choose_exempt_removal(punches, rule, windows, half_day_afternoon)
+            s, late, break_mins = _fixed_exempt(punches, rule, windows, half_day_afternoon)
+            attendance = s.attendance
+        else:
+            late, attendance, break_mins, removal = 0, 'P', 0, 'none'
+
+        if late > 0:
+            late = math.ceil(late) if late - int(late) > 0.5 else math.floor(late)
+        return Evaluation(late, attendance, tuple(punches), break_mins, removal)
+
+    if not punches:
+        return ABSENT
+    day_end = punches[0] + rule.duration
+    n = len(punches)
+    break_mins = 0
+    for i in range(1, n - 1, 2):
+        break_mins += (punches[i + 1] - punches[i]) / 60
+    worked = (punches[-1] - punches[0]) / 60 - break_mins
+    late = max(0, (day_end - punches[0]) / 60 - worked)
+    attendance = 'P'
+    if punches[-1] < day_end and (day_end - punches[-1]) / 60 > HALF_DAY_MINS:
+        attendance, late = ('I', 0) if n == 1 else ('H', 0)
+    if late > 0:
+        late = math.floor(late)
+    return Evaluation(late, attendance, tuple(punches), break_mins, 'none')
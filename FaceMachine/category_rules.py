@@ -0,0 +1,108 @@
+import datetime
+import threading
+from collections import namedtuple
+
+# Category rows as stored: (category_id, category_description, in_time,
+# break_in, break_out, out_time, break_time_mins, type, in1, out2)
+FIXED_REQUIRED_COLUMNS = (2, 3, 4, 5, 6, 8, 9)
+
+CategoryRule = namedtuple("CategoryRule", [
+    "category_id",
+    "description",
+    "is_fixed",
+    "valid",        # False for 'fixed' rows with missing or unparsable times
+    "start",        # seconds since midnight, fixed categories only
+    "break_in",
+    "break_out",
+    "end",
+    "in1",
+    "out2",
+    "middle",       # halfway between break_in and break_out
+    "allowed_break",  # minutes
+    "duration",     # required hours for non-fixed categories, in seconds
+    "row",          # the original category row
+])
+
+
+def to_seconds(value):
+    """Seconds since midnight for a MySQL TIME (timedelta), datetime.time or 'HH:MM:SS' string."""
+    if isinstance(value, datetime.timedelta):
+        seconds = int(value.total_seconds())
+    elif isinstance(value, datetime.time):
+        seconds = value.hour * 3600 + value.minute * 60 + value.second
+    else:
+        parsed = datetime.datetime.strptime(str(value), "%H:%M:%S")
+        seconds = parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+    if not 0 <= seconds < 86400:
+        raise ValueError(f"time out of range: {value}")
+    return seconds
+
+
+def compile_category(row):
+    """Turn one category row into a CategoryRule, parsing its times once."""
+    is_fixed = row[7] == 'fixed'
+    start = break_in = break_out = end = in1 = out2 = middle = duration = None
+    valid = True
+    try:
+        allowed_break = int(row[6]) if row[6] is not None else 0
+    except (TypeError, ValueError):
+        allowed_break = 0
+        valid = not is_fixed
+
+    if is_fixed:
+        if not all(row[i] for i in FIXED_REQUIRED_COLUMNS):
+            valid = False
+        else:
+            try:
+                start, break_in, break_out, end, in1, out2 = (
+                    to_seconds(row[i]) for i in (2, 3, 4, 5, 8, 9)
+                )
+                middle = break_in + (break_out - break_in) / 2
+            except (TypeError, ValueError):
+                valid = False
+    else:
+        try:
+            # Only the hours and minutes of out_time count towards the required span
+            out_time = to_seconds(row[5])
+            duration = out_time - out_time % 60
+        except (TypeError, ValueError):
+            valid = False
+
+    return CategoryRule(row[0], row[1], is_fixed, valid, start, break_in, break_out, end,
+                        in1, out2, middle, allowed_break, duration, tuple(row))
+
+
+def compile_categories(rows):
+    """{category_id: CategoryRule} for a list of category rows."""
+    return {row[0]: compile_category(row) for row in rows}
+
+
+_cache = {"signature": None, "rules": None}
+_cache_lock = threading.Lock()
+
+
+def load_category_rules(cursor):
+    """
+    Compiled rules for every category, reusing the cached set while the
+    category table's checksum is unchanged.
+    """
+    cursor.execute("CHECKSUM TABLE category")
+    row = cursor.fetchone()
+    signature = row[1] if row else None
+
+    with _cache_lock:
+        if signature is not None and signature == _cache["signature"]:
+            return _cache["rules"]
+
+    cursor.execute("SELECT * FROM category")
+    rules = compile_categories(cursor.fetchall())
+    with _cache_lock:
+        _cache["signature"] = signature
+        _cache["rules"] = rules
+    return rules
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache["signature"] = None
+        _cache["rules"] = None
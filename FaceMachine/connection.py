@@ -1,72 +1,366 @@
 import mysql.connector
-import datetime 
+import datetime
+import os
+import queue
+import threading
+import time
+from bisect import insort
+
+from punch_debounce import DEBOUNCE_SECS, ensure_collapse_table, match_punch, record_collapses
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+except ImportError:
+    pass
+
+INSERT_CHUNK_SIZE = 1000
+# Batches with at most this many staff members (a live punch, one device
+# pull) read only their own staff and logs rows
+STAFF_FILTER_LIMIT = 100
+
+# Pool settings, overridable from the FaceMachine .env
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+# Connections older than this many seconds are closed instead of reused
+POOL_RECYCLE_SECS = int(os.getenv("DB_POOL_RECYCLE_SECS", "3600"))
+# Connections idle for longer than this are pinged before reuse; 0 pings on
+# every checkout and a negative value turns the health check off
+POOL_PING_SECS = int(os.getenv("DB_POOL_PING_SECS", "30"))
+POOL_TIMEOUT_SECS = int(os.getenv("DB_POOL_TIMEOUT_SECS", "30"))
+
+
+def db_config():
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "user": os.getenv("DB_USER", "root"),
+        "password": os.getenv("DB_PASS", ""),
+        "database": os.getenv("DB_NAME", "faculty_data_logs"),
+        "use_pure": True,
+    }
+
+
+class PooledConnection:
+    """
+    A checked-out pool connection. Behaves like the underlying MySQL
+    connection, except that close() (or leaving a `with` block) hands it
+    back to the pool instead of closing the socket.
+    """
+
+    def __init__(self, pool, cnx, created):
+        self._pool = pool
+        self._cnx = cnx
+        self._created = created
+
+    def __getattr__(self, name):
+        if self._cnx is None:
+            raise mysql.connector.errors.OperationalError("Connection already returned to the pool")
+        return getattr(self._cnx, name)
+
+    def close(self):
+        if self._cnx is not None:
+            self._pool.release(self._cnx, self._created)
+            self._cnx = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._cnx is not None:
+            try:
+                self._cnx.rollback()
+            except mysql.connector.Error:
+                self._pool.discard(self._cnx)
+                self._cnx = None
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """Thread-safe pool of MySQL connections with age recycling and idle health checks."""
+
+    def __init__(self, size=POOL_SIZE, recycle_secs=POOL_RECYCLE_SECS, ping_secs=POOL_PING_SECS,
+                 timeout_secs=POOL_TIMEOUT_SECS, **config):
+        self.size = max(1, size)
+        self.recycle_secs = recycle_secs
+        self.ping_secs = ping_secs
+        self.timeout_secs = timeout_secs
+        self.config = config or db_config()
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def _reserve(self):
+        with self._lock:
+            if self._open < self.size:
+                self._open += 1
+                return True
+            return False
+
+    def _new_connection(self):
+        try:
+            cnx = mysql.connector.connect(**self.config)
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+        return cnx, time.monotonic()
+
+    def _healthy(self, cnx, created, last_used):
+        now = time.monotonic()
+        if self.recycle_secs > 0 and now - created > self.recycle_secs:
+            return False
+        if self.ping_secs >= 0 and now - last_used >= self.ping_secs:
+            try:
+                cnx.ping(reconnect=False)
+            except mysql.connector.Error:
+                return False
+        return True
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout_secs
+        while True:
+            try:
+                cnx, created, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve():
+                    return PooledConnection(self, *self._new_connection())
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise mysql.connector.errors.PoolError("Timed out waiting for a pooled connection")
+                try:
+                    cnx, created, last_used = self._idle.get(timeout=min(remaining, 1))
+                except queue.Empty:
+                    continue
+
+            if self._healthy(cnx, created, last_used):
+                return PooledConnection(self, cnx, created)
+            self.discard(cnx)
+
+    def release(self, cnx, created):
+        try:
+            # End any open transaction so the next user does not see a stale snapshot
+            if cnx.in_transaction:
+                cnx.rollback()
+        except mysql.connector.Error:
+            self.discard(cnx)
+            return
+        self._idle.put((cnx, created, time.monotonic()))
+
+    def discard(self, cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process-wide pool, recreated after a fork so children never share sockets."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool()
+        return _pool
+
+
+def get_connection():
+    """
+    Check a connection out of the process-wide pool. Use it as a context
+    manager; an exception inside the block rolls the transaction back:
+
+        with get_connection() as conn:
+            ...
+    """
+    return get_pool().acquire()
+
 
 def db():
+    """Pooled connection, or None when the database is unreachable. close() returns it to the pool."""
     try:
-        mydb = mysql.connector.connect(
-                host="localhost",
-                user="root",
-                password="$bio#2025",
-                database="faculty_data_logs",
-                use_pure=True   
-            )
-        return mydb
+        return get_connection()
     except mysql.connector.Error as err:
         print(f"Error: {err}")
         return None
 
 
-
-def check_log_info(log,date1):
-    if not log.user_id or not log.timestamp:
-        # print(f"Log missing user_id or timestamp: {log}")
-        return False
-
+def log_datetime(log):
     # Fix: handle both str and datetime.datetime
     if isinstance(log.timestamp, str):
-        dt = datetime.datetime.strptime(log.timestamp, "%Y-%m-%d %H:%M:%S")
-    else:
-        dt = log.timestamp
-
-    date_value = dt.date()
-    time_value = dt.time()
-    
-    if date1:
-        
-        if str(date_value) != str(date1):
-            
-            return False
-    else:
-        if date_value < datetime.datetime.now().date():
-            return False
+        return datetime.datetime.strptime(log.timestamp, "%Y-%m-%d %H:%M:%S")
+    return log.timestamp
+
+
+def _seconds(value):
+    """Seconds since midnight for a datetime.time or a MySQL TIME (timedelta)."""
+    if isinstance(value, datetime.timedelta):
+        return int(value.total_seconds())
+    return value.hour * 3600 + value.minute * 60 + value.second
 
-    mydb = db()
-    cursor = mydb.cursor()
 
-    # Fix: Use SELECT to check for existing log
-    select_query = """
-        SELECT staff_id FROM logs
-        WHERE staff_id = %s AND time = %s AND date = %s
+def new_result():
+    return {"inserted": 0, "duplicate": 0, "collapsed": 0, "unknown_staff": 0, "skipped": 0, "dates": []}
+
+
+def log_rows(logs, date1, date_range=None, result=None):
+    """
+    (staff_id, time, date) rows for the device records that pass the date
+    filter of ingest_logs; records without a user or timestamp and those
+    outside the filter are counted in result["skipped"].
     """
-    cursor.execute(select_query, (log.user_id, time_value, date_value))
-    fetch_result = cursor.fetchall()
+    result = result if result is not None else new_result()
+    today = datetime.datetime.now().date()
+
+    rows = []
+    for log in logs:
+        if not log.user_id or not log.timestamp:
+            result["skipped"] += 1
+            continue
+
+        dt = log_datetime(log)
+        date_value = dt.date()
+        if date_range is not None:
+            first, last = date_range
+            if (first and date_value < first) or (last and date_value > last):
+                result["skipped"] += 1
+                continue
+        elif date1:
+            if str(date_value) != str(date1):
+                result["skipped"] += 1
+                continue
+        elif date_value < today:
+            result["skipped"] += 1
+            continue
+
+        rows.append((str(log.user_id), dt.time().replace(microsecond=0), date_value))
+    return rows
+
+
+def ingest_logs(logs, date1, connection=None, date_range=None):
+    """
+    Insert a batch of device attendance records into the logs table.
+
+    Records are filtered to `date1` (or today onwards when empty), or to
+    `date_range` when given: a (first, last) pair of dates, None leaving that
+    end open. The remaining records, whatever their date, are checked
+    against the staff table and existing logs in memory, and the new rows are
+    written in chunks inside a single transaction. A punch less than
+    DEBOUNCE_SECS after the one the evaluation keeps before it that day, from
+    any device, is collapsed into it and counted in log_collapses. Pass
+    `connection` to reuse a connection the caller already holds instead of
+    checking one out. Returns a dict with inserted, duplicate, collapsed,
+    unknown_staff and skipped counts, and under "dates" the dates that
+    received new punches.
+    """
+    result = new_result()
+    rows = log_rows(logs, date1, date_range, result)
+    return ingest_rows(rows, connection, result)
+
+
+_collapse_table = {"ensured": False}
+
+
+def ingest_rows(rows, connection=None, result=None):
+    """Insert (staff_id, time, date) rows as ingest_logs does; returns the same summary."""
+    result = result if result is not None else new_result()
+    if not rows:
+        return result
+
+    if connection is not None:
+        _insert_log_rows(connection, rows, result)
+        return result
+
+    try:
+        mydb = get_connection()
+    except mysql.connector.Error as err:
+        print(f"Database connection failed: {err}")
+        result["error"] = "Database connection failed"
+        return result
+
+    with mydb:
+        _insert_log_rows(mydb, rows, result)
+    return result
+
+
+def _insert_log_rows(mydb, rows, result):
+    cursor = mydb.cursor()
+    try:
+        if not _collapse_table["ensured"]:
+            # Once per process, before the ingest transaction: CREATE TABLE commits implicitly
+            ensure_collapse_table(cursor)
+            mydb.commit()
+            _collapse_table["ensured"] = True
+        staff_ids = sorted({staff_id for staff_id, _, _ in rows})
+        dates = sorted({date_value for _, _, date_value in rows})
+        placeholders = ", ".join(["%s"] * len(dates))
+        if len(staff_ids) <= STAFF_FILTER_LIMIT:
+            staff_placeholders = ", ".join(["%s"] * len(staff_ids))
+            cursor.execute(f"SELECT staff_id FROM staff WHERE staff_id IN ({staff_placeholders})", tuple(staff_ids))
+            known_staff = {str(staff_id) for (staff_id,) in cursor.fetchall()}
+            cursor.execute(
+                f"SELECT staff_id, time, date FROM logs WHERE date IN ({placeholders}) AND staff_id IN ({staff_placeholders})",
+                tuple(dates) + tuple(staff_ids)
+            )
+        else:
+            cursor.execute("SELECT staff_id FROM staff")
+            known_staff = {str(staff_id) for (staff_id,) in cursor.fetchall()}
+            cursor.execute(
+                f"SELECT staff_id, time, date FROM logs WHERE date IN ({placeholders})",
+                tuple(dates)
+            )
+        # Sorted punch seconds per staff-day, existing and accepted so far
+        stored = {}
+        for staff_id, time_value, date_value in cursor.fetchall():
+            stored.setdefault((str(staff_id), date_value), []).append(_seconds(time_value))
+        for punches in stored.values():
+            punches.sort()
+
+        new_rows = []
+        unknown = set()
+        collapsed = {}
+        # Earliest first, so the first punch of a burst is the one kept
+        for staff_id, time_value, date_value in sorted(rows, key=lambda row: (row[0], row[2], _seconds(row[1]))):
+            if staff_id not in known_staff:
+                result["unknown_staff"] += 1
+                unknown.add(staff_id)
+                continue
+            day = stored.setdefault((staff_id, date_value), [])
+            t = _seconds(time_value)
+            match = match_punch(day, t, DEBOUNCE_SECS)
+            if match:
+                result[match] += 1
+                if match == 'collapsed':
+                    collapsed[(staff_id, date_value)] = collapsed.get((staff_id, date_value), 0) + 1
+                continue
+            insort(day, t)
+            new_rows.append((staff_id, time_value, date_value))
+
+        if unknown:
+            print("Users not added to the staff table. User IDs: ", sorted(unknown))
+        record_collapses(cursor, collapsed)
+
+        insert_query = "INSERT IGNORE INTO logs (staff_id, time, date) VALUES (%s, %s, %s)"
+        for start in range(0, len(new_rows), INSERT_CHUNK_SIZE):
+            cursor.executemany(insert_query, new_rows[start:start + INSERT_CHUNK_SIZE])
+            result["inserted"] += cursor.rowcount
+        result["duplicate"] += len(new_rows) - result["inserted"]
 
-    if fetch_result:
-        # print(f"Log already exists for User ID: {log.user_id}, Timestamp: {log.timestamp}")
-        return False
-    else:
-        # print(f"Log does not exist, inserting: User ID: {log.user_id}, Timestamp: {log.timestamp}")
-        find_query = "SELECT * FROM staff WHERE staff_id = %s"
-        cursor.execute(find_query, (log.user_id,))
-        find_result = cursor.fetchall()
-        if not find_result:
-            print("User is not added to the staff table. User ID: ", log.user_id)
-            return False
-        insert_query = """
-            INSERT INTO logs (staff_id, time, date)
-            VALUES (%s, %s, %s)
-        """
-        cursor.execute(insert_query, (log.user_id, time_value, date_value))
         mydb.commit()
-        return True
-    
+        result["dates"] = sorted({str(date_value) for _, _, date_value in new_rows})
+    except mysql.connector.Error as err:
+        print(f"Error ingesting logs: {err}")
+        mydb.rollback()
+        result["inserted"] = 0
+        result["error"] = str(err)
+    finally:
+        cursor.close()
+
+
+def check_log_info(log,date1):
+    """Insert a single device record; kept for callers that work per punch."""
+    return ingest_logs([log], date1)["inserted"] == 1
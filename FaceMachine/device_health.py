@@ -0,0 +1,255 @@
+"""
+Per-device connection health.
+
+Every connect to a device goes through the registry, which keeps per IP
+a moving average of the connect latency, the current failure streak and
+the last success and failure. After FAILURE_THRESHOLD failures in a row
+the device's circuit opens: callers skip it without touching the network,
+and only one probe is let through every probe interval, which doubles
+after each failed probe up to PROBE_MAX_SECS. A successful connect closes
+the circuit again. The reachability check before each connect has a
+timeout sized from the observed latency, between TIMEOUT_MIN_SECS and
+TIMEOUT_MAX_SECS (the fixed 5 seconds used before), so a device known to
+answer quickly fails fast when it stops; the session keeps the full
+timeout. Failures on an open session are recorded as well.
+
+The state is kept in a JSON snapshot next to this file, so the worker,
+the poller and one-shot scripts share it: every update re-reads the
+snapshot under a file lock, changes the device's entry and writes it
+back, and queries reload it when another process has saved it since.
+"""
+import contextlib
+import json
+import math
+import os
+import socket
+import threading
+import time
+
+from file_lock import FileLock
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HEALTH_PATH = os.getenv("FACEMACHINE_DEVICE_HEALTH_PATH", os.path.join(BASE_DIR, "device_health.json"))
+PORT = 4370
+
+FAILURE_THRESHOLD = int(os.getenv("FACEMACHINE_DEVICE_FAILURES", "3"))
+PROBE_SECS = int(os.getenv("FACEMACHINE_DEVICE_PROBE_SECS", "300"))
+PROBE_MAX_SECS = int(os.getenv("FACEMACHINE_DEVICE_PROBE_MAX_SECS", "3600"))
+TIMEOUT_MAX_SECS = float(os.getenv("FACEMACHINE_DEVICE_TIMEOUT_SECS", "5"))
+TIMEOUT_MIN_SECS = float(os.getenv("FACEMACHINE_DEVICE_TIMEOUT_MIN_SECS", "2"))
+# Reachability timeout as a multiple of the average connect latency
+TIMEOUT_FACTOR = 4
+# Weight of the newest sample in the latency average
+LATENCY_ALPHA = 0.3
+
+
+class DeviceUnavailable(Exception):
+    """Raised instead of connecting while a device's circuit is open."""
+
+
+def _new_entry(probe_secs=PROBE_SECS):
+    return {
+        "latency": None,
+        "failures": 0,
+        "last_success": None,
+        "last_failure": None,
+        "last_error": None,
+        "next_probe": None,
+        "probe_secs": probe_secs,
+    }
+
+
+class DeviceHealth:
+    def __init__(self, path=HEALTH_PATH, failure_threshold=FAILURE_THRESHOLD, probe_secs=PROBE_SECS,
+                 probe_max_secs=PROBE_MAX_SECS, timeout_min=TIMEOUT_MIN_SECS, timeout_max=TIMEOUT_MAX_SECS):
+        self.path = path
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_secs = probe_secs
+        self.probe_max_secs = max(probe_secs, probe_max_secs)
+        self.timeout_min = timeout_min
+        self.timeout_max = max(timeout_min, timeout_max)
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path + ".lock") if path else None
+        self._devices = {}
+        # (mtime, size) of the snapshot as last read or written by this process
+        self._signature = None
+        with self._lock:
+            self._load_snapshot()
+
+    # ---- Snapshot ----
+    def _snapshot_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_snapshot(self, force=False):
+        """
+        Merge the snapshot into the in-memory state, unless it is unchanged
+        since this process last read or wrote it. Caller holds self._lock.
+        """
+        if not self.path:
+            return
+        signature = self._snapshot_signature()
+        if signature is None or (not force and signature == self._signature):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self._devices.update({ip: dict(_new_entry(self.probe_secs), **entry) for ip, entry in data.items()})
+            self._signature = signature
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print(f"Ignoring unreadable device health snapshot {self.path}: {e}")
+
+    def _save_snapshot(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._devices, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._signature = self._snapshot_signature()
+        except OSError as e:
+            print(f"Could not write device health snapshot {self.path}: {e}")
+
+    @contextlib.contextmanager
+    def _updating(self):
+        """
+        Hold the locks for one read-modify-write of the snapshot, so changes
+        made by other processes since it was last read are kept.
+        """
+        with self._lock, self._file_lock or contextlib.nullcontext():
+            self._load_snapshot(force=True)
+            yield
+            self._save_snapshot()
+
+    def _entry(self, ip):
+        return self._devices.setdefault(ip, _new_entry(self.probe_secs))
+
+    # ---- Queries ----
+    def is_open(self, ip):
+        entry = self._devices.get(ip)
+        return entry is not None and entry["failures"] >= self.failure_threshold
+
+    def allow(self, ip):
+        """
+        Whether to try connecting to `ip` now. While the circuit is open this
+        is True once per probe interval, for a single probe.
+        """
+        with self._lock:
+            self._load_snapshot()
+            if not self.is_open(ip):
+                return True
+        with self._updating():
+            if not self.is_open(ip):
+                return True
+            entry = self._entry(ip)
+            now = time.time()
+            if entry["next_probe"] is not None and now < entry["next_probe"]:
+                return False
+            # Claim the probe so concurrent callers, in any process, keep skipping the device
+            entry["next_probe"] = now + entry["probe_secs"]
+            return True
+
+    def timeout(self, ip):
+        """Reachability check timeout in seconds for `ip`, from its average latency."""
+        entry = self._devices.get(ip)
+        if not entry or entry["latency"] is None:
+            return self.timeout_max
+        timeout = math.ceil(entry["latency"] * TIMEOUT_FACTOR * 10) / 10
+        return max(self.timeout_min, min(self.timeout_max, timeout))
+
+    def status(self, ip=None):
+        """A copy of the health entry for `ip`, or of every device, with "open" added."""
+        with self._lock:
+            self._load_snapshot()
+            ips = [ip] if ip is not None else sorted(self._devices)
+            report = {
+                device: dict(self._devices.get(device) or _new_entry(self.probe_secs), open=self.is_open(device))
+                for device in ips
+            }
+        return report[ip] if ip is not None else report
+
+    # ---- Updates ----
+    def record_success(self, ip, latency):
+        with self._updating():
+            entry = self._entry(ip)
+            if entry["latency"] is None:
+                entry["latency"] = round(latency, 3)
+            else:
+                entry["latency"] = round(LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * entry["latency"], 3)
+            if self.is_open(ip):
+                print(f"Device {ip} is reachable again, closing its circuit")
+            entry.update(failures=0, last_success=time.time(), next_probe=None, probe_secs=self.probe_secs)
+
+    def record_failure(self, ip, error):
+        with self._updating():
+            entry = self._entry(ip)
+            was_open = self.is_open(ip)
+            entry["failures"] += 1
+            entry["last_failure"] = time.time()
+            entry["last_error"] = str(error)
+            if was_open:
+                entry["probe_secs"] = min(entry["probe_secs"] * 2, self.probe_max_secs)
+            if self.is_open(ip):
+                entry["next_probe"] = entry["last_failure"] + entry["probe_secs"]
+                if not was_open:
+                    print(f"Device {ip} failed {entry['failures']} times in a row, probing it every {entry['probe_secs']}s")
+
+    # ---- Connecting ----
+    def connect(self, ip, port=PORT, force=False):
+        """
+        Connect to a device, recording the outcome. Reachability is checked
+        first with a plain TCP connect whose timeout is sized from the
+        device's latency; the pyzk session itself keeps the full
+        TIMEOUT_MAX_SECS, since pyzk uses it for every later call on the
+        socket (downloads included). Raises DeviceUnavailable while the
+        circuit is open, unless `force` (an explicit connection test), and
+        whatever the connect raises when it fails.
+        """
+        if not force and not self.allow(ip):
+            entry = self._devices[ip]
+            raise DeviceUnavailable(
+                f"Device {ip} skipped after {entry['failures']} failed connects "
+                f"(last error: {entry['last_error']}); next probe in {max(0, int((entry['next_probe'] or 0) - time.time()))}s"
+            )
+        from zk import ZK
+
+        started = time.monotonic()
+        try:
+            socket.create_connection((ip, port), timeout=self.timeout(ip)).close()
+            latency = time.monotonic() - started
+            conn = ZK(ip, port=port, timeout=self.timeout_max, password=0, force_udp=False, ommit_ping=False).connect()
+        except Exception as e:
+            self.record_failure(ip, e)
+            raise
+        if not conn:
+            self.record_failure(ip, "connect returned no connection")
+            raise ConnectionError(f"Could not connect to {ip}")
+        self.record_success(ip, latency)
+        return conn
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The process-wide DeviceHealth, created on first use."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DeviceHealth()
+        return _registry
+
+
+def connect_device(ip, port=PORT, force=False):
+    """Connect to `ip` through the process-wide health registry; see DeviceHealth.connect."""
+    return get_registry().connect(ip, port, force)
+
+
+def record_session_failure(ip, error):
+    """Record a failure on an open session (a download, a user write) against `ip`."""
+    get_registry().record_failure(ip, f"Session failed: {error}")
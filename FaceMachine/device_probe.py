@@ -0,0 +1,129 @@
+"""
+Connection test for the eSSL devices.
+
+Connects to every device in the devices table at once and reports, per
+device, the connect time, the round-trip latency (median of a few
+read_sizes calls on the open connection), the firmware version and the
+user, face, fingerprint and record counts the device holds. Each device
+gets its own thread, so the whole fleet takes about as long as the
+slowest device. Probes always try to connect, even to devices whose
+circuit is open, and their outcome updates the device health registry.
+While the database is down the active devices come from the poller's
+device cache, by IP only.
+
+    python device_probe.py       -> active devices
+    python device_probe.py all   -> including devices in maintenance
+"""
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mysql.connector
+
+from connection import get_connection
+from device_health import PORT, connect_device, get_registry, record_session_failure
+
+# read_sizes round trips timed per device
+LATENCY_SAMPLES = 3
+MAX_PROBE_THREADS = 64
+
+
+def load_devices(include_maintenance=False):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            query = "SELECT device_id, ip_address, device_name, device_location, maintenance FROM devices"
+            if include_maintenance:
+                cursor.execute(query)
+            else:
+                cursor.execute(query + " WHERE maintenance = %s", (0,))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+def cached_devices():
+    """load_devices rows for the active devices in the poller's device cache, by IP only; [] without one."""
+    from get_attendance_list import load_device_cache
+
+    cached = load_device_cache()
+    return [] if cached is None else [(None, ip, None, None, 0) for ip in cached[0]]
+
+
+def probe_device(ip, port=PORT, samples=LATENCY_SAMPLES):
+    """
+    Connect to one device and read its sizes and firmware. Never raises;
+    returns a dict with status, error and timings in milliseconds.
+    """
+    result = {"ip": ip, "status": "ok", "error": None, "connect_ms": None, "latency_ms": None,
+              "firmware": None, "users": None, "faces": None, "fingers": None, "records": None}
+    started = time.monotonic()
+    try:
+        conn = connect_device(ip, port, force=True)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"Connection failed: {e}"
+        result["connect_ms"] = round((time.monotonic() - started) * 1000, 1)
+        return result
+    result["connect_ms"] = round((time.monotonic() - started) * 1000, 1)
+
+    try:
+        round_trips = []
+        for _ in range(max(1, samples)):
+            started = time.monotonic()
+            conn.read_sizes()
+            round_trips.append((time.monotonic() - started) * 1000)
+        result["latency_ms"] = round(statistics.median(round_trips), 1)
+        result["users"] = conn.users
+        result["faces"] = conn.faces
+        result["fingers"] = conn.fingers
+        result["records"] = conn.records
+        result["firmware"] = conn.get_firmware_version()
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"Error reading device info: {e}"
+        record_session_failure(ip, e)
+    finally:
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+    return result
+
+
+def probe_devices(include_maintenance=False):
+    """
+    Probe every device concurrently. Returns {"elapsed_ms", "devices": [...]}
+    with one probe_device result per device, in devices table order, plus
+    its id, name, location, maintenance flag and health entry. When the
+    devices table cannot be read, "error" says why and the cached active
+    devices are probed instead.
+    """
+    started = time.monotonic()
+    error = None
+    try:
+        devices = load_devices(include_maintenance)
+    except mysql.connector.Error as err:
+        devices = cached_devices()
+        source = "probing the cached device list" if devices else "no cached device list to probe"
+        error = f"Could not read the devices table, {source}: {err}"
+    results = []
+    if devices:
+        with ThreadPoolExecutor(max_workers=min(len(devices), MAX_PROBE_THREADS)) as pool:
+            probes = pool.map(probe_device, [ip for _, ip, _, _, _ in devices])
+            registry = get_registry()
+            for (device_id, ip, name, location, maintenance), probe in zip(devices, probes):
+                results.append(dict(
+                    probe, device_id=device_id, name=name, location=location,
+                    maintenance=bool(maintenance), health=registry.status(ip)
+                ))
+    report = {"elapsed_ms": round((time.monotonic() - started) * 1000, 1), "devices": results}
+    if error:
+        report["error"] = error
+    return report
+
+
+if __name__ == "__main__":
+    print(json.dumps(probe_devices(len(sys.argv) > 1 and sys.argv[1] == "all"), default=str, indent=1))
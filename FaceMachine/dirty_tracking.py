@@ -0,0 +1,81 @@
+"""
+Change tracking for the report table.
+
+Triggers on logs, attendance_flags and exemptions append the (staff_id,
+date) pairs they touch to report_dirty, so writes from the Node backend
+are tracked as well as FaceMachine's own. A dirty run reads every pair up
+to the current highest id, recomputes only those, and deletes up to that
+id once committed; marks added meanwhile survive for the next run.
+Creating the triggers needs the TRIGGER privilege.
+"""
+
+# (trigger name, table, event, body)
+TRIGGERS = [
+    ("report_dirty_logs_ins", "logs", "AFTER INSERT",
+     "INSERT INTO report_dirty (staff_id, date) VALUES (NEW.staff_id, NEW.date)"),
+    ("report_dirty_logs_del", "logs", "AFTER DELETE",
+     "INSERT INTO report_dirty (staff_id, date) VALUES (OLD.staff_id, OLD.date)"),
+    ("report_dirty_flags_ins", "attendance_flags", "AFTER INSERT",
+     "INSERT INTO report_dirty (staff_id, date) VALUES (NEW.staff_id, NEW.date)"),
+    ("report_dirty_flags_del", "attendance_flags", "AFTER DELETE",
+     "INSERT INTO report_dirty (staff_id, date) VALUES (OLD.staff_id, OLD.date)"),
+    ("report_dirty_flags_upd", "attendance_flags", "AFTER UPDATE",
+     "INSERT INTO report_dirty (staff_id, date) VALUES (OLD.staff_id, OLD.date), (NEW.staff_id, NEW.date)"),
+    ("report_dirty_exemptions_ins", "exemptions", "AFTER INSERT",
+     "INSERT INTO report_dirty (staff_id, date) VALUES (NEW.staffId, NEW.exemptionDate)"),
+    # Only changes that can move the result count; the processed flag does
+    # not, and neither does mark_processed's own status change, which comes
+    # with processed going 0 -> 1 (the backend never sets processed)
+    ("report_dirty_exemptions_upd", "exemptions", "AFTER UPDATE",
+     """
+     BEGIN
+         IF NOT ((NEW.exemptionStatus <=> OLD.exemptionStatus OR (OLD.processed = 0 AND NEW.processed = 1))
+                 AND NEW.exemptionType <=> OLD.exemptionType
+                 AND NEW.staffId <=> OLD.staffId
+                 AND NEW.exemptionDate <=> OLD.exemptionDate
+                 AND NEW.exemptionSession <=> OLD.exemptionSession
+                 AND NEW.start_time <=> OLD.start_time
+                 AND NEW.end_time <=> OLD.end_time) THEN
+             INSERT INTO report_dirty (staff_id, date)
+             VALUES (OLD.staffId, OLD.exemptionDate), (NEW.staffId, NEW.exemptionDate);
+         END IF;
+     END
+     """),
+]
+
+
+def ensure_dirty_tracking(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_dirty (
+            id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            staff_id VARCHAR(64) NOT NULL,
+            date DATE NOT NULL,
+            marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_report_dirty_date (date)
+        )
+        """
+    )
+    cursor.execute("SELECT trigger_name FROM information_schema.triggers WHERE trigger_schema = DATABASE()")
+    existing = {name for (name,) in cursor.fetchall()}
+    for name, table, event, body in TRIGGERS:
+        if name not in existing:
+            cursor.execute(f"CREATE TRIGGER {name} {event} ON {table} FOR EACH ROW {body}")
+
+
+def load_dirty(cursor):
+    """Return (max_id, {date: {staff_id, ...}}) for everything marked so far; max_id is None when clean."""
+    cursor.execute("SELECT MAX(id) FROM report_dirty")
+    row = cursor.fetchone()
+    max_id = row[0] if row else None
+    if max_id is None:
+        return None, {}
+    cursor.execute("SELECT DISTINCT date, staff_id FROM report_dirty WHERE id <= %s", (max_id,))
+    dirty = {}
+    for date, staff_id in cursor.fetchall():
+        dirty.setdefault(date, set()).add(staff_id)
+    return max_id, dirty
+
+
+def clear_dirty(cursor, max_id):
+    cursor.execute("DELETE FROM report_dirty WHERE id <= %s", (max_id,))
@@ -1,579 +1,139 @@
 import mysql.connector
 import datetime as dt
+import os
+import sys
+import time
 from datetime import datetime, timedelta
 
-import math
-from connection import db as db_connect
-from holiday import get_holidays
-from exemption import process_exemptions
+from connection import get_connection
+from holiday_cache import holiday_dates
+from exemption import load_exemptions, load_session_times, resolve_staff_days, evaluate_staff_day, mark_processed
+from report_writer import ReportWriter
+from category_rules import load_category_rules, to_seconds
+from attendance_batch import evaluate_roster
+from dirty_tracking import ensure_dirty_tracking, load_dirty, clear_dirty
 
+RANGE_WORKERS = int(os.getenv("FACEMACHINE_RANGE_WORKERS", str(os.cpu_count() or 2)))
 
-def insert_log(cursor, staff_id, category_id, logs, date, is_holiday, categories):
-    """Process logs and insert attendance records for a single staff member."""
-    if (category_id == 5):
-        return 
-    if not logs:
-        return
-   
-    print(f"Inserting log for staff_id: {staff_id}, category_id: {category_id}")
-    try:
-        cursor.execute(
-            "SELECT time FROM attendance_flags WHERE staff_id = %s AND date = %s",
-            (staff_id, date)
-        )
-        flagged_times_raw = cursor.fetchall()
-        flagged_times = {str(t[0]) for t in flagged_times_raw}
-        print(f"Flagged times for {staff_id}: {flagged_times}")
-
-
-
-        time_logs = [log_time for log_staff_id, log_time in logs if log_staff_id == staff_id]
-        time_logs.sort()
-
-        time_logs = [t if isinstance(t, str) else str(t) for t in time_logs]
-        time_logs = [t for t in time_logs if t not in flagged_times]
-        original_logs = time_logs.copy()
-
-        # Handle odd number of logs
-        options = []
-        if len(time_logs) % 2 == 1 and len(time_logs) > 1:
-            for removal_type in ['last', 'center']:
-                temp_time_logs = time_logs.copy()
-                if removal_type == 'last':
-                    temp_time_logs = temp_time_logs[:-1]
-                    print(f"Evaluating option (remove last) for {staff_id}: removed {original_logs[-1] if original_logs else None}")
-                else:
-                    center_index = len(temp_time_logs) // 2
-                    removed_log = temp_time_logs.pop(center_index) if temp_time_logs else None
-                    print(f"Evaluating option (remove center) for {staff_id}: removed {removed_log}")
-                
-                temp_time_logs = [t for t in temp_time_logs if t not in flagged_times]
-                if not temp_time_logs:
-                    continue
-
-                temp_late_mins = 0
-                temp_attendance = 'P'
-                temp_half_day_morning = False
-                temp_half_day_afternoon = False
-                temp_morning_late_mins = 0
-                temp_afternoon_late_mins = 0
-                temp_break_mins = 0
-
-                try:
-                    temp_time_objs = [datetime.strptime(f"{date} {t}", "%Y-%m-%d %H:%M:%S") for t in temp_time_logs]
-                except ValueError as e:
-                    print(f"Error parsing time logs for {staff_id} in option {removal_type}: {e}")
-                    continue
-                n = len(temp_time_objs)
-
-                category_data = next((cat for cat in categories if cat[0] == category_id), None)
-                if not category_data:
-                    print(f"No category data for {staff_id} (category_id: {category_id}) in option {removal_type}")
-                    continue
-                if category_data[7] == 'fixed' and not all(category_data[i] for i in [2, 3, 4, 5, 6, 8, 9]):
-                    print(f"Incomplete category data for {staff_id} (category_id: {category_id}): {category_data}")
-                    continue
-
-                if is_fixed_hours := (category_data[7] == 'fixed'):
-                    in_time = category_data[2]
-                    break_in = category_data[3]
-                    break_out = category_data[4]
-                    out_time = category_data[5]
-                    allowed_break = int(category_data[6])
-                    in1 = category_data[8]
-                    out2 = category_data[9]
-
-                    try:
-                        start_const = datetime.strptime(f"{date} {in_time}", "%Y-%m-%d %H:%M:%S")
-                        break_in_const = datetime.strptime(f"{date} {break_in}", "%Y-%m-%d %H:%M:%S")
-                        break_out_const = datetime.strptime(f"{date} {break_out}", "%Y-%m-%d %H:%M:%S")
-                        end_const = datetime.strptime(f"{date} {out_time}", "%Y-%m-%d %H:%M:%S")
-                        in1_const = datetime.strptime(f"{date} {in1}", "%Y-%m-%d %H:%M:%S")
-                        out2_const = datetime.strptime(f"{date} {out2}", "%Y-%m-%d %H:%M:%S")
-                        middle_time = break_in_const + (break_out_const - break_in_const) / 2
-                    except ValueError as e:
-                        print(f"Error parsing category times for {staff_id} (category_id: {category_id}) in option {removal_type}: {e}")
-                        continue
-
-                    # Morning check
-                    if temp_time_objs:
-                        if temp_time_objs[0] > start_const:
-                            late_minutes = (temp_time_objs[0] - start_const).total_seconds() / 60
-                            if late_minutes > 90:
-                                temp_half_day_morning = True
-                                temp_morning_late_mins = 0
-                                temp_attendance = 'H'
-                            elif late_minutes >= 16:
-                                temp_morning_late_mins += late_minutes
-
-                        if not any(t > in1_const for t in temp_time_objs):
-                            temp_half_day_morning = True
-                            temp_morning_late_mins = 0
-                            temp_attendance = 'H'
-
-                    # Break check: select break with greatest valid duration within end_time
-                    breaks = []
-                    temp_morning_late_mins = temp_morning_late_mins
-                    temp_afternoon_late_mins = temp_afternoon_late_mins
-                    temp_half_day_morning = temp_half_day_morning
-                    temp_half_day_afternoon = False
-                    temp_attendance = temp_attendance
-                    temp_break_mins = 0
-
-                    i = 1
-                    while i < n - 1:
-                        exit_time = temp_time_objs[i]
-                        entry_time = temp_time_objs[i + 1]
-                        break_duration = (entry_time - exit_time).total_seconds() / 60
-                        print(f"Evaluating break {i//2 + 1} for {staff_id}: {break_duration:.2f} mins (from {exit_time} to {entry_time})")
-
-                        # Skip breaks after end_time
-                        if exit_time > end_const:
-                            print(f"Break starts after out_time for {staff_id}, no late_mins added")
-                            i += 2
-                            continue
-
-                        # Calculate valid duration
-                        valid_start = max(exit_time, break_in_const)
-                        valid_end = min(entry_time, break_out_const)
-                        valid_duration = max(0, (valid_end - valid_start).total_seconds() / 60) if valid_start <= valid_end else 0
-                        is_valid = valid_duration > 0 and entry_time <= break_out_const
-                        print(f"Break {i//2 + 1} valid duration: {valid_duration:.2f} mins (from {valid_start} to {valid_end})")
-
-                        breaks.append((i//2 + 1, exit_time, entry_time, break_duration, valid_duration))
-                        i += 2
-
-                    # Select break with greatest valid duration
-                    if breaks:
-                        valid_breaks = [(num, exit_time, entry_time, break_dur, valid_dur) for num, exit_time, entry_time, break_dur, valid_dur in breaks if valid_dur > 0]
-                        if valid_breaks:
-                            selected_break = max(valid_breaks, key=lambda x: x[4])  # Max by valid_duration
-                            temp_break_mins = selected_break[4]
-                            print(f"Selected break {selected_break[0]} for {staff_id}: valid {temp_break_mins:.2f} mins (from {selected_break[1]} to {selected_break[2]})")
-                            # Calculate late minutes for selected break (invalid portions)
-                            break_late_mins = 0
-                            if selected_break[1] < break_in_const:
-                                break_late_mins += (break_in_const - selected_break[1]).total_seconds() / 60
-                                print(f"Selected break starts before break_in for {staff_id}: {break_late_mins:.2f} mins added (exit_time={selected_break[1]}, break_in={break_in_const})")
-                            if selected_break[2] > break_out_const:
-                                break_late_mins += (selected_break[2] - break_out_const).total_seconds() / 60
-                                print(f"Selected break ends after break_out for {staff_id}: {break_late_mins:.2f} mins added (entry_time={selected_break[2]}, break_out={break_out_const})")
-                            if break_late_mins > 0:
-                                if selected_break[1] <= middle_time:
-                                    temp_morning_late_mins += break_late_mins
-                                    print(f"Selected break late mins aligned to morning for {staff_id}: {break_late_mins:.2f} mins added")
-                                else:
-                                    temp_afternoon_late_mins += break_late_mins
-                                    print(f"Selected break late mins aligned to afternoon for {staff_id}: {break_late_mins:.2f} mins added")
-
-                        # Add full durations of all other breaks within end_time to late_mins
-                        for break_num, exit_time, _, break_duration, _ in breaks:
-                            if not valid_breaks or break_num != selected_break[0]:
-                                if exit_time <= middle_time:
-                                    temp_morning_late_mins += break_duration
-                                    print(f"Other break {break_num} aligned to morning for {staff_id}: {break_duration:.2f} mins added to late_mins")
-                                else:
-                                    temp_afternoon_late_mins += break_duration
-                                    print(f"Other break {break_num} aligned to afternoon for {staff_id}: {break_duration:.2f} mins added to late_mins")
-                    else:
-                        print(f"No breaks within end_time for {staff_id}")
-
-                    # Apply half-day if late_mins exceed 90
-                    if temp_morning_late_mins > 90:
-                        temp_half_day_morning = True
-                        temp_morning_late_mins = 0
-                        temp_attendance = 'H'
-                        print(f"Morning late_mins > 90 for {staff_id}, marking morning half-day")
-                    if temp_afternoon_late_mins > 90:
-                        temp_half_day_afternoon = True
-                        temp_afternoon_late_mins = 0
-                        temp_attendance = 'H'
-                        print(f"Afternoon late_mins > 90 for {staff_id}, marking afternoon half-day")
-
-                    temp_late_mins = temp_morning_late_mins + temp_afternoon_late_mins
-                    if temp_half_day_morning and temp_half_day_afternoon:
-                        temp_attendance = 'I'
-                        temp_morning_late_mins = 0
-                        temp_afternoon_late_mins = 0
-                        temp_late_mins = 0
-
-                    options.append((int(temp_half_day_morning) + int(temp_half_day_afternoon), temp_late_mins, temp_attendance, temp_time_logs, removal_type, temp_break_mins))
-
-        else:
-            options.append((0, 0, 'P', time_logs, 'none', 0))
-
-        if not time_logs:
-            print(f"No logs for {staff_id} on {date}, marking as absent")
-            try:
-                cursor.execute(
-                    "INSERT INTO report (staff_id, date, late_mins, attendance) VALUES (%s, %s, %s, %s) "
-                    "ON DUPLICATE KEY UPDATE late_mins = %s, attendance = %s",
-                    (staff_id, date, 0, 'I', 0, 'I')
-                )
-                print(f"Inserted/Updated report for {staff_id}: Date: {date}, Late Minutes: 0, Attendance: I")
-            except mysql.connector.Error as err:
-                print(f"Error inserting report for {staff_id}: {err}")
-            return
-
-        if options:
-            options.sort()
-            num_half_days, late_mins, attendance, time_logs, removal_type, break_mins = options[0]
-            print(f"Selected option ({removal_type}) for {staff_id}: num_half_days={num_half_days}, late_mins={late_mins}, attendance={attendance}")
-        else:
-            print(f"No valid logs for {staff_id} after processing options")
-            try:
-                cursor.execute(
-                    "INSERT INTO report (staff_id, date, late_mins, attendance) VALUES (%s, %s, %s, %s) "
-                    "ON DUPLICATE KEY UPDATE late_mins = %s, attendance = %s",
-                    (staff_id, date, 0, 'I', 0, 'I')
-                )
-                print(f"Inserted/Updated report for {staff_id}: Date: {date}, Late Minutes: 0, Attendance: I")
-            except mysql.connector.Error as err:
-                print(f"Error inserting report for {staff_id}: {err}")
-            return
 
+def flag_seconds(flagged_times):
+    """Flagged time strings as seconds since midnight; unparsable entries match no punch."""
+    seconds = set()
+    for flag in flagged_times:
         try:
-            time_objs = [datetime.strptime(f"{date} {t}", "%Y-%m-%d %H:%M:%S") for t in time_logs]
-            print(f"Time objects for {staff_id}: {time_objs}")
+            seconds.add(to_seconds(flag))
+        except ValueError:
+            pass
+    return seconds
+
+
+def is_day_off(date, is_holiday):
+    """Holidays and Sundays get no report row for days with punches."""
+    date_obj = date if isinstance(date, dt.date) else datetime.strptime(str(date), "%Y-%m-%d")
+    return is_holiday or date_obj.weekday() == 6
+
+
+def prefetch_day(cursor, date, staff_ids=None):
+    """
+    Load everything the evaluation needs for one date in two queries, limited
+    to `staff_ids` when given.
+
+    Returns (logs_by_staff, flags_by_staff): punch rows and flagged time
+    strings, each grouped by staff id.
+    """
+    staff_filter, params = "", (date,)
+    if staff_ids is not None:
+        staff_ids = list(staff_ids)
+        if not staff_ids:
+            return {}, {}
+        staff_filter = f" AND staff_id IN ({', '.join(['%s'] * len(staff_ids))})"
+        params = (date, *staff_ids)
+
+    cursor.execute(
+        f"""
+        SELECT logs.staff_id, logs.time
+        FROM logs
+        JOIN staff ON logs.staff_id = staff.staff_id
+        WHERE logs.date = %s{staff_filter.replace("staff_id", "logs.staff_id")}
+        """,
+        params
+    )
+    logs_by_staff = {}
+    for staff_id, log_time in cursor.fetchall():
+        logs_by_staff.setdefault(staff_id, []).append((staff_id, log_time))
+
+    cursor.execute(f"SELECT staff_id, time FROM attendance_flags WHERE date = %s{staff_filter}", params)
+    flags_by_staff = {}
+    for staff_id, flag_time in cursor.fetchall():
+        flags_by_staff.setdefault(staff_id, set()).add(str(flag_time))
+
+    return logs_by_staff, flags_by_staff
+
+
+def build_roster(staffs, logs_by_staff, flags_by_staff):
+    """
+    (staff_id, category_id, punches, flagged) for every staff member with
+    punches to evaluate, with times as seconds since midnight.
+    """
+    roster = []
+    for staff_id, category_id in staffs:
+        logs = logs_by_staff.get(staff_id)
+        if category_id == 5 or not logs:
+            continue
+        try:
+            punches = sorted(to_seconds(log_time) for _, log_time in logs)
         except ValueError as e:
             print(f"Error parsing time logs for {staff_id}: {e}")
-            return
-        n = len(time_objs)
-
-        category_data = next((cat for cat in categories if cat[0] == category_id), None)
-        if not category_data:
-            print(f"No category data found for staff {staff_id} (category_id: {category_id})")
-            return
-        if category_data[7] == 'fixed' and not all(category_data[i] for i in [2, 3, 4, 5, 6, 8, 9]):
-            print(f"Incomplete category data for {staff_id} (category_id: {category_id}): {category_data}")
-            return
-        print(f"Category data for {staff_id}: {category_data}")
-
-        attendance = 'P'
-        half_day_morning = False
-        half_day_afternoon = False
-        morning_late_mins = 0
-        afternoon_late_mins = 0
-        late_mins = 0
-
-        if isinstance(date, dt.date):
-            date_obj = date
-        else:
-            date_obj = datetime.strptime(date, "%Y-%m-%d")
-
-        if is_holiday or date_obj.weekday() == 6:
-            return
-
-        if is_fixed_hours := (category_data[7] == 'fixed'):
-            in_time = category_data[2]
-            break_in = category_data[3]
-            break_out = category_data[4]
-            out_time = category_data[5]
-            allowed_break = int(category_data[6])
-            in1 = category_data[8]
-            out2 = category_data[9]
-
-            try:
-                start_const = datetime.strptime(f"{date} {in_time}", "%Y-%m-%d %H:%M:%S")
-                break_in_const = datetime.strptime(f"{date} {break_in}", "%Y-%m-%d %H:%M:%S")
-                break_out_const = datetime.strptime(f"{date} {break_out}", "%Y-%m-%d %H:%M:%S")
-                end_const = datetime.strptime(f"{date} {out_time}", "%Y-%m-%d %H:%M:%S")
-                in1_const = datetime.strptime(f"{date} {in1}", "%Y-%m-%d %H:%M:%S")
-                out2_const = datetime.strptime(f"{date} {out2}", "%Y-%m-%d %H:%M:%S")
-                middle_time = break_in_const + (break_out_const - break_in_const) / 2
-                print(f"Constants for {staff_id} (category_id: {category_id}): start={start_const}, break_in={break_in_const}, break_out={break_out_const}, end={end_const}, in1={in1_const}, out2={out2_const}, middle_time={middle_time}")
-            except ValueError as e:
-                print(f"Error parsing category times for {staff_id} (category_id: {category_id}): {e}")
-                return
-
-            if n == 1:
-                log_time = time_objs[0]
-                times_to_compare = [
-                    ('in_time', start_const),
-                    ('out_time', end_const),
-                    ('in1', in1_const),
-                    ('out2', out2_const)
-                ]
-                time_diffs = [
-                    (name, abs((log_time - ref_time).total_seconds() / 60))
-                    for name, ref_time in times_to_compare
-                ]
-                closest_time = min(time_diffs, key=lambda x: x[1])
-                closest_name, min_diff = closest_time
-                print(f"Single log for {staff_id} (category_id: {category_id}): {log_time.time()}, closest to {closest_name} ({times_to_compare[[n[0] for n in times_to_compare].index(closest_name)][1].time()}), diff={min_diff:.2f} mins")
-
-                if closest_name == 'in_time' and log_time > start_const:
-                    late_minutes = (log_time - start_const).total_seconds() / 60
-                    if late_minutes > 90:
-                        half_day_morning = True
-                        morning_late_mins = 0
-                        attendance = 'H'
-                        print(f"Single log late > 90 mins for {staff_id} compared to in_time: {late_minutes:.2f}")
-                    elif late_minutes >= 16:
-                        morning_late_mins = late_minutes
-                        print(f"Single log late mins for {staff_id} compared to in_time: {late_minutes:.2f}")
-                elif closest_name == 'in1' and log_time < in1_const:
-                    early_minutes = (in1_const - log_time).total_seconds() / 60
-                    if early_minutes > 90:
-                        half_day_morning = True
-                        morning_late_mins = 0
-                        attendance = 'H'
-                        print(f"Single log early > 90 mins for {staff_id} compared to in1: {early_minutes:.2f}")
-                    else:
-                        morning_late_mins = early_minutes
-                        print(f"Single log early mins for {staff_id} compared to in1: {early_minutes:.2f}")
-                elif closest_name in ['out2', 'out_time'] and log_time < end_const:
-                    early_minutes = (end_const - log_time).total_seconds() / 60
-                    if early_minutes > 90:
-                        half_day_afternoon = True
-                        afternoon_late_mins = 0
-                        attendance = 'H'
-                        print(f"Single log early > 90 mins for {staff_id} compared to {closest_name}: {early_minutes:.2f}")
-                    else:
-                        afternoon_late_mins = early_minutes
-                        print(f"Single log early mins for {staff_id} compared to {closest_name}: {early_minutes:.2f}")
-                late_mins = morning_late_mins + afternoon_late_mins
-
-            elif n >= 2:
-                if time_objs[0] > start_const:
-                    late_minutes = (time_objs[0] - start_const).total_seconds() / 60
-                    if late_minutes > 90:
-                        half_day_morning = True
-                        morning_late_mins = 0
-                        attendance = 'H'
-                        print(f"Morning absence > 90 mins for {staff_id}: {late_minutes}")
-                    elif late_minutes >= 16:
-                        morning_late_mins += late_minutes
-                        print(f"Morning late mins for {staff_id}: {late_minutes}")
-
-                if not any(t > in1_const for t in time_objs):
-                    half_day_morning = True
-                    morning_late_mins = 0
-                    attendance = 'H'
-                    print(f"No logs after in1 for {staff_id}, marking morning half-day")
-
-                # Break check: select break with greatest valid duration within end_time
-                breaks = []
-                break_mins = 0
-                selected_break = None
-
-                i = 1
-                while i < n - 1:
-                    try:
-                        exit_time = time_objs[i]
-                        entry_time = time_objs[i + 1]
-                        break_duration = (entry_time - exit_time).total_seconds() / 60
-                        print(f"Evaluating break {i//2 + 1} for {staff_id}: {break_duration:.2f} mins (from {exit_time} to {entry_time})")
-
-                        # Skip breaks after end_time
-                        if exit_time > end_const:
-                            print(f"Break starts after out_time for {staff_id}, no late_mins added")
-                            i += 2
-                            continue
-
-                        # Calculate valid duration
-                        valid_start = max(exit_time, break_in_const)
-                        valid_end = min(entry_time, break_out_const)
-                        valid_duration = max(0, (valid_end - valid_start).total_seconds() / 60) if valid_start <= valid_end else 0
-                        is_valid = valid_duration > 0 and entry_time <= break_out_const
-                        print(f"Break {i//2 + 1} valid duration: {valid_duration:.2f} mins (from {valid_start} to {valid_end})")
-
-                        breaks.append((i//2 + 1, exit_time, entry_time, break_duration, valid_duration))
-                        i += 2
-                    except IndexError:
-                        print(f"IndexError in break calculation for {staff_id} at index {i}")
-                        break
-
-                # Select break with greatest valid duration
-                if breaks:
-                    valid_breaks = [(num, exit_time, entry_time, break_dur, valid_dur) for num, exit_time, entry_time, break_dur, valid_dur in breaks if valid_dur > 0]
-                    if valid_breaks:
-                        selected_break = max(valid_breaks, key=lambda x: x[4])  # Max by valid_duration
-                        break_mins = selected_break[4]
-                        print(f"Selected break {selected_break[0]} for {staff_id}: valid {break_mins:.2f} mins (from {selected_break[1]} to {selected_break[2]})")
-                        # Calculate late minutes for selected break (invalid portions)
-                        break_late_mins = 0
-                        if selected_break[1] < break_in_const:
-                            break_late_mins += (break_in_const - selected_break[1]).total_seconds() / 60
-                            print(f"Selected break starts before break_in for {staff_id}: {break_late_mins:.2f} mins added (exit_time={selected_break[1]}, break_in={break_in_const})")
-                        if selected_break[2] > break_out_const:
-                            break_late_mins += (selected_break[2] - break_out_const).total_seconds() / 60
-                            print(f"Selected break ends after break_out for {staff_id}: {break_late_mins:.2f} mins added (entry_time={selected_break[2]}, break_out={break_out_const})")
-                        if break_late_mins > 0:
-                            if selected_break[1] <= middle_time:
-                                morning_late_mins += break_late_mins
-                                print(f"Selected break late mins aligned to morning for {staff_id}: {break_late_mins:.2f} mins added")
-                            else:
-                                afternoon_late_mins += break_late_mins
-                                print(f"Selected break late mins aligned to afternoon for {staff_id}: {break_late_mins:.2f} mins added")
-
-                    # Add full durations of all other breaks within end_time to late_mins
-                    for break_num, exit_time, _, break_duration, _ in breaks:
-                        if not valid_breaks or break_num != selected_break[0]:
-                            if exit_time <= middle_time:
-                                morning_late_mins += break_duration
-                                print(f"Other break {break_num} aligned to morning for {staff_id}: {break_duration:.2f} mins added to late_mins")
-                            else:
-                                afternoon_late_mins += break_duration
-                                print(f"Other break {break_num} aligned to afternoon for {staff_id}: {break_duration:.2f} mins added to late_mins")
-                else:
-                    print(f"No breaks within end_time for {staff_id}")
-                print(f"Total valid break mins for {staff_id}: {break_mins:.2f}")
-
-                # Apply half-day if late_mins exceed 90
-                if morning_late_mins > 90:
-                    half_day_morning = True
-                    morning_late_mins = 0
-                    attendance = 'H'
-                    print(f"Morning late_mins > 90 for {staff_id}, marking morning half-day")
-                if afternoon_late_mins > 90:
-                    half_day_afternoon = True
-                    afternoon_late_mins = 0
-                    attendance = 'H'
-                    print(f"Afternoon late_mins > 90 for {staff_id}, marking afternoon half-day")
-
-                if time_objs and not any(t > out2_const for t in time_objs):
-                    half_day_afternoon = True
-                    afternoon_late_mins = 0
-                    attendance = 'H'
-                    print(f"No logs after out2 for {staff_id}, marking half-day")
-
-                if time_objs and time_objs[-1] < end_const and not half_day_afternoon:
-                    early_minutes = (end_const - time_objs[-1]).total_seconds() / 60
-                    print(f"Early out check: last_log={time_objs[-1].time()}, end_const={end_const.time()}, early_minutes={early_minutes}")
-                    if early_minutes > 90:
-                        half_day_afternoon = True
-                        afternoon_late_mins = 0
-                        attendance = 'H'
-                        print(f"Early out > 90 mins for {staff_id}, marking afternoon half-day")
-                    else:
-                        afternoon_late_mins += early_minutes
-                        print(f"Early out mins added to afternoon_late_mins for {staff_id}: {early_minutes}")
-
-                if half_day_morning and half_day_afternoon:
-                    attendance = 'I'
-                    morning_late_mins = 0
-                    afternoon_late_mins = 0
-                    print(f"Both sessions half-day for {staff_id}, marking as 'I'")
-
-                late_mins = morning_late_mins + afternoon_late_mins
-
-        else:
-            if not time_objs:
-                try:
-                    cursor.execute(
-                        "INSERT INTO report (staff_id, date, late_mins, attendance) VALUES (%s, %s, %s, %s) "
-                        "ON DUPLICATE KEY UPDATE late_mins = %s, attendance = %s",
-                        (staff_id, date, 0, 'I', 0, 'I')
-                    )
-                    print(f"Inserted/Updated report for {staff_id}: Date: {date}, Late Minutes: 0, Attendance: I")
-                except mysql.connector.Error as err:
-                    print(f"Error inserting report for {staff_id}: {err}")
-                return
-
-            start_const = time_objs[0]
-            end_temp = datetime.strptime(f"{date} {category_data[5]}", "%Y-%m-%d %H:%M:%S")
-            end_const = start_const + timedelta(hours=end_temp.hour, minutes=end_temp.minute)
-            allowed_break = int(category_data[6])
-
-            if n == 1:
-                if time_objs[0] < end_const:
-                    early_minutes = (end_const - time_objs[0]).total_seconds() / 60
-                    if early_minutes > 90:
-                        half_day_afternoon = True
-                        afternoon_late_mins = 0
-                        attendance = 'H'
-                        print(f"Single log early > 90 mins for {staff_id} (non-fixed): {early_minutes:.2f}")
-                    else:
-                        afternoon_late_mins = early_minutes
-                        print(f"Single log early mins for {staff_id} (non-fixed): {early_minutes:.2f}")
-                late_mins = afternoon_late_mins
-
-            else:
-                if time_objs[-1] < end_const:
-                    early_minutes = (end_const - time_objs[-1]).total_seconds() / 60
-                    if early_minutes > 90:
-                        half_day_afternoon = True
-                        afternoon_late_mins = 0
-                        attendance = 'H'
-                        print(f"Early out > 90 mins for {staff_id}, marking half-day")
-                    else:
-                        afternoon_late_mins += early_minutes
-                        print(f"Early out mins for {staff_id}: {early_minutes}")
-
-                break_mins = 0
-                i = 1
-                while i < n - 1:
-                    try:
-                        exit_time = time_objs[i]
-                        entry_time = time_objs[i + 1]
-                        break_duration = (entry_time - exit_time).total_seconds() / 60
-                        break_mins += break_duration
-                        print(f"Break {i//2 + 1} for {staff_id}: {break_duration:.2f} mins (from {exit_time} to {entry_time})")
-                        i += 2
-                    except IndexError:
-                        print(f"IndexError in break calculation for {staff_id} at index {i}")
-                        break
-                print(f"Total break mins for {staff_id}: {break_mins:.2f}")
-
-                if not half_day_afternoon and break_mins > allowed_break:
-                    excess_break = break_mins - allowed_break
-                    afternoon_late_mins += excess_break
-                    print(f"Excess break mins for {staff_id}: {excess_break:.2f}")
-
-                if half_day_afternoon and n == 1:
-                    attendance = 'H'
-                    afternoon_late_mins = 0
-                    print(f"Single log with early out for {staff_id}, marking half-day")
-
-                late_mins = afternoon_late_mins
-
-        if late_mins > 0:
-            late_mins = math.floor(late_mins)
-            # fractional_part = late_mins - int(late_mins)
-            # if fractional_part > 0.5:
-            #     late_mins = math.ceil(late_mins)
-            # else:
-            #     late_mins = math.floor(late_mins)
-            # print(f"Rounded late_mins for {staff_id}: {late_mins}")
-
+            continue
+        roster.append((staff_id, category_id, punches, flag_seconds(flags_by_staff.get(staff_id, ()))))
+    return roster
+
+
+def apply_exemptions(cursor, date, results, staffs, categories, sessions, logs_by_staff, flags_by_staff):
+    """
+    Overlay the date's exemptions for `staffs` on a roster's results in
+    place, giving each exempted staff-day the row process_exemptions would
+    have rewritten it with. Returns the exemption ids applied.
+    """
+    staff_map = {staff[0]: staff for staff in staffs}
+    exemptions = [e for e in load_exemptions(cursor, date) if e[2] in staff_map]
+    applied = []
+    if not exemptions:
+        return []
+    staff_days = resolve_staff_days(exemptions, staff_map, categories, sessions)
+    for (staff_id, _), (rule, windows, exemption_ids) in staff_days.items():
         try:
-            cursor.execute(
-                "SELECT 1 FROM report WHERE staff_id = %s AND date = %s",
-                (staff_id, date)
-            )
-            cursor.fetchall()  # Consume all results to prevent 'Unread result found'
-            exists = cursor.rowcount > 0
-
-            if exists:
-                cursor.execute(
-                    "UPDATE report SET late_mins = %s, attendance = %s WHERE staff_id = %s AND date = %s",
-                    (late_mins, attendance, staff_id, date)
-                )
-                print(f"Updated report for {staff_id}: Date: {date}, Late Minutes: {late_mins}, Attendance: {attendance}")
-            else:
-                cursor.execute(
-                    "INSERT INTO report (staff_id, date, late_mins, attendance) VALUES (%s, %s, %s, %s)",
-                    (staff_id, date, late_mins, attendance)
-                )
-                print(f"Inserted report for {staff_id}: Date: {date}, Late Minutes: {late_mins}, Attendance: {attendance}")
-        except mysql.connector.Error as err:
-            print(f"Error inserting or updating report for {staff_id}: {err}")
-    except mysql.connector.Error as err:
-        print(f"Error processing staff {staff_id}: {err}")
+            punches = sorted(to_seconds(log_time) for _, log_time in logs_by_staff.get(staff_id, []))
+        except ValueError as e:
+            print(f"Error parsing time logs for {staff_id}: {e}")
+            continue
+        result = evaluate_staff_day(punches, rule, windows, flag_seconds(flags_by_staff.get(staff_id, ())))
+        if result is None:
+            print(f"Skipping exemptions {exemption_ids} for {staff_id}: Incomplete category data {rule.row}")
+            continue
+        results[staff_id] = result
+        applied.extend(exemption_ids)
+    return applied
+
 
 def process_logs(date1=None):
     """Process logs for a given date or current date."""
-    conn = db_connect()
-    if not conn:
-        print("Database connection failed.")
+    today = date1 if date1 else datetime.now().date()
+    # Validate the date before a pooled connection is checked out
+    try:
+        is_holiday = _as_date(today) in holiday_dates()
+    except ValueError as err:
+        print(f"Invalid date {today!r}: {err}")
+        return
+    print(f"Processing date: {today}, is_holiday: {is_holiday}")
+
+    try:
+        conn = get_connection()
+    except mysql.connector.Error as err:
+        print(f"Database connection failed: {err}")
         return
 
     cursor = conn.cursor()
-    today = date1 if date1 else datetime.now().date()
-    holidays = get_holidays()
-    is_holiday = today in holidays
-    print(f"Processing date: {today}, is_holiday: {is_holiday}")
 
     try:
 
@@ -581,27 +141,31 @@ def process_logs(date1=None):
         staffs = cursor.fetchall()
         print(f"Staffs fetched: {staffs}")
 
-        cursor.execute("SELECT * FROM category")
-        categories = cursor.fetchall()
-        print(f"Categories fetched: {categories}")
-
-        for staff_id, category_id in staffs:
-            cursor.execute(
-                """
-                SELECT logs.staff_id, logs.time
-                FROM logs
-                JOIN staff ON logs.staff_id = staff.staff_id
-                WHERE logs.date = %s AND logs.staff_id = %s
-                """,
-                (today, staff_id)
-            )
-            logs = cursor.fetchall()
-            print(f"Logs fetched for {staff_id}: {logs}")
-
-            insert_log(cursor, staff_id, category_id, logs, today, is_holiday, categories)
-              
+        categories = load_category_rules(cursor)
+        sessions = load_session_times(cursor)
+        print(f"Categories fetched: {[rule.row for rule in categories.values()]}")
+
+        logs_by_staff, flags_by_staff = prefetch_day(cursor, today)
+        writer = ReportWriter(cursor)
+
+        roster = build_roster(staffs, logs_by_staff, flags_by_staff)
+        results = evaluate_roster(roster, categories, is_day_off(today, is_holiday))
+        # Exempted staff are evaluated with their exemptions in the same pass,
+        # so every staff-day is computed and written once
+        exemption_ids = apply_exemptions(cursor, today, results, staffs, categories, sessions, logs_by_staff, flags_by_staff)
+        for staff_id, result in results.items():
+            if result is None:
+                continue
+            writer.add(staff_id, today, result.late_mins, result.attendance)
+            print(f"Queued report for {staff_id}: Late Minutes: {result.late_mins}, Attendance: {result.attendance}, Removed: {result.removal}")
+
+        summary = writer.flush()
+        if exemption_ids:
+            mark_processed(cursor, exemption_ids)
+            print(f"Marked exemptions as processed: {exemption_ids}")
         conn.commit()
-        process_exemptions(today)  
+        print(f"Report rows written for {today}: {summary}")
+        return summary
 
     except mysql.connector.Error as err:
         print(f"Error: {err}")
@@ -610,5 +174,190 @@ def process_logs(date1=None):
         cursor.close()
         conn.close()
 
+def evaluate_date(date, staffs, categories, sessions, is_holiday):
+    """
+    Report rows for one date of a range run. Runs in a worker process, so it
+    only reads: logs, flags and exemptions come through the process's own
+    pool, and the rows and applied exemption ids go back to the parent.
+    Returns (date, rows, exemption_ids, seconds).
+    """
+    started = time.monotonic()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            logs_by_staff, flags_by_staff = prefetch_day(cursor, date)
+            roster = build_roster(staffs, logs_by_staff, flags_by_staff)
+            results = evaluate_roster(roster, categories, is_day_off(date, is_holiday))
+            exemption_ids = apply_exemptions(cursor, date, results, staffs, categories, sessions, logs_by_staff, flags_by_staff)
+        finally:
+            cursor.close()
+
+    rows = [(staff_id, date, result.late_mins, result.attendance)
+            for staff_id, result in results.items() if result is not None]
+    return date, rows, exemption_ids, round(time.monotonic() - started, 3)
+
+
+def process_dirty():
+    """
+    Recompute only the (staff_id, date) pairs whose logs, flags or
+    exemptions changed since the last successful run (see dirty_tracking),
+    with their exemptions applied in the same pass. Returns the writer
+    summary with the number of pairs and dates, or None on failure.
+    """
+    try:
+        conn = get_connection()
+    except mysql.connector.Error as err:
+        print(f"Database connection failed: {err}")
+        return None
+
+    cursor = conn.cursor()
+    try:
+        ensure_dirty_tracking(cursor)
+        sessions = load_session_times(cursor)
+        conn.commit()
+        max_id, dirty = load_dirty(cursor)
+        if max_id is None:
+            print("No dirty report rows")
+            return {"pairs": 0, "dates": 0}
+
+        holidays = holiday_dates()
+        categories = load_category_rules(cursor)
+        writer = ReportWriter(cursor)
+        pairs = 0
+        exemption_ids = []
+        for date, staff_ids in sorted(dirty.items()):
+            placeholders = ", ".join(["%s"] * len(staff_ids))
+            cursor.execute(f"SELECT staff_id, category FROM staff WHERE staff_id IN ({placeholders})", tuple(staff_ids))
+            staffs = cursor.fetchall()
+            logs_by_staff, flags_by_staff = prefetch_day(cursor, date, staff_ids)
+            roster = build_roster(staffs, logs_by_staff, flags_by_staff)
+            results = evaluate_roster(roster, categories, is_day_off(date, date in holidays))
+            exemption_ids += apply_exemptions(cursor, date, results, staffs, categories, sessions, logs_by_staff, flags_by_staff)
+            for staff_id, result in results.items():
+                if result is not None:
+                    writer.add(staff_id, date, result.late_mins, result.attendance)
+            pairs += len(staff_ids)
+            print(f"Recomputed {len(staff_ids)} dirty staff for {date}")
+
+        summary = writer.flush()
+        if exemption_ids:
+            mark_processed(cursor, exemption_ids)
+        clear_dirty(cursor, max_id)
+        conn.commit()
+    except mysql.connector.Error as err:
+        print(f"Error: {err}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+    summary = dict(summary, pairs=pairs, dates=len(dirty))
+    print(f"Dirty report rows written: {summary}")
+    return summary
+
+
+def _as_date(value):
+    return value if isinstance(value, dt.date) else datetime.strptime(str(value), "%Y-%m-%d").date()
+
+
+def process_logs_range(start, end, workers=None):
+    """Process every date from `start` to `end` inclusive; see process_dates."""
+    start, end = _as_date(start), _as_date(end)
+    dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    if not dates:
+        print(f"Empty date range: {start} to {end}")
+        return None
+    return process_dates(dates, workers)
+
+
+def process_dates(dates, workers=None):
+    """
+    Process the given dates, which need not be contiguous.
+
+    Staff, categories and holidays are loaded once; dates are evaluated on a
+    process pool of `workers` (FACEMACHINE_RANGE_WORKERS by default) and all
+    rows, with each date's exemptions already applied, go through one
+    ReportWriter in a single transaction. Returns {"report": writer summary, "dates": [...]}
+    with the row count and seconds for each date.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    dates = sorted({_as_date(date) for date in dates})
+    if not dates:
+        print("No dates to process")
+        return None
+    start, end = dates[0], dates[-1]
+
+    holidays = holiday_dates()
+    workers = max(1, min(workers or RANGE_WORKERS, len(dates)))
+    print(f"Processing {len(dates)} dates between {start} and {end} on {workers} workers")
+
+    try:
+        conn = get_connection()
+    except mysql.connector.Error as err:
+        print(f"Database connection failed: {err}")
+        return None
+
+    cursor = conn.cursor()
+    timings = []
+    try:
+        cursor.execute("SELECT staff_id, category FROM staff ")
+        staffs = cursor.fetchall()
+        categories = load_category_rules(cursor)
+        sessions = load_session_times(cursor)
+        writer = ReportWriter(cursor)
+
+        exemption_ids = []
+
+        def collect(date, rows, date_exemption_ids, secs):
+            for row in rows:
+                writer.add(*row)
+            exemption_ids.extend(date_exemption_ids)
+            timings.append({"date": str(date), "rows": len(rows), "secs": secs})
+            print(f"Evaluated {date}: {len(rows)} rows in {secs}s")
+
+        if workers == 1:
+            for date in dates:
+                collect(*evaluate_date(date, staffs, categories, sessions, date in holidays))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(evaluate_date, date, staffs, categories, sessions, date in holidays): date
+                    for date in dates
+                }
+                for future in as_completed(futures):
+                    try:
+                        collect(*future.result())
+                    except Exception as e:
+                        print(f"Error evaluating {futures[future]}: {e}")
+                        timings.append({"date": str(futures[future]), "rows": 0, "secs": None, "error": str(e)})
+
+        summary = writer.flush()
+        if exemption_ids:
+            mark_processed(cursor, exemption_ids)
+        conn.commit()
+    except mysql.connector.Error as err:
+        print(f"Error: {err}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+    timings.sort(key=lambda timing: timing["date"])
+    print(f"Report rows written for {start} to {end}: {summary}")
+    return {"report": summary, "dates": timings}
+
+
 if __name__ == "__main__":
-    process_logs("")
\ No newline at end of file
+    # essl.py                     -> today
+    # essl.py DATE                -> one date
+    # essl.py dirty               -> only the staff/dates changed since the last run
+    # essl.py START END [WORKERS] -> every date in the range
+    if len(sys.argv) == 2 and sys.argv[1] == "dirty":
+        process_dirty()
+    elif len(sys.argv) >= 3:
+        process_logs_range(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else None)
+    else:
+        process_logs(sys.argv[1] if len(sys.argv) > 1 else "")
\ No newline at end of file
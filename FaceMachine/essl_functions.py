@@ -1,19 +1,18 @@
+import json
+import os
 import sys
-from zk import ZK
-from connection import db
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from connection import get_connection
+from device_health import DeviceUnavailable, connect_device, record_session_failure
 import random
 
-
-def connect_to_device(reason , DEVICE_IP ):
-    PORT = 4370
-    zk = ZK(DEVICE_IP, port=PORT, timeout=5, password=0, force_udp=False, ommit_ping=False)
-    try:
-        conn = zk.connect()
-        print("Connected to device successfully for reason:", reason)
-        return conn
-    except Exception as e:
-        print(f"Connection failed: {e}")
-        return False
+UID_MIN = 1000
+UID_MAX = 32767
+# Device user lists are re-read once they are older than this
+UID_CACHE_SECS = int(os.getenv("FACEMACHINE_UID_CACHE_SECS", "300"))
+MAX_DEVICE_THREADS = 32
 
 
 # def get_uid():
@@ -48,83 +47,204 @@ def connect_to_device(reason , DEVICE_IP ):
 
 
 
-def set_user_credentials(user_id, name):
-    connection = db()
-    cursor = connection.cursor()
-    cursor.execute("SELECT ip_address FROM devices where maintenance = %s",(0,))
-    rows = cursor.fetchall()
-    print(rows)
-    conn = connect_to_device("setting user credentials",ip)
-    if not conn:
-        return "Error: Device not connected"
-    existing_uids = {user.uid for user in conn.get_users()}
-    uid = random.randint(1000, 32767)
-    while uid in existing_uids:
-        uid = random.randint(1000, 32767)
-    for (ip,) in rows:
-       
+def active_device_rows():
+    with get_connection() as connection:
+        cursor = connection.cursor()
         try:
-            conn = connect_to_device("setting user credentials",ip)
-
-            if not conn:
-                return "Error: Device not connected"
-          
-            if not user_id or not name:
-                return "Error: Missing ID or name in a device"
-        
-            print(uid , user_id , name )
-            password = str(user_id)
-            
-            conn.set_user(
-                uid=uid,                   
-                user_id=str(user_id),       
-                name=name,
-                privilege=0,
-                password=password
-            )
-           
-        except Exception as e:
-            return f"Error: Set credentials failed"
+            cursor.execute("SELECT ip_address FROM devices where maintenance = %s",(0,))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
 
+
+def on_devices(ips, action):
+    """
+    Run action(conn, ip) on every device at once, each on its own
+    connection. The action returns a status ("ok" unless it says otherwise)
+    or raises. Returns [{"ip", "status", "error", "secs"}] in `ips` order.
+    """
+    def run(ip):
+        result = {"ip": ip, "status": "ok", "error": None, "secs": None}
+        started = time.monotonic()
+        conn = None
+        try:
+            conn = connect_device(ip)
+            result["status"] = action(conn, ip) or "ok"
+        except DeviceUnavailable as e:
+            result["status"] = "skipped"
+            result["error"] = str(e)
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+            if conn:
+                record_session_failure(ip, e)
         finally:
-            conn.disconnect()
+            if conn:
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+            result["secs"] = round(time.monotonic() - started, 3)
+        return result
+
+    if not ips:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(ips), MAX_DEVICE_THREADS)) as pool:
+        return list(pool.map(run, ips))
+
+
+class DeviceUsers:
+    """
+    {ip: {user_id: uid}} for every device, so a uid can be allocated and a
+    user found without downloading each device's user list per call. Lists
+    older than `ttl_secs` are re-read, all devices at once.
+    """
+
+    def __init__(self, ttl_secs=UID_CACHE_SECS):
+        self.ttl_secs = ttl_secs
+        self._lock = threading.Lock()
+        self._users = {}
+        self._loaded_at = {}
+
+    def refresh(self, ips, force=False):
+        """Re-read the user lists that are missing or stale; returns the on_devices results."""
+        now = time.monotonic()
+        with self._lock:
+            stale = [ip for ip in ips if force or now - self._loaded_at.get(ip, -self.ttl_secs - 1) > self.ttl_secs]
+
+        def read_users(conn, ip):
+            users = {str(user.user_id): user.uid for user in conn.get_users()}
+            with self._lock:
+                self._users[ip] = users
+                self._loaded_at[ip] = time.monotonic()
+
+        return on_devices(stale, read_users)
+
+    def known(self, ip):
+        with self._lock:
+            return ip in self._users
+
+    def uid(self, ip, user_id):
+        with self._lock:
+            return self._users.get(ip, {}).get(str(user_id))
+
+    def allocate_uid(self, user_id, ips):
+        """
+        A uid for `user_id` that no other user holds on any of `ips`: the one
+        it already has on a device when that is still free everywhere,
+        otherwise a random free one.
+        """
+        user_id = str(user_id)
+        with self._lock:
+            taken = {}
+            for ip in ips:
+                for other, uid in self._users.get(ip, {}).items():
+                    taken.setdefault(uid, set()).add(other)
+        for ip in ips:
+            uid = self.uid(ip, user_id)
+            if uid is not None and taken.get(uid) == {user_id}:
+                return uid
+        free = UID_MAX - UID_MIN + 1 - sum(1 for uid in taken if UID_MIN <= uid <= UID_MAX)
+        if free <= 0:
+            raise ValueError("No free uid left on the devices")
+        uid = random.randint(UID_MIN, UID_MAX)
+        while uid in taken:
+            uid = random.randint(UID_MIN, UID_MAX)
+        return uid
+
+    def add(self, ip, user_id, uid):
+        with self._lock:
+            self._users.setdefault(ip, {})[str(user_id)] = uid
+
+    def discard(self, ip, user_id):
+        with self._lock:
+            self._users.get(ip, {}).pop(str(user_id), None)
+
+
+_device_users = None
+_device_users_lock = threading.Lock()
+
+
+def get_device_users():
+    """The process-wide DeviceUsers, created on first use."""
+    global _device_users
+    with _device_users_lock:
+        if _device_users is None:
+            _device_users = DeviceUsers()
+        return _device_users
+
+
+def _report(devices, **fields):
+    return dict(fields, ok=bool(devices) and all(d["status"] == "ok" for d in devices), devices=devices)
+
+
+def set_user_credentials(user_id, name):
+    """
+    Enrol a user on every active device at once, under one uid. A device
+    whose user list cannot be read is left out, since the uid might already
+    belong to someone there. Returns {"ok", "user_id", "uid", "devices":
+    [per device result]}.
+    """
+    if not user_id or not name:
+        return _report([], user_id=user_id, error="Missing ID or name")
+    ips = [ip for (ip,) in active_device_rows()]
+    if not ips:
+        return _report([], user_id=user_id, error="No active devices")
+
+    users = get_device_users()
+    failed = {result["ip"]: result for result in users.refresh(ips) if result["status"] != "ok"}
+    # A uid is only known to be free on devices whose users could be read
+    targets = [ip for ip in ips if ip not in failed and users.known(ip)]
+    uid = users.allocate_uid(user_id, targets)
+
+    def provision(conn, ip):
+        conn.set_user(
+            uid=uid,
+            user_id=str(user_id),
+            name=name,
+            privilege=0,
+            password=str(user_id)
+        )
+        users.add(ip, user_id, uid)
+
+    results = {result["ip"]: result for result in on_devices(targets, provision)}
+    devices = [results.get(ip) or failed.get(ip) or {"ip": ip, "status": "error", "error": "User list unavailable", "secs": 0.0}
+               for ip in ips]
+    return _report(devices, user_id=user_id, uid=uid)
 
-   
 
 def delete_user(user_id):
-    connection = db()
-    cursor = connection.cursor()
-    cursor.execute("SELECT ip_address FROM devices where maintenance = %s",(0,))
-    rows = cursor.fetchall()
+    """
+    Remove a user from every active device at once. Devices that do not
+    have the user report "not_found" without being contacted. Returns
+    {"ok", "user_id", "devices": [per device result]}.
+    """
+    if not user_id:
+        return _report([], user_id=user_id, error="Missing ID")
+    ips = [ip for (ip,) in active_device_rows()]
+    if not ips:
+        return _report([], user_id=user_id, error="No active devices")
 
-  
-    for (ip,) in rows:
-        
-        
-        
-        try:
-            conn = connect_to_device("deleting user",ip)
-            if not conn:
-                return "Error: Device not connected"
-
-            if not user_id:
-                return "Error: Missing ID in a device"
-            
-            users = conn.get_users()
-            for user in users:
-                if(user.user_id == user_id):
-                    uid = user.uid
-                    break
-            if(uid):
-
-                conn.delete_user(uid=uid)
-                return f"User {user_id} deleted successfully"
+    users = get_device_users()
+    users.refresh(ips)
+    if all(users.uid(ip, user_id) is None for ip in ips):
+        # Possibly enrolled since the lists were read
+        users.refresh(ips, force=True)
 
-        except Exception as e:
-            return "Error: Delete user failed"
+    def remove(conn, ip):
+        conn.delete_user(uid=users.uid(ip, user_id))
+        users.discard(ip, user_id)
+
+    targets = [ip for ip in ips if users.uid(ip, user_id) is not None]
+    results = {result["ip"]: result for result in on_devices(targets, remove)}
+    devices = [
+        results.get(ip) or {"ip": ip, "status": "not_found", "error": None, "secs": 0.0}
+        for ip in ips
+    ]
+    report = _report(devices, user_id=user_id)
+    report["ok"] = bool(results) and all(d["status"] in ("ok", "not_found") for d in devices)
+    return report
 
-        finally:
-            conn.disconnect()
 
 if __name__ == "__main__":
     print("Running ESSL functions script")
@@ -135,11 +255,11 @@ if __name__ == "__main__":
         else:
             user_id = sys.argv[2]
             name = sys.argv[3]
-            print(set_user_credentials(user_id, name))
+            print(json.dumps(set_user_credentials(user_id, name)))
     elif func == 'delete_user':
         if len(sys.argv) < 3:
             print("Error: Missing ID")
         else:
             user_id = sys.argv[2]
-            print(delete_user(user_id))
+            print(json.dumps(delete_user(user_id)))
     
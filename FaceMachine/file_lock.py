@@ -0,0 +1,73 @@
+"""Exclusive file locks shared by threads and processes (the spool, device health)."""
+import os
+import threading
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """
+    An exclusive lock on `path` held across threads and processes. The lock
+    file itself is never removed, so every holder locks the same file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def _lock_file(self, blocking):
+        fileno = self._file.fileno()
+        if os.name != "nt":
+            fcntl.flock(fileno, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        self._file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(fileno, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if not blocking:
+                    raise
+                # LK_LOCK gives up after ten seconds; a blocking lock waits on
+                time.sleep(0.05)
+
+    def acquire(self, blocking=True):
+        """Take the lock; with blocking=False returns False instead of waiting."""
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            self._file = open(self.path, "a+b")
+            self._lock_file(blocking)
+        except OSError:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            if blocking:
+                raise
+            return False
+        return True
+
+    def release(self):
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
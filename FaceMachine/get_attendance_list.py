@@ -1,58 +1,339 @@
-from connection import check_log_info
-from connection import db
+import contextlib
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from zk import ZK
+import mysql.connector
 
+from device_health import PORT, DeviceUnavailable, connect_device, record_session_failure
+from connection import log_datetime, log_rows, new_result
+from connection import get_connection
+from spool import get_spool
+from watermark import ensure_watermark_table, load_watermarks, newer_than
 
-def connect_to_device(reason , DEVICE_IP ):
-    PORT = 4370
-    
+POLL_WORKERS = int(os.getenv("FACEMACHINE_POLL_WORKERS", "8"))
 
-    zk = ZK(DEVICE_IP, port=PORT, timeout=5, password=0, force_udp=False, ommit_ping=False)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Device list and watermarks from the last cycle the database answered,
+# so devices are still polled (into the spool) while it is down
+DEVICE_CACHE_PATH = os.getenv("FACEMACHINE_DEVICE_CACHE_PATH", os.path.join(BASE_DIR, "device_cache.json"))
+
+
+def poll_device(ip, last_count=None):
+    """
+    Connect to one device, download its attendance records and re-enable it.
+    Never raises; returns a result dict with status, error, timings and the
+    downloaded records under "logs". When `last_count` matches the device's
+    record count the download is skipped and status is "unchanged"; a
+    device whose circuit is open is not contacted and status is "skipped".
+    """
+    result = {"ip": ip, "status": "ok", "error": None, "records": None,
+              "connect_secs": 0.0, "download_secs": 0.0, "logs": []}
+    started = time.monotonic()
+
+    try:
+        conn = connect_device(ip, PORT)
+    except DeviceUnavailable as e:
+        result["status"] = "skipped"
+        result["error"] = str(e)
+        return result
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"Connection failed: {e}"
+        result["connect_secs"] = round(time.monotonic() - started, 3)
+        return result
+    result["connect_secs"] = round(time.monotonic() - started, 3)
+
+    started = time.monotonic()
     try:
-        conn = zk.connect()
-        print("Connected to device successfully for reason:", reason)
-        return conn
+        if last_count is not None:
+            conn.read_sizes()
+            result["records"] = conn.records
+            if conn.records == last_count:
+                result["status"] = "unchanged"
+                return result
+
+        conn.disable_device()
+        try:
+            result["logs"] = conn.get_attendance() or []
+        finally:
+            conn.enable_device()
+        result["records"] = conn.records
     except Exception as e:
-        print(f"Connection failed: {e}")
-        return False
+        result["status"] = "error"
+        result["error"] = f"Error getting attendance logs: {e}"
+        record_session_failure(ip, e)
+    finally:
+        result["download_secs"] = round(time.monotonic() - started, 3)
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+    return result
+
+
+def poll_devices(ips, last_counts, max_workers=None):
+    """
+    Download every device in `ips` on a thread pool of `max_workers`
+    (FACEMACHINE_POLL_WORKERS by default), yielding poll_device results as
+    they finish. `last_counts` maps an ip to its last known record count.
+    """
+    workers = max(1, min(max_workers or POLL_WORKERS, len(ips)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(poll_device, ip, last_counts.get(ip)) for ip in ips]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def ingest_device_logs(connection, ip, logs, record_count, watermark, date1="", date_range=None, drain=True):
+    """
+    Ingest one device download and advance its watermark.
+
+    `watermark` is the device's (last_timestamp, record_count) pair, or None
+    to ingest every record without touching the watermark table.
+    `date1` and `date_range` filter the records as in ingest_logs. The rows
+    and the new watermark go through the local punch spool, so when the
+    database is unavailable they wait there instead of being downloaded
+    again; `connection` may be None to check one out for the drain, and
+    with `drain` False they are only spooled. When another process was
+    draining the spool, "dates" lists every date this download spooled.
+    Returns the ingest_logs summary, with "spooled" rows and "drained".
+    """
+    filtered = new_result()
+    if watermark is None:
+        rows, new_watermark = log_rows(logs, date1, date_range, filtered), None
+    else:
+        last_timestamp, last_count = watermark
+        # A cleared device starts counting again, so its old watermark is meaningless
+        if last_count is not None and record_count is not None and record_count < last_count:
+            last_timestamp = None
+        rows = log_rows(newer_than(logs, last_timestamp, log_datetime), date1, date_range, filtered)
+        timestamps = [log_datetime(log) for log in logs if log.timestamp]
+        end = date_range[1] if date_range else None
+        if end is not None and any(timestamp.date() > end for timestamp in timestamps):
+            # Records after the range were not ingested: stop the watermark at
+            # the range end and drop the count, so the next poll downloads them
+            timestamps = [timestamp for timestamp in timestamps if timestamp.date() <= end]
+            if last_timestamp is not None:
+                timestamps.append(last_timestamp)
+            record_count = None
+        new_watermark = (max(timestamps, default=last_timestamp), record_count)
+
+    summary = get_spool().store(ip, rows, new_watermark, connection, drain)
+    summary["skipped"] += filtered["skipped"]
+    if drain and not summary["drained"]:
+        # The other drain inserts these rows and reports their dates, so report them here too
+        summary["dates"] = sorted({str(date_value) for _, _, date_value in rows})
+    return summary
+
+
+def load_spool(connection, watermarks=None, drain=True):
+    """
+    Drain punches left in the spool by an earlier cycle (unless `drain` is
+    False), and merge the watermarks still spooled into `watermarks`: those
+    downloads count as acknowledged even if the database has not stored
+    them yet.
+    """
+    spool = get_spool()
+    # Read before draining: `watermarks` was loaded before the drain saved these
+    pending = spool.pending_watermarks()
+    if drain:
+        summary = spool.drain(connection)
+        if summary and (summary["inserted"] or "error" in summary):
+            print(f"Drained punch spool: {summary}")
+    if watermarks is not None:
+        watermarks.update(pending)
+
+
+def save_device_cache(connection, ips, path=DEVICE_CACHE_PATH):
+    """Save `ips` and the stored watermarks for cycles run while the database is down. Never raises."""
+    try:
+        cursor = connection.cursor()
+        try:
+            watermarks = load_watermarks(cursor)
+            connection.commit()
+        finally:
+            cursor.close()
+    except mysql.connector.Error as err:
+        print(f"Device cache not updated: {err}")
+        return
+    data = {
+        "ips": ips,
+        "watermarks": {
+            ip: [None if last_timestamp is None else last_timestamp.isoformat(), record_count]
+            for ip, (last_timestamp, record_count) in watermarks.items()
+        },
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError as err:
+        print(f"Could not write the device cache {path}: {err}")
 
 
+def load_device_cache(path=DEVICE_CACHE_PATH):
+    """(ips, watermarks) saved by the last save_device_cache, or None."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        watermarks = {
+            ip: (None if last_timestamp is None else datetime.datetime.fromisoformat(last_timestamp), record_count)
+            for ip, (last_timestamp, record_count) in data["watermarks"].items()
+        }
+        return list(data["ips"]), watermarks
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError, KeyError) as err:
+        print(f"Ignoring unreadable device cache {path}: {err}")
+        return None
+
 
+def connect_cycle():
+    """A connection for one polling cycle, or None when the database is unavailable."""
+    try:
+        return get_connection()
+    except mysql.connector.Error as err:
+        print(f"Database unavailable, polling into the spool: {err}")
+        return None
 
-def get_attendance_list(date1):
-     
-        connection = db()
+
+def load_devices(connection, use_watermark):
+    """
+    (ips, watermarks, online) for one cycle: the active devices and, with
+    `use_watermark`, their stored watermarks, read through `connection`.
+    When it is None or the reads fail they come from the device cache and
+    `online` is False; returns None if there is no cache either.
+    """
+    if connection is not None:
         cursor = connection.cursor()
-        cursor.execute("SELECT ip_address FROM devices where maintenance = %s",(0,))
-        rows = cursor.fetchall()
-
-  
-        for (ip,) in rows:
-        
-           
-            try :
-                conn = connect_to_device("getting attendance list" , ip)
-                if not conn:
-                    print("connection failed")
-                conn.disable_device()
-                logs = conn.get_attendance()
-                conn.enable_device()
-
-                if not logs:
-                    print("No attendance logs found.")
-                    return
-                
-                else:
-                    for log in logs:
-                        check_log_info(log,date1)
-
-                conn.disconnect()
-
-            except Exception as e:
-                print(f"Error getting attendance logs: {e}")
-            finally:    
-                
-                print("Disconnected from device.") 
-        cursor.close()
-        connection.close()   
\ No newline at end of file
+        try:
+            ensure_watermark_table(cursor)
+            cursor.execute("SELECT ip_address FROM devices where maintenance = %s",(0,))
+            ips = [ip for (ip,) in cursor.fetchall()]
+            watermarks = load_watermarks(cursor) if use_watermark else {}
+            connection.commit()
+            return ips, watermarks, True
+        except mysql.connector.Error as err:
+            print(f"Could not read the devices, polling into the spool: {err}")
+        finally:
+            cursor.close()
+
+    cached = load_device_cache()
+    if cached is None:
+        print("No device cache to poll from while the database is down")
+        return None
+    ips, watermarks = cached
+    return ips, watermarks if use_watermark else {}, False
+
+
+def poll_and_ingest(connection, use_watermark, max_workers=None, date1="", date_range=None):
+    """
+    One polling cycle: load the devices (see load_devices), drain the spool,
+    download every device on a thread pool of `max_workers` and ingest each
+    download as it arrives, filtered by `date1` or `date_range`. With
+    `use_watermark` devices resume from their watermarks, which are
+    advanced. Ingestion stays on the calling thread and reuses `connection`.
+    Returns (results, online), one result dict per device, or None when
+    there are no devices to poll.
+    """
+    devices = load_devices(connection, use_watermark)
+    if devices is None:
+        return None
+    ips, watermarks, online = devices
+    load_spool(connection, watermarks if use_watermark else None, drain=online)
+
+    results = []
+    last_counts = {ip: count for ip, (_, count) in watermarks.items()}
+    for result in poll_devices(ips, last_counts, max_workers):
+        logs = result.pop("logs")
+        result["ingest_secs"] = 0.0
+        result["summary"] = None
+        results.append(result)
+        if result["status"] != "ok" or not logs:
+            continue
+
+        started = time.monotonic()
+        watermark = watermarks.get(result["ip"], (None, None)) if use_watermark else None
+        result["summary"] = ingest_device_logs(
+            connection if online else None, result["ip"], logs, result["records"], watermark,
+            date1, date_range, drain=online
+        )
+        result["ingest_secs"] = round(time.monotonic() - started, 3)
+
+    if online:
+        save_device_cache(connection, ips)
+    return results, online
+
+
+def get_attendance_list(date1, max_workers=None):
+    """
+    Poll every active device concurrently and ingest their records.
+
+    Downloads run on a thread pool of `max_workers` (FACEMACHINE_POLL_WORKERS
+    by default); ingestion and watermark updates stay on the calling thread
+    and reuse one database connection. While the database is down the
+    devices come from the device cache and downloads are only spooled.
+    Returns one result dict per device.
+    """
+    # Watermarks only apply to the regular "today" pulls; an explicit
+    # date always re-reads the device.
+    use_watermark = not date1
+    connection = connect_cycle()
+    with connection if connection is not None else contextlib.nullcontext():
+        cycle = poll_and_ingest(connection, use_watermark, max_workers, date1=date1)
+    return [] if cycle is None else cycle[0]
+
+
+def _as_date(value):
+    if value is None or isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(str(value), "%Y-%m-%d").date()
+
+
+def backfill(start=None, end=None, process=False, max_workers=None):
+    """
+    Ingest every date from `start` to `end` (inclusive, None for an open
+    end) with one download per active device.
+
+    Records are partitioned by date in memory and each device's download is
+    ingested in one pass. Without `start` every device resumes from its
+    watermark, which is then advanced (no further than `end`), and devices
+    whose record count has not changed are not downloaded at all; an
+    explicit `start` re-reads the devices and leaves the watermarks alone.
+    With `process`, reports are rebuilt for exactly the dates that received
+    new punches, or every date a download spooled when another process was
+    draining the spool (after waiting for that drain). While the database
+    is down downloads are only spooled and no reports are rebuilt.
+    Returns {"devices": [...], "dates": [...], "report": ...}.
+    """
+    start, end = _as_date(start), _as_date(end)
+    if start and end and end < start:
+        print(f"Empty date range: {start} to {end}")
+        return None
+
+    connection = connect_cycle()
+    with connection if connection is not None else contextlib.nullcontext():
+        cycle = poll_and_ingest(connection, start is None, max_workers, date_range=(start, end))
+        if cycle is None:
+            return None
+        results, online = cycle
+        summaries = [result["summary"] for result in results if result["summary"]]
+        new_dates = set()
+        for summary in summaries:
+            new_dates.update(summary["dates"])
+        if process and online and not all(summary["drained"] for summary in summaries):
+            # Another process was draining these downloads; wait for it so
+            # the rebuild sees them
+            get_spool().drain(connection, wait=True)
+
+    new_dates = sorted(new_dates)
+    print(f"Backfill from {start or 'watermark'} to {end or 'latest'}: new punches on {new_dates}")
+    report = None
+    if process and new_dates and online:
+        from essl import process_dates
+        report = process_dates(new_dates)
+    return {"devices": results, "dates": new_dates, "report": report}
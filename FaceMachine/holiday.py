@@ -1,10 +1,7 @@
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 import json
 import os , sys
-from datetime import timezone, datetime
+
+from holiday_cache import get_cache
 
 
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
@@ -18,6 +15,12 @@ TOKEN_PATH = os.path.join(BASE_DIR, 'token.json')
 # ---- Helper: Authenticate ----
 def get_credentials():
     """Get valid Google API credentials, refreshing or re-authorizing if needed."""
+    # The Google client libraries take a noticeable share of startup, so they
+    # are only imported once the calendar is actually needed.
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     if os.path.exists(TOKEN_PATH):
         creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
@@ -40,34 +43,46 @@ def get_credentials():
     return creds
 
 
-# ---- Function 1: Get upcoming holidays ----
-def get_holidays(max_results=5):
-    """Fetch the next N upcoming holidays from the calendar."""
-    creds = get_credentials()
+# ---- Calendar fetch (used by the holiday cache) ----
+def fetch_holidays_between(start_date: str, end_date: str):
+    """
+    Fetch every holiday between the given start and end date (YYYY-MM-DD)
+    straight from the calendar. Raises if the calendar cannot be reached.
+    """
+    from googleapiclient.discovery import build
 
-    try:
-        service = build('calendar', 'v3', credentials=creds)
-        now = datetime.now(timezone.utc).isoformat()
+    creds = get_credentials()
+    service = build('calendar', 'v3', credentials=creds)
 
+    holidays = []
+    page_token = None
+    while True:
         events_result = service.events().list(
             calendarId=CALENDAR_ID,
-            timeMin=now,
-            maxResults=max_results,
+            timeMin=f"{start_date}T00:00:00Z",
+            timeMax=f"{end_date}T23:59:59Z",
             singleEvents=True,
-            orderBy='startTime'
+            orderBy='startTime',
+            pageToken=page_token
         ).execute()
 
-        events = events_result.get('items', [])
-        holidays = [
+        holidays.extend(
             {
                 "date": event['start'].get('date'),
                 "summary": event.get('summary', '')
             }
-            for event in events if 'Holiday' in event.get('summary', '')
-        ]
+            for event in events_result.get('items', []) if 'Holiday' in event.get('summary', '')
+        )
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return holidays
 
-        return holidays
 
+# ---- Function 1: Get upcoming holidays ----
+def get_holidays(max_results=5):
+    """Return the next N upcoming holidays, served from the local holiday cache."""
+    try:
+        return get_cache().upcoming(max_results)
     except Exception as e:
         print(f"Error fetching upcoming holidays: {e}")
         return []
@@ -76,32 +91,11 @@ def get_holidays(max_results=5):
 # ---- Function 2: Get holidays between start and end date ----
 def get_holidays_between(start_date: str, end_date: str):
     """
-    Fetch all holidays between the given start and end date (YYYY-MM-DD format).
+    Return all holidays between the given start and end date (YYYY-MM-DD format),
+    served from the local holiday cache.
     """
-    creds = get_credentials()
-
     try:
-        service = build('calendar', 'v3', credentials=creds)
-
-        events_result = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=f"{start_date}T00:00:00Z",
-            timeMax=f"{end_date}T23:59:59Z",
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-
-        events = events_result.get('items', [])
-        holidays = [
-            {
-                "date": event['start'].get('date'),
-                "summary": event.get('summary', '')
-            }
-            for event in events if 'Holiday' in event.get('summary', '')
-        ]
-       
-        return holidays
-
+        return get_cache().between(start_date, end_date)
     except Exception as e:
         print(f"Error fetching holidays between dates: {e}")
         return []
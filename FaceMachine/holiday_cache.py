@@ -0,0 +1,190 @@
+"""
+Local cache of the holiday calendar.
+
+Holidays are fetched for a window of whole years around today and kept
+as {date: summary} in memory and in a JSON snapshot next to this file, so
+membership checks are a set lookup and runs keep working when Google
+Calendar (or the network) is unavailable. Once the snapshot is older than
+HOLIDAY_CACHE_TTL_SECS, callers keep getting the cached answer while one
+background thread refreshes it. The calendar is reached through a
+`source(start_date, end_date)` callable returning [{"date", "summary"}],
+so tests can stand a stub in for the real service.
+"""
+import json
+import os
+import threading
+import time
+from datetime import date as Date, datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATH = os.getenv("HOLIDAY_CACHE_PATH", os.path.join(BASE_DIR, 'holiday_cache.json'))
+TTL_SECS = int(os.getenv("HOLIDAY_CACHE_TTL_SECS", "21600"))
+# Whole years fetched on either side of the current one
+YEARS_AROUND = int(os.getenv("HOLIDAY_CACHE_YEARS", "1"))
+# After a failed fetch, uncovered dates are answered from the cache for this long before retrying
+RETRY_SECS = int(os.getenv("HOLIDAY_CACHE_RETRY_SECS", "300"))
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, Date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def _calendar_source(start_date, end_date):
+    # Imported here so a warm cache never loads the Google client libraries
+    from holiday import fetch_holidays_between
+    return fetch_holidays_between(start_date, end_date)
+
+
+class HolidayCache:
+    def __init__(self, source=_calendar_source, path=SNAPSHOT_PATH, ttl_secs=TTL_SECS, years_around=YEARS_AROUND):
+        self.source = source
+        self.path = path
+        self.ttl_secs = ttl_secs
+        self.years_around = years_around
+        self._lock = threading.Lock()
+        self._refreshing = None
+        self._holidays = {}
+        self._dates = frozenset()
+        self._window = None
+        self._fetched_at = 0
+        self._failed_at = None
+        self._load_snapshot()
+
+    # ---- Snapshot ----
+    def _load_snapshot(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            holidays = {_as_date(day): summary for day, summary in data.get("holidays", {}).items()}
+            window = tuple(_as_date(day) for day in data["window"]) if data.get("window") else None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable holiday snapshot {self.path}: {e}")
+            return
+        self._set(holidays, window, data.get("fetched_at", 0))
+
+    def _save_snapshot(self):
+        if not self.path:
+            return
+        data = {
+            "fetched_at": self._fetched_at,
+            "window": [str(day) for day in self._window] if self._window else None,
+            "holidays": {str(day): summary for day, summary in sorted(self._holidays.items())},
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not write holiday snapshot {self.path}: {e}")
+
+    def _set(self, holidays, window, fetched_at):
+        self._holidays = holidays
+        self._dates = frozenset(holidays)
+        self._window = window
+        self._fetched_at = fetched_at
+
+    # ---- Fetching ----
+    def _default_window(self):
+        year = Date.today().year
+        return Date(year - self.years_around, 1, 1), Date(year + self.years_around, 12, 31)
+
+    def _fetch(self, start, end):
+        """{date: summary} for start..end from the source; raises when it is unreachable."""
+        return {_as_date(h["date"]): h.get("summary", '') for h in self.source(str(start), str(end)) if h.get("date")}
+
+    def refresh(self, start=None, end=None):
+        """
+        Fetch the default window (widened to `start`..`end` when given) and
+        replace the cache. Returns False, keeping the old data, on failure.
+        """
+        window_start, window_end = self._default_window()
+        if start is not None:
+            window_start = min(window_start, _as_date(start))
+        if end is not None:
+            window_end = max(window_end, _as_date(end))
+        try:
+            holidays = self._fetch(window_start, window_end)
+        except Exception as e:
+            print(f"Holiday refresh failed, serving cached holidays: {e}")
+            self._failed_at = time.time()
+            return False
+        self._failed_at = None
+        with self._lock:
+            self._set(holidays, (window_start, window_end), time.time())
+            self._save_snapshot()
+        return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return
+            # Not a daemon: a one-shot script still finishes writing the snapshot
+            self._refreshing = threading.Thread(target=self.refresh, name="holiday-refresh")
+            self._refreshing.start()
+
+    def _ensure(self, start=None, end=None):
+        """Make sure start..end is covered, fetching in the foreground only when it is not."""
+        window = self._window
+        covered = window is not None and (
+            (start is None or window[0] <= start) and (end is None or end <= window[1])
+        )
+        if not covered:
+            if self._failed_at is None or time.time() - self._failed_at > RETRY_SECS:
+                self.refresh(start, end)
+        elif time.time() - self._fetched_at > self.ttl_secs:
+            self._refresh_in_background()
+
+    # ---- Queries ----
+    def dates(self):
+        """Every cached holiday date, as a frozenset of datetime.date."""
+        self._ensure()
+        return self._dates
+
+    def is_holiday(self, day):
+        day = _as_date(day)
+        self._ensure(day, day)
+        return day in self._dates
+
+    def between(self, start_date, end_date):
+        """[{"date": "YYYY-MM-DD", "summary": ...}] for start..end inclusive, in date order."""
+        start, end = _as_date(start_date), _as_date(end_date)
+        self._ensure(start, end)
+        holidays = self._holidays
+        return [{"date": str(day), "summary": holidays[day]} for day in sorted(holidays) if start <= day <= end]
+
+    def upcoming(self, max_results=5):
+        """The next `max_results` holidays from today on."""
+        today = Date.today()
+        self._ensure(today, today)
+        holidays = self._holidays
+        upcoming = sorted(day for day in holidays if day >= today)[:max_results]
+        return [{"date": str(day), "summary": holidays[day]} for day in upcoming]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide HolidayCache, created on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HolidayCache()
+        return _cache
+
+
+def holiday_dates():
+    """Every cached holiday as a set of datetime.date, for `day in holiday_dates()` checks."""
+    try:
+        return get_cache().dates()
+    except Exception as e:
+        print(f"Error loading holiday dates: {e}")
+        return frozenset()
@@ -1,9 +1,15 @@
-from essl import process_logs
-from get_attendance_list import get_attendance_list
+# Subcommands import their code path on first use: 'list' never loads the
+# report engine (NumPy, holiday cache), 'report' never loads the device client.
+#
+#   instant_logs.py report DATE
+#   instant_logs.py list DATE
+#   instant_logs.py backfill START [END] [report]  -> one download per device for the whole range
+#   instant_logs.py backfill watermark [report]    -> everything since each device's watermark
 
 def get_instant_report(date):
     
     try:
+        from essl import process_logs
         result = process_logs(date)
         return f"Instant attendance processed for {date}: {result}"
     except Exception as e:
@@ -13,12 +19,23 @@ def get_instant_report(date):
 def get_instant_list(date):
  
     try:
+        from get_attendance_list import get_attendance_list
         result = get_attendance_list(date)
         return f"Attendance list generated for {date}: {result}"
     except Exception as e:
         return f"Error while generating list for {date}: {str(e)}"
 
 
+def get_instant_backfill(start, end=None, process=False):
+
+    try:
+        from get_attendance_list import backfill
+        result = backfill(None if start == "watermark" else start, end or None, process)
+        return f"Backfill from {start} to {end or 'latest'}: {result}"
+    except Exception as e:
+        return f"Error while backfilling from {start}: {str(e)}"
+
+
 if __name__ == "__main__":
     import sys
 
@@ -34,6 +51,11 @@ if __name__ == "__main__":
         get_instant_report(date)
     elif func_name == "list":
         get_instant_list(date)
+    elif func_name == "backfill":
+        args = sys.argv[3:]
+        process = "report" in args
+        args = [arg for arg in args if arg != "report"]
+        get_instant_backfill(date, args[0] if args else None, process)
     else:
         print(f"Unknown function: {func_name}")
         sys.exit(1)
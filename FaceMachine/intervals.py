@@ -0,0 +1,95 @@
+"""
+Merged exemption windows for one staff-day.
+
+Windows are (start, end) seconds since midnight, closed at both ends.
+Overlapping or touching windows are merged once on construction; after
+that every coverage question is a binary search over the interval starts
+plus a prefix sum of covered seconds, so it costs O(log n).
+"""
+from bisect import bisect_right
+
+
+class IntervalIndex:
+    def __init__(self, windows=()):
+        merged = []
+        for start, end in sorted(w for w in windows if w[0] <= w[1]):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = [start for start, _ in merged]
+        self.ends = [end for _, end in merged]
+        # Covered seconds before each interval starts
+        self._before = []
+        covered = 0
+        for start, end in merged:
+            self._before.append(covered)
+            covered += end - start
+
+    def __bool__(self):
+        return bool(self.starts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return f"IntervalIndex({self.intervals})"
+
+    @property
+    def intervals(self):
+        return list(zip(self.starts, self.ends))
+
+    @property
+    def start(self):
+        return self.starts[0] if self.starts else None
+
+    @property
+    def end(self):
+        return self.ends[-1] if self.ends else None
+
+    def _find(self, t):
+        """Index of the last interval starting at or before `t`, or -1."""
+        return bisect_right(self.starts, t) - 1
+
+    def covers(self, t):
+        """Whether the instant `t` (a punch) falls inside a window."""
+        i = self._find(t)
+        return i >= 0 and t <= self.ends[i]
+
+    def covers_span(self, a, b):
+        """Whether all of a..b (a gap between punches) is exempted."""
+        i = self._find(a)
+        return i >= 0 and b <= self.ends[i]
+
+    def _covered_until(self, t):
+        i = self._find(t)
+        if i < 0:
+            return 0
+        return self._before[i] + min(t, self.ends[i]) - self.starts[i]
+
+    def covered_seconds(self, a, b):
+        """How much of a..b is exempted, in seconds."""
+        if b <= a:
+            return 0
+        return self._covered_until(b) - self._covered_until(a)
+
+    def covered_minutes(self, a, b):
+        """How many minutes of a lateness running from a to b are exempted."""
+        return self.covered_seconds(a, b) / 60
+
+    def apply_to(self, punches):
+        """
+        Apply every window to the punches: a single punch inside a window
+        ends that window at the punch, several are dropped as covered by it.
+        Returns (punches, IntervalIndex) with the windows as applied.
+        """
+        punches = list(punches)
+        windows = []
+        for start, end in zip(self.starts, self.ends):
+            inside = [t for t in punches if start <= t <= end]
+            if len(inside) == 1:
+                end = inside[0]
+            elif len(inside) > 1:
+                punches = [t for t in punches if not start <= t <= end]
+            windows.append((start, end))
+        return punches, IntervalIndex(windows)
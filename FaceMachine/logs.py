@@ -1,30 +1,23 @@
 
-from get_attendance_list import get_attendance_list
-
+import time
 
 
-from zk import ZK
-import schedule
-import time
+def poll_cycle():
+    """One scheduled poll; a failed cycle is reported and the next one still runs."""
+    from get_attendance_list import get_attendance_list
 
-def connect_to_device(reason , DEVICE_IP ):
-    PORT = 4370 
-    zk = ZK(DEVICE_IP, port=PORT, timeout=5, password=0, force_udp=False, ommit_ping=False)
     try:
-        conn = zk.connect()
-        print("Connected to device successfully for reason:", reason)
-        return conn
+        get_attendance_list("")
     except Exception as e:
-        print(f"Connection failed: {e}")
-        return False
-
+        print(f"Polling cycle failed: {e}")
 
 
 def logs_main():
-        
-        get_attendance_list("")
+        import schedule
+
+        poll_cycle()
       
-        schedule.every(10).minutes.do(get_attendance_list,"")
+        schedule.every(10).minutes.do(poll_cycle)
       
 
         while True:
@@ -32,4 +25,11 @@ def logs_main():
             time.sleep(1)
         
 if __name__ == "__main__":
-    logs_main()        
\ No newline at end of file
+    import sys
+
+    # "stream" holds live-capture sessions instead of polling every 10 minutes
+    if len(sys.argv) > 1 and sys.argv[1] == "stream":
+        from stream_logs import stream_main
+        stream_main()
+    else:
+        logs_main()        
\ No newline at end of file
@@ -0,0 +1,54 @@
+from bisect import bisect_left
+
+from attendance_rules import DUPLICATE_SECS, collapse_duplicates
+
+# Punches by one staff member less than this many seconds after the punch
+# the evaluation keeps before them, from any device, are collapsed into it
+# at ingestion. The same FACEMACHINE_DUPLICATE_PUNCH_SECS window the
+# evaluation uses, so what is stored and what is evaluated agree; 0 turns
+# collapsing off and only exact duplicates are dropped.
+DEBOUNCE_SECS = DUPLICATE_SECS
+
+
+def ensure_collapse_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_collapses (
+            staff_id VARCHAR(64) NOT NULL,
+            date DATE NOT NULL,
+            collapsed INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (staff_id, date)
+        )
+        """
+    )
+
+
+def match_punch(stored, t, window=DEBOUNCE_SECS):
+    """
+    How a new punch at `t` relates to the sorted punch seconds `stored`:
+    'duplicate' for an exact repeat, 'collapsed' when collapse_duplicates
+    would drop it (less than `window` seconds after the last punch it keeps
+    before `t`), else None. Stored punches after `t` do not count: an
+    earlier punch that arrives late is stored, and the evaluation keeps it
+    over the later one, as it would have had they arrived in order.
+    """
+    i = bisect_left(stored, t)
+    if i < len(stored) and stored[i] == t:
+        return 'duplicate'
+    if window > 0 and i > 0:
+        previous = collapse_duplicates(stored[:i], window)
+        if t - previous[-1] < window:
+            return 'collapsed'
+    return None
+
+
+def record_collapses(cursor, collapsed):
+    """Add {(staff_id, date): count} to the log_collapses audit counts."""
+    if not collapsed:
+        return
+    cursor.executemany(
+        "INSERT INTO log_collapses (staff_id, date, collapsed) VALUES (%s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE collapsed = collapsed + VALUES(collapsed)",
+        [(staff_id, date_value, count) for (staff_id, date_value), count in sorted(collapsed.items())]
+    )
@@ -0,0 +1,44 @@
+import os
+
+# Rows buffered before an automatic flush, overridable from the FaceMachine .env
+REPORT_FLUSH_SIZE = int(os.getenv("REPORT_FLUSH_SIZE", "500"))
+
+UPSERT_QUERY = (
+    "INSERT INTO report (staff_id, date, late_mins, attendance) VALUES (%s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE late_mins = VALUES(late_mins), attendance = VALUES(attendance)"
+)
+
+
+class ReportWriter:
+    """
+    Buffers computed report rows and writes them with chunked upserts.
+
+    Rows are keyed by (staff_id, date), so a later add() for the same key
+    replaces the earlier one, as the old UPDATE-after-INSERT sequence did.
+    The writer never commits; everything it writes belongs to the caller's
+    transaction.
+    """
+
+    def __init__(self, cursor, flush_size=REPORT_FLUSH_SIZE):
+        self.cursor = cursor
+        self.flush_size = max(1, flush_size)
+        self._pending = {}
+        self.summary = {"queued": 0, "written": 0, "flushes": 0}
+
+    def add(self, staff_id, date, late_mins, attendance):
+        self._pending[(staff_id, str(date))] = (staff_id, date, late_mins, attendance)
+        self.summary["queued"] += 1
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far and return the running summary."""
+        if not self._pending:
+            return self.summary
+        rows = list(self._pending.values())
+        self._pending.clear()
+        for start in range(0, len(rows), self.flush_size):
+            self.cursor.executemany(UPSERT_QUERY, rows[start:start + self.flush_size])
+            self.summary["flushes"] += 1
+        self.summary["written"] += len(rows)
+        return self.summary
@@ -0,0 +1,276 @@
+"""
+Append-only local spool for downloaded punches.
+
+Device downloads are written here and fsynced before they are
+acknowledged, i.e. before the device's watermark moves, and the spool is
+then drained into logs whenever the database is reachable. A database
+outage therefore neither loses punches nor makes the next poll download
+them again: the watermarks still in the spool stand in for the ones in
+device_watermarks until a drain saves them.
+
+One record per line, tab separated:
+
+    P  ip  staff_id  YYYY-MM-DD  HH:MM:SS         a punch
+    W  ip  last_timestamp|-  record_count|-       the device's watermark once the punches before it are stored
+
+A drain first renames the spool aside, so appends carry on into a fresh
+file while it runs. The renamed file is deleted only once its rows and
+watermarks are committed, so a failed or interrupted drain is simply
+retried; ingestion skips punches that are already in logs.
+
+The poller, the live capture and the worker may share one spool, so the
+files are guarded by OS file locks next to it: a short write lock around
+every append, rename, delete and read of pending watermarks, and a drain
+lock held for a whole drain, which other drains skip instead of waiting.
+"""
+import datetime
+import os
+import threading
+
+import mysql.connector
+
+from connection import get_connection, ingest_rows, new_result
+from file_lock import FileLock
+from watermark import ensure_watermark_table, save_watermark
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SPOOL_PATH = os.getenv("FACEMACHINE_SPOOL_PATH", os.path.join(BASE_DIR, "punches.spool"))
+
+
+def _field(value):
+    return "-" if value is None else str(value)
+
+
+def _parse_line(line):
+    """('P', ip, row) or ('W', ip, watermark); raises ValueError for a malformed line."""
+    fields = line.rstrip("\n").split("\t")
+    if fields[0] == "P" and len(fields) == 5:
+        _, ip, staff_id, date_value, time_value = fields
+        return "P", ip, (
+            staff_id,
+            datetime.datetime.strptime(time_value, "%H:%M:%S").time(),
+            datetime.date.fromisoformat(date_value),
+        )
+    if fields[0] == "W" and len(fields) == 4:
+        _, ip, last_timestamp, record_count = fields
+        return "W", ip, (
+            None if last_timestamp == "-" else datetime.datetime.fromisoformat(last_timestamp),
+            None if record_count == "-" else int(record_count),
+        )
+    raise ValueError(f"Unrecognised spool line: {line!r}")
+
+
+def _merge(summary, loaded):
+    """Add one ingest summary into another; returns `summary`."""
+    for key in ("inserted", "duplicate", "collapsed", "unknown_staff", "skipped"):
+        summary[key] += loaded[key]
+    summary["dates"] = sorted(set(summary["dates"]) | set(loaded["dates"]))
+    if "error" in loaded:
+        summary["error"] = loaded["error"]
+    return summary
+
+
+class Spool:
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        self.draining_path = path + ".draining"
+        self._write_lock = FileLock(path + ".lock")
+        self._drain_lock = FileLock(path + ".drain.lock")
+
+    def append(self, ip, rows, watermark=None):
+        """
+        Append (staff_id, time, date) rows from one device, and the
+        (last_timestamp, record_count) watermark they bring it to, with a
+        single fsync for the batch. Returns the number of rows written.
+        """
+        lines = [f"P\t{ip}\t{staff_id}\t{date_value}\t{time_value}\n" for staff_id, time_value, date_value in rows]
+        if watermark is not None:
+            lines.append(f"W\t{ip}\t{_field(watermark[0])}\t{_field(watermark[1])}\n")
+        if not lines:
+            return 0
+        data = "".join(lines).encode("utf-8")
+        with self._write_lock:
+            with open(self.path, "a+b") as spool:
+                # Terminate a line a crash cut short, so this batch does not run into it
+                size = spool.seek(0, os.SEEK_END)
+                if size:
+                    spool.seek(size - 1)
+                    if spool.read(1) != b"\n":
+                        data = b"\n" + data
+                spool.write(data)
+                spool.flush()
+                os.fsync(spool.fileno())
+        return len(rows)
+
+    def _read(self, path):
+        """(rows, {ip: watermark}) from one spool file, skipping lines that cannot be parsed."""
+        rows, watermarks = [], {}
+        try:
+            with open(path, encoding="utf-8") as spool:
+                for line in spool:
+                    if not line.strip():
+                        continue
+                    try:
+                        kind, ip, value = _parse_line(line)
+                    except ValueError as err:
+                        print(f"Skipping spool line: {err}")
+                        continue
+                    if kind == "P":
+                        rows.append(value)
+                    else:
+                        watermarks[ip] = value
+        except FileNotFoundError:
+            pass
+        return rows, watermarks
+
+    def pending_watermarks(self):
+        """{ip: (last_timestamp, record_count)} spooled but not yet saved to device_watermarks."""
+        watermarks = {}
+        with self._write_lock:
+            for path in (self.draining_path, self.path):
+                watermarks.update(self._read(path)[1])
+        return watermarks
+
+    def _rotate(self):
+        """Move the live spool aside unless an earlier drain left one there. Returns whether there is anything to drain."""
+        with self._write_lock:
+            if os.path.exists(self.draining_path):
+                return True
+            try:
+                os.replace(self.path, self.draining_path)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def _discard(self):
+        """
+        Delete the drained file; returns whether it is gone. If it cannot be
+        deleted it is emptied instead, so the next drain does not load it again.
+        """
+        with self._write_lock:
+            try:
+                os.remove(self.draining_path)
+                return True
+            except FileNotFoundError:
+                return True
+            except OSError as err:
+                print(f"Could not delete the drained spool {self.draining_path}: {err}")
+            try:
+                open(self.draining_path, "wb").close()
+            except OSError as err:
+                print(f"Could not empty the drained spool {self.draining_path}: {err}")
+            return False
+
+    def _load(self, connection, rows, watermarks):
+        """Ingest rows, then save watermarks; the summary carries "error" if either failed."""
+        summary = ingest_rows(rows, connection)
+        if "error" in summary or not watermarks:
+            return summary
+        cursor = connection.cursor()
+        try:
+            ensure_watermark_table(cursor)
+            for ip, (last_timestamp, record_count) in watermarks.items():
+                save_watermark(cursor, ip, last_timestamp, record_count)
+            connection.commit()
+        except mysql.connector.Error as err:
+            print(f"Error saving spooled watermarks: {err}")
+            connection.rollback()
+            summary["error"] = str(err)
+        finally:
+            cursor.close()
+        return summary
+
+    def _drain(self, connection):
+        summary = new_result()
+        # A drain left over from a failed run goes first, then whatever was
+        # appended meanwhile, until the live spool is empty
+        while self._rotate():
+            rows, watermarks = self._read(self.draining_path)
+            loaded = self._load(connection, rows, watermarks) if rows or watermarks else new_result()
+            _merge(summary, loaded)
+            if "error" in loaded:
+                break
+            if not self._discard():
+                break
+        return summary
+
+    def drain(self, connection=None, wait=False):
+        """
+        Load everything spooled into logs and save the spooled watermarks,
+        checking a connection out when none is given. Returns the ingest
+        summary, with "error" set if the database was unavailable (the
+        spool is then kept), or None when another thread or process is
+        draining. That drain picks up what was appended before this call;
+        with `wait`, this call waits for it to finish and then drains
+        whatever is left.
+        """
+        summary = None
+        blocking = wait
+        while self._drain_lock.acquire(blocking=blocking):
+            blocking = False
+            try:
+                if connection is not None:
+                    drained = self._drain(connection)
+                else:
+                    with get_connection() as checked_out:
+                        drained = self._drain(checked_out)
+            except mysql.connector.Error as err:
+                print(f"Spool not drained, database unavailable: {err}")
+                drained = dict(new_result(), error=str(err))
+            except OSError as err:
+                print(f"Spool not drained: {err}")
+                drained = dict(new_result(), error=str(err))
+            finally:
+                self._drain_lock.release()
+            summary = drained if summary is None else _merge(summary, drained)
+            # A store that found the lock taken after the last rotate relies
+            # on this drain, so look again now that the lock is free; unless
+            # this drain could not finish, which the next one retries
+            if "error" in summary or os.path.exists(self.draining_path) or not os.path.exists(self.path):
+                break
+        return summary
+
+    def store(self, ip, rows, watermark=None, connection=None, drain=True):
+        """
+        Spool rows from one device and drain the spool, unless `drain` is
+        False (the database is known to be down). If the spool cannot be
+        written the rows and watermark are loaded directly instead.
+        Never raises; returns the drain summary with "spooled" set to the
+        rows written and "drained" False when the drain was skipped or
+        left to another thread or process.
+        """
+        try:
+            spooled = self.append(ip, rows, watermark)
+        except OSError as err:
+            print(f"Could not write to the punch spool {self.path}: {err}; storing directly")
+            try:
+                if connection is not None:
+                    summary = self._load(connection, rows, {ip: watermark} if watermark else {})
+                else:
+                    with get_connection() as connection:
+                        summary = self._load(connection, rows, {ip: watermark} if watermark else {})
+            except mysql.connector.Error as db_err:
+                print(f"Punches from {ip} lost, database unavailable: {db_err}")
+                summary = dict(new_result(), error=str(db_err))
+            return dict(summary, spooled=0, drained=True)
+
+        summary = self.drain(connection) if drain else None
+        drained = summary is not None
+        if summary is None:
+            summary = new_result()
+        summary["spooled"] = spooled
+        summary["drained"] = drained
+        return summary
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """The process-wide Spool, created on first use."""
+    global _spool
+    with _spool_lock:
+        if _spool is None:
+            _spool = Spool()
+        return _spool
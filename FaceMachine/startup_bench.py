@@ -0,0 +1,142 @@
+"""
+Startup benchmark for the FaceMachine entry points.
+
+Each subcommand is replayed up to its first real work (the imports its code
+path performs) in a fresh interpreter under `python -X importtime`. The
+report shows the median wall time from interpreter start, the slowest
+modules, and any module that path should never load. Exits 1 when a
+subcommand imports a forbidden module or goes over STARTUP_BUDGET_MS, so
+it can guard startup latency in CI or before a release.
+
+    python startup_bench.py                 -> every subcommand
+    python startup_bench.py "instant list"  -> just the named ones
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUDGET_MS = int(os.getenv("STARTUP_BUDGET_MS", "800"))
+REPEAT = int(os.getenv("STARTUP_BENCH_REPEAT", "5"))
+TOP_MODULES = 8
+
+GOOGLE = ("google", "googleapiclient", "google_auth_oauthlib", "httplib2")
+
+# name -> (imports made before the first real work, modules that path must not load)
+SUBCOMMANDS = {
+    "instant list": (
+        "import instant_logs; import get_attendance_list",
+        GOOGLE + ("numpy", "essl", "holiday_cache", "schedule"),
+    ),
+    "instant report": (
+        "import instant_logs; import essl",
+        GOOGLE + ("zk", "schedule", "multiprocessing"),
+    ),
+    "essl": (
+        "import essl",
+        GOOGLE + ("zk", "schedule", "multiprocessing"),
+    ),
+    "holiday (warm cache)": (
+        "import holiday",
+        GOOGLE,
+    ),
+    "logs": (
+        "import logs; import schedule; import get_attendance_list",
+        GOOGLE + ("numpy", "essl"),
+    ),
+    "essl_functions": (
+        "import essl_functions",
+        GOOGLE + ("numpy", "essl", "schedule"),
+    ),
+    "device_probe": (
+        "import device_probe",
+        GOOGLE + ("numpy", "essl", "schedule", "zk"),
+    ),
+}
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from `-X importtime` output."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            depth = (len(name) - len(name.lstrip())) // 2
+            modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+        except ValueError:
+            continue
+    return modules
+
+
+def run_once(code):
+    """(wall_ms, modules, error) for one fresh interpreter running `code`."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    error = None
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["exit code %d" % proc.returncode])[-1]
+    return wall_ms, parse_importtime(proc.stderr), error
+
+
+def bench(name, repeat=REPEAT, budget_ms=BUDGET_MS):
+    code, forbidden = SUBCOMMANDS[name]
+    walls, modules, error = [], [], None
+    for _ in range(max(1, repeat)):
+        wall_ms, modules, error = run_once(code)
+        if error:
+            break
+        walls.append(wall_ms)
+
+    loaded = {module for module, *_ in modules}
+    violations = sorted({m.split(".")[0] for m in loaded} & set(forbidden))
+    wall_ms = statistics.median(walls) if walls else None
+    slowest = sorted(
+        ((module, cumulative_us) for module, _, cumulative_us, depth in modules if depth <= 1),
+        key=lambda item: -item[1]
+    )[:TOP_MODULES]
+    return {
+        "name": name,
+        "wall_ms": round(wall_ms, 1) if wall_ms is not None else None,
+        "modules": len(loaded),
+        "slowest": [(module, round(us / 1000, 1)) for module, us in slowest],
+        "forbidden": violations,
+        "error": error,
+        "ok": error is None and not violations and wall_ms <= budget_ms,
+    }
+
+
+def bench_main(names=None):
+    names = names or list(SUBCOMMANDS)
+    unknown = [name for name in names if name not in SUBCOMMANDS]
+    if unknown:
+        print(f"Unknown subcommand(s): {unknown}; choose from {list(SUBCOMMANDS)}")
+        return False
+
+    all_ok = True
+    print(f"Startup budget {BUDGET_MS} ms, median of {REPEAT} runs")
+    for name in names:
+        result = bench(name)
+        all_ok &= result["ok"]
+        status = "ok" if result["ok"] else "FAIL"
+        if result["error"]:
+            print(f"[{status}] {name}: {result['error']}")
+            continue
+        print(f"[{status}] {name}: {result['wall_ms']} ms, {result['modules']} modules")
+        for module, ms in result["slowest"]:
+            print(f"        {ms:8.1f} ms  {module}")
+        if result["forbidden"]:
+            print(f"        forbidden imports: {', '.join(result['forbidden'])}")
+    return all_ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if bench_main(sys.argv[1:]) else 1)
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+
+import mysql.connector
+
+from connection import get_connection, log_rows
+from device_health import connect_device, record_session_failure
+from get_attendance_list import ingest_device_logs
+from spool import get_spool
+from watermark import ensure_watermark_table, load_watermark
+
+# live_capture yields None every CAPTURE_TIMEOUT seconds while idle, which is
+# how the capture loop gets a chance to stop, reconcile or notice a dead link.
+CAPTURE_TIMEOUT = 1
+RECONCILE_MINUTES = int(os.getenv("FACEMACHINE_RECONCILE_MINUTES", "10"))
+# A TCP session that silently died looks exactly like an idle device, so
+# sessions without any event for this long are recycled.
+IDLE_RECONNECT_SECS = int(os.getenv("FACEMACHINE_IDLE_RECONNECT_SECS", "900"))
+BACKOFF_MIN = 1
+BACKOFF_MAX = 300
+DEVICE_REFRESH_SECS = 60
+
+
+def reconcile_device(conn, ip):
+    """
+    Pull the device buffer on an open session and ingest anything newer than
+    its watermark. A watermark still in the spool wins over the stored one;
+    with the database down the pull goes to the spool.
+    """
+    watermark = (None, None)
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            try:
+                ensure_watermark_table(cursor)
+                watermark = load_watermark(cursor, ip)
+                connection.commit()
+            finally:
+                cursor.close()
+    except mysql.connector.Error as err:
+        print(f"Could not read the watermark for {ip}: {err}")
+    watermark = get_spool().pending_watermarks().get(ip, watermark)
+
+    conn.read_sizes()
+    if watermark[1] is not None and conn.records == watermark[1]:
+        return {"unchanged": conn.records}
+
+    conn.disable_device()
+    try:
+        logs = conn.get_attendance() or []
+    finally:
+        conn.enable_device()
+
+    return ingest_device_logs(None, ip, logs, conn.records, watermark)
+
+
+def capture_device(ip, stop_event):
+    """
+    Hold a live-capture session on one device until `stop_event` is set.
+
+    Each punch is spooled and written to logs as it arrives. Every
+    (re)connect and every RECONCILE_MINUTES the session pauses capture for a
+    reconciliation pull, which also covers punches made while the device
+    was unreachable.
+    Failed or dropped sessions are retried with exponential backoff.
+    """
+    backoff = BACKOFF_MIN
+    while not stop_event.is_set():
+        conn = None
+        try:
+            conn = connect_device(ip)
+            print(f"Live capture connected to {ip}")
+            backoff = BACKOFF_MIN
+
+            while not stop_event.is_set():
+                summary = reconcile_device(conn, ip)
+                print(f"Reconciled {ip}: {summary}")
+
+                reconcile_at = time.monotonic() + RECONCILE_MINUTES * 60
+                last_event = time.monotonic()
+                idle = False
+                for attendance in conn.live_capture(new_timeout=CAPTURE_TIMEOUT):
+                    now = time.monotonic()
+                    if attendance is not None:
+                        last_event = now
+                        result = get_spool().store(ip, log_rows([attendance], ""))
+                        if "error" in result:
+                            print(f"Punch from {ip} spooled until the database is back: {attendance}")
+                    elif now - last_event > IDLE_RECONNECT_SECS:
+                        idle = True
+                    # Ending the generator through end_live_capture lets pyzk
+                    # unregister the event and restore the device state.
+                    if stop_event.is_set() or idle or now >= reconcile_at:
+                        conn.end_live_capture = True
+                if idle:
+                    print(f"No events from {ip} for {IDLE_RECONNECT_SECS}s, recycling session")
+                    break
+        except Exception as e:
+            print(f"Live capture on {ip} failed: {e}; retrying in {backoff}s")
+            if conn:
+                record_session_failure(ip, e)
+            stop_event.wait(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX)
+        finally:
+            if conn:
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+
+
+def active_devices():
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT ip_address FROM devices where maintenance = %s", (0,))
+                return {ip for (ip,) in cursor.fetchall()}
+            finally:
+                cursor.close()
+    except Exception as e:
+        print(f"Could not read the device list: {e}")
+        return None
+
+
+def stream_main():
+    """Run one capture thread per active device, following changes to the devices table."""
+    sessions = {}
+    try:
+        while True:
+            ips = active_devices()
+            if ips is not None:
+                for ip in ips - sessions.keys():
+                    stop_event = threading.Event()
+                    thread = threading.Thread(target=capture_device, args=(ip, stop_event), daemon=True, name=f"capture-{ip}")
+                    thread.start()
+                    sessions[ip] = (thread, stop_event)
+                for ip in sessions.keys() - ips:
+                    print(f"Stopping live capture on {ip}")
+                    sessions.pop(ip)[1].set()
+            time.sleep(DEVICE_REFRESH_SECS)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for thread, stop_event in sessions.values():
+            stop_event.set()
+        for thread, stop_event in sessions.values():
+            thread.join(timeout=CAPTURE_TIMEOUT + 5)
+
+
+if __name__ == "__main__":
+    stream_main()
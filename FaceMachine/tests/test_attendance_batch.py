@@ -0,0 +1,63 @@
+import datetime
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from attendance_batch import evaluate_fixed_batch, evaluate_roster
+from attendance_rules import collapse_duplicates, evaluate_day
+from category_rules import compile_categories
+
+
+def fixed_rule(rng):
+    """A fixed category with randomised times around a 9-to-5 day."""
+    def td(seconds):
+        return datetime.timedelta(seconds=seconds)
+
+    start = rng.choice([8 * 3600 + 30 * 60, 9 * 3600])
+    break_in = rng.choice([12 * 3600 + 30 * 60, 12 * 3600 + 40 * 60])
+    break_out = break_in + rng.choice([40, 50, 60]) * 60
+    end = rng.choice([16 * 3600 + 45 * 60, 17 * 3600])
+    in1 = rng.choice([10 * 3600, 10 * 3600 + 30 * 60])
+    out2 = rng.choice([14 * 3600 + 30 * 60, 15 * 3600])
+    row = (1, "fixed", td(start), td(break_in), td(break_out), td(end), 40, "fixed", td(in1), td(out2))
+    return compile_categories([row])[1]
+
+
+def punch_set(rng, rule):
+    """Sorted punches, half of them clustered around the rule's reference times."""
+    n = rng.choice([0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 7, 9, 15])
+    if rng.random() < 0.5:
+        references = [rule.start, rule.break_in, rule.break_out, rule.end, rule.in1, rule.out2, rule.middle]
+        punches = {int(rng.choice(references) + rng.randint(-7200, 7200)) for _ in range(n)}
+    else:
+        # Coarse steps make ties between drop-one candidates common
+        punches = set(rng.sample(range(6 * 3600, 20 * 3600, rng.choice([1, 600, 1800])), n))
+    return collapse_duplicates(sorted(punches))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_matches_evaluate_day(seed):
+    rng = random.Random(seed)
+    for _ in range(40):
+        rule = fixed_rule(rng)
+        day_off = rng.random() < 0.05
+        punch_lists = [punch_set(rng, rule) for _ in range(100)]
+        for punches, result in zip(punch_lists, evaluate_fixed_batch(punch_lists, rule, day_off)):
+            assert result == evaluate_day(punches, rule, (), day_off), punches
+
+
+def test_roster_matches_evaluate_day():
+    rng = random.Random(7)
+    rules = {1: fixed_rule(rng)}
+    roster = []
+    for staff_id in range(500):
+        punches = sorted(rng.sample(range(7 * 3600, 19 * 3600), rng.choice([1, 2, 3, 4, 5, 6, 7])))
+        flagged = set(rng.sample(punches, 1)) if rng.random() < 0.1 else set()
+        # Category 2 has no rule and goes through the scalar path
+        roster.append((staff_id, rng.choice([1, 1, 1, 2]), punches, flagged))
+
+    results = evaluate_roster(roster, rules)
+    for staff_id, category_id, punches, flagged in roster:
+        assert results[staff_id] == evaluate_day(punches, rules.get(category_id), flagged), punches
@@ -0,0 +1,60 @@
+import threading
+
+from device_health import DeviceHealth
+
+IP = "10.0.0.5"
+
+
+def registries(tmp_path, count=2, **kwargs):
+    """Registries on one snapshot, standing in for the worker, the poller and the scripts."""
+    path = str(tmp_path / "device_health.json")
+    return [DeviceHealth(path=path, **kwargs) for _ in range(count)]
+
+
+def test_failure_streaks_add_up_across_processes(tmp_path):
+    worker, poller = registries(tmp_path, failure_threshold=3)
+    worker.record_failure(IP, "timed out")
+    poller.record_failure(IP, "timed out")
+    worker.record_failure(IP, "timed out")
+
+    assert poller.status(IP)["failures"] == 3
+    assert poller.status(IP)["open"]
+    assert not poller.allow(IP)
+
+
+def test_success_elsewhere_closes_the_circuit(tmp_path):
+    worker, poller = registries(tmp_path, failure_threshold=1)
+    worker.record_failure(IP, "timed out")
+    assert poller.status(IP)["open"]
+
+    poller.record_success(IP, 0.2)
+    assert not worker.status(IP)["open"]
+    assert worker.allow(IP)
+
+
+def test_one_probe_is_claimed_across_processes(tmp_path):
+    worker, poller = registries(tmp_path, failure_threshold=1, probe_secs=60)
+    worker.record_failure(IP, "timed out")
+    assert not poller.allow(IP)
+
+    # The probe interval passes: one caller gets the probe, the other keeps skipping
+    with worker._updating():
+        worker._devices[IP]["next_probe"] = 0
+    assert poller.allow(IP)
+    assert not worker.allow(IP)
+
+
+def test_concurrent_updates_are_not_lost(tmp_path):
+    instances = registries(tmp_path, count=4, failure_threshold=1000)
+
+    def fail(registry):
+        for _ in range(25):
+            registry.record_failure(IP, "timed out")
+
+    threads = [threading.Thread(target=fail, args=(registry,)) for registry in instances]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert DeviceHealth(path=str(tmp_path / "device_health.json")).status(IP)["failures"] == 100
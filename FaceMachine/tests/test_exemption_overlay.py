@@ -0,0 +1,131 @@
+import datetime
+import random
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+import category_rules
+import essl
+import exemption
+
+DAYS = [datetime.date(2025, 7, 1), datetime.date(2025, 7, 2), datetime.date(2025, 7, 6)]
+
+
+class FakeCursor:
+    """Answers the queries process_logs and process_exemptions make from in-memory tables."""
+
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query, params=()):
+        query = " ".join(query.split())
+        db = self.db
+        if query.startswith("SELECT * FROM exemptions WHERE exemptionDate"):
+            self.rows = [e for e in db.exemptions if e[5] == params[0]]
+        elif query.startswith("SELECT staff_id, category FROM staff"):
+            self.rows = list(db.staff)
+        elif query.startswith("CHECKSUM TABLE"):
+            self.rows = [("table", 1)]
+        elif query.startswith("SELECT * FROM category"):
+            self.rows = list(db.categories)
+        elif query.startswith("SELECT COUNT(*) FROM exemption_sessions"):
+            self.rows = [(len(exemption.SESSION_TIMES),)]
+        elif query.startswith("SELECT session_key"):
+            self.rows = [(key, times["start"], times["end"]) for key, times in exemption.SESSION_TIMES.items()]
+        elif query.startswith("SELECT logs.staff_id, logs.time"):
+            known = {staff_id for staff_id, _ in db.staff}
+            self.rows = [(s, t) for s, d, t in db.logs if d == params[0] and s in known]
+        elif query.startswith("SELECT staff_id, time FROM attendance_flags"):
+            self.rows = [(s, t) for s, d, t in db.flags if d == params[0]]
+        elif query.startswith(("SELECT staff_id, date, time FROM logs", "SELECT staff_id, date, time FROM attendance_flags")):
+            pairs = set(zip(params[::2], params[1::2]))
+            table = db.logs if " logs " in query else db.flags
+            self.rows = [row for row in table if row[:2] in pairs]
+        elif query.startswith("UPDATE exemptions"):
+            db.marked.update(params)
+        elif not query.startswith("CREATE TABLE"):
+            raise AssertionError(f"Unexpected query: {query}")
+
+    def executemany(self, query, rows):
+        if query.startswith("INSERT INTO report"):
+            for staff_id, date, late_mins, attendance in rows:
+                self.db.report[(staff_id, str(date))] = (late_mins, attendance)
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self, rng):
+        def td(seconds):
+            return datetime.timedelta(seconds=seconds)
+
+        self.categories = [
+            (1, "fixed", td(30600), td(45000), td(47400), td(60300), 40, "fixed", td(36000), td(54000)),
+            (3, "hours", None, None, None, td(28800), 60, "hrs", None, None),
+            (5, "exempt", None, None, None, None, None, "hrs", None, None),
+        ]
+        # Category 9 has no rule, and GHOST has punches but no staff record
+        self.staff = [(f"S{i}", rng.choice([1, 1, 3, 5, 9])) for i in range(120)]
+        self.logs, self.flags, self.exemptions = [], [], []
+        for staff_id in [s for s, _ in self.staff] + ["GHOST"]:
+            for day in DAYS:
+                for punch in sorted(rng.sample(range(8 * 3600, 18 * 3600), rng.choice([0, 1, 2, 3, 4, 5]))):
+                    self.logs.append((staff_id, day, td(punch)))
+                    if rng.random() < 0.05:
+                        self.flags.append((staff_id, day, td(punch)))
+                for _ in range(rng.choice([0, 0, 1, 1, 2])):
+                    start = rng.randint(8 * 3600, 16 * 3600)
+                    end = td(start + rng.randint(600, 7200)) if rng.random() < 0.95 else None
+                    self.exemptions.append((
+                        len(self.exemptions) + 1, rng.choice(["day", "time", "time", "session"]), staff_id, "note",
+                        rng.choice(["1", "2,3", "5,6,7", "4"]), day, "reason", "", td(start), end, "processing", 0,
+                    ))
+        self.report, self.marked = {}, set()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run(monkeypatch, db, two_pass):
+    category_rules.clear_cache()
+    exemption.clear_session_cache()
+    monkeypatch.setattr(essl, "get_connection", lambda: db)
+    monkeypatch.setattr(exemption, "get_connection", lambda: db)
+    monkeypatch.setattr(essl, "holiday_dates", lambda: {DAYS[1]})
+    exemptions = db.exemptions
+    for day in DAYS:
+        if two_pass:
+            # The old flow: the day without exemptions, then process_exemptions rewriting its rows
+            db.exemptions = []
+            essl.process_logs(day)
+            db.exemptions = exemptions
+            exemption.process_exemptions(day)
+        else:
+            essl.process_logs(day)
+    return db.report, db.marked
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_overlay_matches_two_passes(monkeypatch, seed):
+    overlay = run(monkeypatch, FakeDatabase(random.Random(seed)), two_pass=False)
+    two_pass = run(monkeypatch, FakeDatabase(random.Random(seed)), two_pass=True)
+    assert overlay[0] and overlay[1]
+    assert overlay == two_pass
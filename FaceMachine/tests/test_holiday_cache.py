@@ -0,0 +1,89 @@
+from datetime import date
+
+import pytest
+
+from holiday_cache import HolidayCache
+
+
+class StubCalendar:
+    """A source(start_date, end_date) returning fixed holidays, counting calls."""
+
+    def __init__(self, holidays):
+        self.holidays = holidays
+        self.calls = []
+        self.down = False
+
+    def __call__(self, start_date, end_date):
+        self.calls.append((start_date, end_date))
+        if self.down:
+            raise OSError("calendar unreachable")
+        return [{"date": day, "summary": summary} for day, summary in self.holidays.items()
+                if start_date <= day <= end_date]
+
+
+def this_year(month, day):
+    return date(date.today().year, month, day)
+
+
+@pytest.fixture
+def calendar():
+    return StubCalendar({
+        str(this_year(1, 26)): "Republic Day",
+        str(this_year(8, 15)): "Independence Day",
+        str(this_year(12, 25)): "Christmas",
+        str(date(date.today().year - 5, 10, 2)): "Gandhi Jayanti",
+    })
+
+
+def test_lookups_are_served_from_one_fetch(calendar, tmp_path):
+    cache = HolidayCache(source=calendar, path=str(tmp_path / "holidays.json"))
+    assert cache.is_holiday(this_year(1, 26))
+    assert cache.is_holiday(str(this_year(8, 15)))
+    assert not cache.is_holiday(this_year(8, 16))
+    assert this_year(12, 25) in cache.dates()
+    assert len(calendar.calls) == 1
+
+
+def test_stale_cache_refreshes_in_background(calendar, tmp_path):
+    cache = HolidayCache(source=calendar, path=str(tmp_path / "holidays.json"), ttl_secs=0)
+    cache.dates()
+    calendar.holidays[str(this_year(11, 1))] = "Added later"
+
+    # The stale answer is served while the refresh runs
+    assert this_year(11, 1) not in cache.dates()
+    cache._refreshing.join()
+    assert this_year(11, 1) in cache.dates()
+    assert len(calendar.calls) >= 2
+
+
+def test_snapshot_serves_lookups_offline(calendar, tmp_path):
+    path = str(tmp_path / "holidays.json")
+    HolidayCache(source=calendar, path=path).dates()
+
+    calendar.down = True
+    offline = HolidayCache(source=calendar, path=path)
+    assert offline.is_holiday(this_year(1, 26))
+    assert offline.between(this_year(1, 1), this_year(12, 31))[0] == {"date": str(this_year(1, 26)), "summary": "Republic Day"}
+    assert len(calendar.calls) == 1
+
+
+def test_failed_fetch_is_not_retried_at_once(calendar, tmp_path):
+    calendar.down = True
+    cache = HolidayCache(source=calendar, path=str(tmp_path / "holidays.json"))
+    assert cache.dates() == frozenset()
+    assert not cache.is_holiday(this_year(1, 26))
+    assert len(calendar.calls) == 1
+
+
+def test_range_outside_the_window_widens_it(calendar, tmp_path):
+    cache = HolidayCache(source=calendar, path=str(tmp_path / "holidays.json"), years_around=0)
+    old_year = date.today().year - 5
+    assert cache.between(date(old_year, 1, 1), date(old_year, 12, 31)) == [
+        {"date": str(date(old_year, 10, 2)), "summary": "Gandhi Jayanti"}
+    ]
+    assert cache.between(this_year(8, 15), this_year(12, 25)) == [
+        {"date": str(this_year(8, 15)), "summary": "Independence Day"},
+        {"date": str(this_year(12, 25)), "summary": "Christmas"},
+    ]
+    # The widened window already covers the second range
+    assert len(calendar.calls) == 1
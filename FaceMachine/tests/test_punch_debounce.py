@@ -0,0 +1,52 @@
+import random
+from bisect import insort
+
+from attendance_rules import collapse_duplicates
+from punch_debounce import match_punch
+
+
+def ingest(stored, batch, window):
+    """Ingest one batch the way _insert_log_rows does: earliest first, against everything stored."""
+    for t in sorted(batch):
+        if match_punch(stored, t, window) is None:
+            insort(stored, t)
+
+
+def test_late_earlier_punch_is_stored():
+    stored = [9 * 3600 + 30]
+    ingest(stored, [9 * 3600], 60)
+    assert stored == [9 * 3600, 9 * 3600 + 30]
+    assert collapse_duplicates(stored, 60) == [9 * 3600]
+
+
+def test_match_punch_kinds():
+    stored = [100, 200]
+    assert match_punch(stored, 100, 60) == 'duplicate'
+    assert match_punch(stored, 150, 60) == 'collapsed'
+    assert match_punch(stored, 50, 60) is None
+    assert match_punch(stored, 150, 0) is None
+
+
+def test_in_order_arrival_evaluates_like_one_batch():
+    rng = random.Random(3)
+    for _ in range(2000):
+        window = rng.choice([0, 30, 60, 120])
+        punches = sorted(rng.sample(range(8 * 3600, 8 * 3600 + 900), rng.randint(1, 12)))
+        stored = []
+        for i in range(0, len(punches), 3):
+            ingest(stored, punches[i:i + 3], window)
+        assert collapse_duplicates(stored, window) == collapse_duplicates(punches, window), punches
+
+
+def test_first_punch_survives_any_arrival_order():
+    rng = random.Random(4)
+    for _ in range(2000):
+        window = rng.choice([0, 30, 60, 120])
+        punches = rng.sample(range(8 * 3600, 8 * 3600 + 900), rng.randint(1, 12))
+        stored = []
+        # Devices deliver their batches in any order
+        batches = [punches[i::3] for i in range(3)]
+        rng.shuffle(batches)
+        for batch in batches:
+            ingest(stored, batch, window)
+        assert collapse_duplicates(stored, window)[0] == min(punches), (punches, batches)
@@ -0,0 +1,259 @@
+import datetime
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+mysql_connector = pytest.importorskip("mysql.connector")
+
+import essl
+import get_attendance_list
+import spool
+from connection import new_result
+from spool import Spool
+
+DAY = datetime.date(2025, 7, 1)
+
+
+def punches(staff_ids, hour=9):
+    return [(staff_id, datetime.time(hour, minute), DAY) for minute, staff_id in enumerate(staff_ids)]
+
+
+def watermark(hour, count):
+    return datetime.datetime(2025, 7, 1, hour, 0), count
+
+
+class FakeDatabase:
+    """logs and device_watermarks in memory; ingestion skips rows already stored, as INSERT IGNORE does."""
+
+    def __init__(self):
+        self.logs = []
+        self.watermarks = {}
+        self.down = False
+        self.fail_after = None
+        self.during_ingest = None
+
+    def ingest_rows(self, rows, connection=None, result=None):
+        result = result if result is not None else new_result()
+        hook, self.during_ingest = self.during_ingest, None
+        if hook:
+            hook()
+        for row in rows:
+            if self.fail_after is not None and len(self.logs) >= self.fail_after:
+                result["error"] = "Lost connection to MySQL server"
+                return result
+            if row in self.logs:
+                result["duplicate"] += 1
+            else:
+                self.logs.append(row)
+                result["inserted"] += 1
+                result["dates"] = sorted(set(result["dates"]) | {str(row[2])})
+        return result
+
+    def save_watermark(self, cursor, ip, last_timestamp, record_count):
+        self.watermarks[ip] = (last_timestamp, record_count)
+
+    def connect(self):
+        if self.down:
+            raise mysql_connector.Error("Can't connect to MySQL server")
+        return FakeConnection()
+
+
+class FakeConnection:
+    def cursor(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(spool, "ingest_rows", db.ingest_rows)
+    monkeypatch.setattr(spool, "save_watermark", db.save_watermark)
+    monkeypatch.setattr(spool, "ensure_watermark_table", lambda cursor: None)
+    monkeypatch.setattr(spool, "get_connection", db.connect)
+    return db
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "punches.spool")
+
+
+def test_interrupted_drain_is_retried_without_duplicates(db, path):
+    store = Spool(path)
+    rows = punches(["S1", "S2", "S3", "S4"])
+    db.fail_after = 2
+    summary = store.store("a", rows, watermark(9, 4))
+    assert summary["error"] and summary["inserted"] == 2
+    # Nothing is saved past the failure and the batch waits in the drained file
+    assert db.watermarks == {}
+    assert os.path.exists(store.draining_path)
+
+    db.fail_after = None
+    summary = store.drain()
+    assert summary["inserted"] == 2 and summary["duplicate"] == 2
+    assert sorted(db.logs) == sorted(rows)
+    assert db.watermarks == {"a": watermark(9, 4)}
+    assert not os.path.exists(store.draining_path) and not os.path.exists(path)
+
+
+def test_drain_killed_before_discard_is_retried_without_duplicates(db, path, monkeypatch):
+    store = Spool(path)
+    rows = punches(["S1", "S2"])
+    store.append("a", rows, watermark(9, 2))
+
+    def crash():
+        raise KeyboardInterrupt
+    monkeypatch.setattr(store, "_discard", crash)
+    with pytest.raises(KeyboardInterrupt):
+        store.drain()
+
+    # The next process finds the committed batch still on disk and loads it again
+    summary = Spool(path).drain()
+    assert summary["inserted"] == 0 and summary["duplicate"] == 2
+    assert sorted(db.logs) == sorted(rows)
+    assert not os.path.exists(store.draining_path)
+
+
+@pytest.mark.parametrize("when", ["ingest", "last_rotate"])
+def test_appends_during_a_drain_are_not_stranded(db, path, monkeypatch, when):
+    poller, live_capture = Spool(path), Spool(path)
+    late = punches(["S9"], hour=10)
+    late_summary = {}
+
+    # The live capture stores while the poller's drain holds the lock
+    def capture():
+        late_summary.update(live_capture.store("b", late, watermark(10, 7)))
+    if when == "ingest":
+        db.during_ingest = capture
+    else:
+        # After the drain found the live spool empty, before it lets go of the lock
+        rotate = poller._rotate
+
+        def rotate_then_capture():
+            moved = rotate()
+            if not moved and not late_summary:
+                capture()
+            return moved
+        monkeypatch.setattr(poller, "_rotate", rotate_then_capture)
+
+    summary = poller.store("a", punches(["S1", "S2"]), watermark(9, 2))
+    assert late_summary["spooled"] == 1 and late_summary["inserted"] == 0
+    assert summary["inserted"] == 3
+    assert sorted(db.logs) == sorted(punches(["S1", "S2"]) + late)
+    assert db.watermarks == {"a": watermark(9, 2), "b": watermark(10, 7)}
+    assert not os.path.exists(path) and not os.path.exists(poller.draining_path)
+
+
+def test_second_process_skips_a_drain_in_progress(db, path):
+    store, other = Spool(path), Spool(path)
+    store.append("a", punches(["S1"]), watermark(9, 1))
+    with store._drain_lock:
+        assert other.drain() is None
+        summary = other.store("a", punches(["S2"]), watermark(9, 2))
+    assert summary["spooled"] == 1 and summary["inserted"] == 0
+    assert db.logs == []
+    assert other.pending_watermarks() == {"a": watermark(9, 2)}
+
+    assert store.drain()["inserted"] == 2
+
+
+def test_torn_tail_line_is_skipped(db, path):
+    with open(path, "wb") as f:
+        f.write(b"P\ta\tS1\t2025-07-01\t09:0")
+    store = Spool(path)
+    store.append("a", punches(["S2"]), watermark(9, 2))
+
+    rows, watermarks = store._read(path)
+    assert rows == punches(["S2"])
+    assert watermarks == {"a": watermark(9, 2)}
+    assert store.drain()["inserted"] == 1
+
+
+def test_store_keeps_punches_while_the_database_is_down(db, path):
+    store = Spool(path)
+    db.down = True
+    summary = store.store("a", punches(["S1", "S2"]), watermark(9, 2))
+    assert summary["spooled"] == 2 and "error" in summary
+    summary = store.store("a", punches(["S3"], hour=10), watermark(10, 3), drain=False)
+    assert summary["spooled"] == 1 and "error" not in summary
+    assert store.pending_watermarks() == {"a": watermark(10, 3)}
+
+    db.down = False
+    assert store.drain()["inserted"] == 3
+    assert db.watermarks == {"a": watermark(10, 3)}
+    assert store.pending_watermarks() == {}
+
+
+def test_undeletable_drained_file_is_emptied(db, path, monkeypatch):
+    store = Spool(path)
+    store.append("a", punches(["S1"]), watermark(9, 1))
+
+    remove = os.remove
+    refusing = [True]
+
+    def refuse(target):
+        if refusing[0]:
+            raise PermissionError(13, "Permission denied", target)
+        remove(target)
+    monkeypatch.setattr(spool.os, "remove", refuse)
+    assert store.drain()["inserted"] == 1
+    assert os.path.getsize(store.draining_path) == 0
+
+    refusing[0] = False
+    summary = store.drain()
+    assert summary["inserted"] == 0 and summary["duplicate"] == 0
+    assert not os.path.exists(store.draining_path)
+
+
+def test_spooled_watermarks_override_stored_ones(db, path, monkeypatch):
+    store = Spool(path)
+    store.append("a", punches(["S1"]), watermark(9, 1))
+    store._rotate()
+    store.append("a", punches(["S2"]), watermark(10, 2))
+    monkeypatch.setattr(get_attendance_list, "get_spool", lambda: store)
+
+    watermarks = {"a": watermark(8, 0), "b": watermark(8, 5)}
+    get_attendance_list.load_spool(None, watermarks, drain=False)
+    assert watermarks == {"a": watermark(10, 2), "b": watermark(8, 5)}
+
+
+def test_backfill_waits_for_another_drain_before_rebuilding(db, path, monkeypatch):
+    store, other = Spool(path), Spool(path)
+    download = [SimpleNamespace(user_id="S1", timestamp=datetime.datetime(2025, 7, 1, 9, 0)),
+                SimpleNamespace(user_id="S2", timestamp=datetime.datetime(2025, 7, 2, 9, 5))]
+    rebuilt = []
+    monkeypatch.setattr(get_attendance_list, "get_spool", lambda: store)
+    monkeypatch.setattr(get_attendance_list, "connect_cycle", FakeConnection)
+    monkeypatch.setattr(get_attendance_list, "load_devices", lambda connection, use_watermark: (["a"], {}, True))
+    monkeypatch.setattr(get_attendance_list, "save_device_cache", lambda connection, ips: None)
+    monkeypatch.setattr(get_attendance_list, "poll_devices", lambda ips, last_counts, max_workers: iter([
+        {"ip": "a", "status": "ok", "error": None, "records": 2, "logs": download},
+    ]))
+    monkeypatch.setattr(essl, "process_dates", lambda dates: rebuilt.append((dates, list(db.logs))))
+
+    # Another process is draining when the backfill stores its download
+    other._drain_lock.acquire()
+    threading.Timer(0.2, other._drain_lock.release).start()
+    summary = get_attendance_list.backfill("2025-07-01", "2025-07-02", process=True)
+
+    assert summary["dates"] == ["2025-07-01", "2025-07-02"]
+    dates, logs = rebuilt[0]
+    assert dates == ["2025-07-01", "2025-07-02"]
+    assert len(logs) == 2
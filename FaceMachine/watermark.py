@@ -0,0 +1,47 @@
+def ensure_watermark_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS device_watermarks (
+            ip_address VARCHAR(64) NOT NULL PRIMARY KEY,
+            last_timestamp DATETIME NULL,
+            record_count INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def load_watermark(cursor, ip):
+    """Return (last_timestamp, record_count) for a device, or (None, None) if never pulled."""
+    cursor.execute(
+        "SELECT last_timestamp, record_count FROM device_watermarks WHERE ip_address = %s",
+        (ip,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None, None
+    return row[0], row[1]
+
+
+def load_watermarks(cursor):
+    """Return {ip: (last_timestamp, record_count)} for every device pulled so far."""
+    cursor.execute("SELECT ip_address, last_timestamp, record_count FROM device_watermarks")
+    return {ip: (last_timestamp, record_count) for ip, last_timestamp, record_count in cursor.fetchall()}
+
+
+def save_watermark(cursor, ip, last_timestamp, record_count):
+    cursor.execute(
+        "INSERT INTO device_watermarks (ip_address, last_timestamp, record_count) VALUES (%s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE last_timestamp = %s, record_count = %s",
+        (ip, last_timestamp, record_count, last_timestamp, record_count)
+    )
+
+
+def newer_than(logs, last_timestamp, log_datetime):
+    """
+    Records at or after the watermark. Punches sharing the watermark second
+    are kept so ingestion can dedupe them instead of dropping a late arrival.
+    """
+    if last_timestamp is None:
+        return list(logs)
+    return [log for log in logs if log.timestamp and log_datetime(log) >= last_timestamp]
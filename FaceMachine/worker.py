@@ -0,0 +1,126 @@
+import importlib
+import json
+import os
+import sys
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+except ImportError:
+    pass
+
+WORKER_HOST = os.getenv("WORKER_HOST", "127.0.0.1")
+WORKER_PORT = int(os.getenv("WORKER_PORT", "5055"))
+
+# Function name -> (module, attribute). Modules are imported on first use and
+# then stay loaded, so the zk / Google client imports and the connection pool
+# are paid for once per worker instead of once per request.
+FUNCTIONS = {
+    "get_instant_report": ("instant_logs", "get_instant_report"),
+    "get_instant_list": ("instant_logs", "get_instant_list"),
+    "get_instant_backfill": ("instant_logs", "get_instant_backfill"),
+    "set_user_credentials": ("essl_functions", "set_user_credentials"),
+    "delete_user": ("essl_functions", "delete_user"),
+    "probe_devices": ("device_probe", "probe_devices"),
+    "get_holidays_between": ("holiday", "get_holidays_between"),
+    "process_dirty": ("essl", "process_dirty"),
+}
+
+# One lock per function: the same job never runs twice at once (two report
+# runs for one date would race on the report table), different jobs can.
+_locks = {name: threading.Lock() for name in FUNCTIONS}
+
+
+def resolve(name):
+    module_name, attr = FUNCTIONS[name]
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def call(name, args):
+    func = resolve(name)
+    with _locks[name]:
+        return func(*args)
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    """
+    JSON interface for the Node backend:
+
+        POST /call  {"function": "get_instant_list", "args": ["2025-07-01"]}
+        GET  /health
+    """
+
+    def _send(self, code, body):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok", "functions": sorted(FUNCTIONS)})
+        else:
+            self._send(404, {"status": "error", "message": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/call":
+            self._send(404, {"status": "error", "message": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send(400, {"status": "error", "message": "Invalid JSON"})
+            return
+
+        name = request.get("function")
+        args = request.get("args") or []
+        if name not in FUNCTIONS:
+            self._send(400, {"status": "error", "message": f"Unknown function: {name}"})
+            return
+        if not isinstance(args, list):
+            self._send(400, {"status": "error", "message": "args must be a list"})
+            return
+
+        try:
+            result = call(name, args)
+        except Exception as e:
+            traceback.print_exc()
+            self._send(500, {"status": "error", "message": str(e)})
+            return
+        self._send(200, {"status": "ok", "result": result})
+
+    def log_message(self, format, *args):
+        print(f"Worker: {self.address_string()} {format % args}")
+
+
+def warm_up():
+    """Import every module up front so the first request does not pay for it."""
+    for module_name in sorted({module_name for module_name, _ in FUNCTIONS.values()}):
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            print(f"Worker: could not preload {module_name}: {e}")
+
+
+def worker_main(host=WORKER_HOST, port=WORKER_PORT):
+    warm_up()
+    server = ThreadingHTTPServer((host, port), WorkerHandler)
+    server.daemon_threads = True
+    print(f"FaceMachine worker listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else WORKER_PORT
+    worker_main(port=port)
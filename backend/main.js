@@ -10,7 +10,7 @@ const { verifyToken, authorizeRoles } = require('./middleware/authMiddleware');
 const passport = require('passport');
 require('dotenv').config();
 const app = express();
-const { startPythonScript } = require('./server');
+const { startPythonScript, startPythonWorker, stopPythonWorker } = require('./server');
 const PORT = 5050;
 const corsOptions = {
   origin: ['http://10.10.33.251:8000', 'http://localhost:8000', 'http://localhost:3001', 'http://bio.psgitech.ac.in:8000', 'http://bio.psgitech.ac.in', "http://bio.psgitech.ac.in:8000/", 'http://10.10.33.251:3000', 'http://localhost:3000'],
@@ -20,6 +20,7 @@ const corsOptions = {
 };
 
 const pythonProcess = startPythonScript();
+startPythonWorker();
 
 app.use(cors(corsOptions));
 app.use(express.json());
@@ -51,6 +52,7 @@ passport.deserializeUser((user, done) => {
 process.on('SIGINT', () => {
   console.log('Shutting down Node.js server...');
   pythonProcess.kill(); // Terminate Python process
+  stopPythonWorker();
   process.exit();
 });
 
@@ -0,0 +1,51 @@
+const http = require('http');
+require('dotenv').config();
+
+const WORKER_HOST = process.env.WORKER_HOST || '127.0.0.1';
+const WORKER_PORT = Number(process.env.WORKER_PORT || 5055);
+
+// Errors that mean the worker is not running, as opposed to a failed call.
+// ECONNRESET is left out: the worker may have died after starting the call,
+// and running it again as a script could repeat a non-idempotent job.
+const UNREACHABLE = new Set(['ECONNREFUSED', 'EHOSTUNREACH']);
+
+// Call a function on the long-lived FaceMachine worker (FaceMachine/worker.py)
+function callWorker(func, args = []) {
+  const body = JSON.stringify({ function: func, args });
+  return new Promise((resolve, reject) => {
+    const req = http.request({
+      host: WORKER_HOST,
+      port: WORKER_PORT,
+      path: '/call',
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(body) }
+    }, (res) => {
+      let data = '';
+      res.on('data', (chunk) => { data += chunk; });
+      res.on('end', () => {
+        try {
+          const parsed = JSON.parse(data);
+          if (parsed.status === 'ok') return resolve(parsed.result);
+          reject(new Error(parsed.message || 'Worker call failed'));
+        } catch {
+          reject(new Error(`Invalid JSON from worker: ${data}`));
+        }
+      });
+    });
+    req.on('error', reject);
+    req.end(body);
+  });
+}
+
+// Use the worker, and only spawn a one-off Python process when it is down
+async function callWorkerOr(func, args, fallback) {
+  try {
+    return await callWorker(func, args);
+  } catch (err) {
+    if (!UNREACHABLE.has(err.code)) throw err;
+    console.error(`Python worker unreachable (${err.code}), running ${func} as a script`);
+    return fallback();
+  }
+}
+
+module.exports = { callWorker, callWorkerOr };
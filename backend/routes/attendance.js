@@ -2,6 +2,7 @@ const express = require('express');
 const router = express.Router();
 const db = require('../db');
 const { exec } = require('child_process');
+const { callWorkerOr } = require('../pythonWorker');
 
 const scriptPath = process.env.PYTHON_SCRIPT_PATH3;
 const pythonPath = process.env.PYTHON_PATH_VENV;
@@ -1259,7 +1260,7 @@ router.post('/get_holiday_list', async (req, res) => {
       [start_date, end_date]
     );
 
-    const googleHolidays = await runPythonWithDates(start_date, end_date);
+    const googleHolidays = await callWorkerOr('get_holidays_between', [start_date, end_date], () => runPythonWithDates(start_date, end_date));
    
     const allHolidays = [
       ...dbRows.map(h => ({ date: h.date, reason: h.reason })),
@@ -3,10 +3,11 @@ const router = express.Router();
 const db = require('../db');
 const password = require('./passWord');
 const { exec } = require('child_process');
+const { callWorkerOr } = require('../pythonWorker');
 require('dotenv').config();
 const scriptPath = process.env.PYTHON_SCRIPT_PATH;
 
-function runPythonScript(args) {
+function runPythonProcess(args) {
   const pythonPath = process.env.PYTHON_PATH_VENV; // Update to your venv path
   return new Promise((resolve, reject) => {
     exec(`"${pythonPath}" "${scriptPath}" ${args.join(' ')}`, (error, stdout, stderr) => {
@@ -18,6 +19,12 @@ function runPythonScript(args) {
   });
 }
 
+// essl_functions.py through the worker; args are [function, ...arguments] as for the script
+function runPythonScript(args) {
+  const [func, ...rest] = args;
+  return callWorkerOr(func, rest, () => runPythonProcess(args));
+}
+
 
 
 
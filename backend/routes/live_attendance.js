@@ -1,6 +1,7 @@
 const express = require("express");
 const router = express.Router();
 const { exec } = require("child_process");
+const { callWorkerOr } = require("../pythonWorker");
 
 const scriptPath = process.env.PYTHON_SCRIPT_PATH2;
 const pythonPath = process.env.PYTHON_PATH_VENV;
@@ -18,6 +19,9 @@ function runPythonFunction(funcName, args = []) {
   });
 }
 
+// instant_logs.py CLI names -> worker function names
+const WORKER_FUNCTIONS = { report: "get_instant_report", list: "get_instant_list" };
+
 // POST /instant_logs
 router.post("/instant", async (req, res) => {
   const { date, type } = req.body;
@@ -26,9 +30,10 @@ router.post("/instant", async (req, res) => {
   }
 
   try {
-    const result = await runPythonFunction(
-      type,
-      [date]
+    const result = await callWorkerOr(
+      WORKER_FUNCTIONS[type] || type,
+      [date],
+      () => runPythonFunction(type, [date])
     );
     res.json({ status: "success", result });
   } catch (err) {
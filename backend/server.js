@@ -31,5 +31,51 @@ function startPythonScript() {
     return pythonProcess;
 }
 
-// Export the function to start the Python script
-module.exports = { startPythonScript };
\ No newline at end of file
+const workerPath = process.env.PYTHON_WORKER_PATH;
+// The running worker, replaced on every restart, and whether shutdown has begun
+let currentWorker = null;
+let workerStopping = false;
+
+// Long-lived FaceMachine worker the routes call instead of spawning Python per request
+function startPythonWorker() {
+    if (!workerPath) {
+        console.log('PYTHON_WORKER_PATH not set, routes will spawn Python per request');
+        return null;
+    }
+    if (workerStopping) return null;
+    const workerProcess = spawn(process.env.PYTHON_PATH_VENV, [workerPath]);
+    currentWorker = workerProcess;
+
+    workerProcess.on('error', (err) => {
+        console.error('Failed to start Python worker:', err);
+    });
+
+    workerProcess.stdout.on('data', (data) => {
+        console.log(`Python worker: ${data}`);
+    });
+
+    workerProcess.stderr.on('data', (data) => {
+        console.error(`Python worker Error: ${data}`);
+    });
+
+    workerProcess.on('close', (code) => {
+        if (currentWorker === workerProcess) currentWorker = null;
+        if (workerStopping || workerProcess.killed) return;
+        console.log(`Python worker exited with code ${code}, restarting...`);
+        setTimeout(startPythonWorker, 1000);
+    });
+
+    return workerProcess;
+}
+
+// Stop the current worker, whichever restart it is, and keep it from being restarted
+function stopPythonWorker() {
+    workerStopping = true;
+    if (currentWorker) {
+        currentWorker.kill();
+        currentWorker = null;
+    }
+}
+
+// Export the functions to start the Python processes
+module.exports = { startPythonScript, startPythonWorker, stopPythonWorker };